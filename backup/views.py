@@ -8,6 +8,7 @@ from django.contrib.auth.decorators import login_required
 import os
 import json
 import openai
+from instrumentos.ai_populate import popular_uma_chamada
 
 # Create your views here.
 
@@ -464,109 +465,15 @@ def ai_populate(request):
             if not api_key:
                 raise ValueError("API key não encontrada")
 
-            client = openai.OpenAI(api_key=api_key)
-            
-            # Construir o prompt baseado nas tabelas selecionadas
-            prompt_parts = []
-            if 'categorias' in selected_tables:
-                prompt_parts.append("1. 10 categorias de instrumentos (nome e descrição)")
-            if 'marcas' in selected_tables:
-                prompt_parts.append("2. 20 marcas famosas (nome, país de origem e website)")
-            if 'modelos' in selected_tables:
-                prompt_parts.append("3. 30 modelos populares (nome e descrição)")
-            
-            prompt = "Gere uma lista em formato JSON com dados de instrumentos musicais contendo:\n"
-            prompt += "\n".join(prompt_parts)
-            prompt += "\n\nFormato:\n{"
-            
-            if 'categorias' in selected_tables:
-                prompt += '\n    "categorias": [{"nome": "", "descricao": ""}],'
-            if 'marcas' in selected_tables:
-                prompt += '\n    "marcas": [{"nome": "", "pais_origem": "", "website": ""}],'
-            if 'modelos' in selected_tables:
-                prompt += '\n    "modelos": [{"nome": "", "descricao": ""}],'
-            
-            prompt = prompt.rstrip(',') + "\n}"
-            
-            # Fazer a chamada para a API
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Você é um especialista em instrumentos musicais."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Processar a resposta
-            data = json.loads(response.choices[0].message.content)
-            
-            # Criar os registros
-            created_counts = {}
-            skipped_counts = {}
-            
-            if 'categorias' in selected_tables and 'categorias' in data:
-                count_created = 0
-                count_skipped = 0
-                for cat in data['categorias']:
-                    try:
-                        _, created = Categoria.objects.get_or_create(
-                            nome=cat['nome'],
-                            defaults={'descricao': cat['descricao']}
-                        )
-                        if created:
-                            count_created += 1
-                        else:
-                            count_skipped += 1
-                    except Exception as e:
-                        count_skipped += 1
-                created_counts['categorias'] = count_created
-                skipped_counts['categorias'] = count_skipped
-            
-            if 'marcas' in selected_tables and 'marcas' in data:
-                count_created = 0
-                count_skipped = 0
-                for marca in data['marcas']:
-                    try:
-                        _, created = Marca.objects.get_or_create(
-                            nome=marca['nome'],
-                            defaults={
-                                'pais_origem': marca['pais_origem'],
-                                'website': marca['website']
-                            }
-                        )
-                        if created:
-                            count_created += 1
-                        else:
-                            count_skipped += 1
-                    except Exception as e:
-                        count_skipped += 1
-                created_counts['marcas'] = count_created
-                skipped_counts['marcas'] = count_skipped
-            
-            if 'modelos' in selected_tables and 'modelos' in data:
-                count_created = 0
-                count_skipped = 0
-                for modelo in data['modelos']:
-                    try:
-                        _, created = Modelo.objects.get_or_create(
-                            nome=modelo['nome'],
-                            defaults={'descricao': modelo['descricao']}
-                        )
-                        if created:
-                            count_created += 1
-                        else:
-                            count_skipped += 1
-                    except Exception as e:
-                        count_skipped += 1
-                created_counts['modelos'] = count_created
-                skipped_counts['modelos'] = count_skipped
+            # Uma chamada para todas as tabelas; as linhas novas são gravadas em lote
+            contagens = popular_uma_chamada(selected_tables)
             
             # Criar mensagem de sucesso com detalhes
             success_msg = "Dados gerados com sucesso!\n"
-            for table in created_counts.keys():
-                success_msg += f"\n- {table.title()}: {created_counts[table]} criados"
-                if skipped_counts[table] > 0:
-                    success_msg += f" ({skipped_counts[table]} ignorados por já existirem)"
+            for table, (criados, ignorados) in contagens.items():
+                success_msg += f"\n- {table.title()}: {criados} criados"
+                if ignorados > 0:
+                    success_msg += f" ({ignorados} ignorados por já existirem)"
             
             messages.success(request, success_msg)
             
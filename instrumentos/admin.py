@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento, GeracaoIA, EtapaGeracaoIA
+from . import taxonomia
 
 # Register your models here.
 
+class FiltroTaxonomia(admin.RelatedFieldListFilter):
+    """Filtro por categoria, subcategoria, marca ou modelo com as opções da taxonomia em memória"""
+    def field_choices(self, field, request, model_admin):
+        return taxonomia.escolhas(field.related_model._meta.model_name, vazio=None)
+
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
     list_display = ['nome', 'descricao']
@@ -11,7 +17,7 @@ class CategoriaAdmin(admin.ModelAdmin):
 @admin.register(SubCategoria)
 class SubCategoriaAdmin(admin.ModelAdmin):
     list_display = ['nome', 'categoria', 'descricao']
-    list_filter = ['categoria']
+    list_filter = [('categoria', FiltroTaxonomia)]
     search_fields = ['nome']
 
 @admin.register(Marca)
@@ -22,7 +28,7 @@ class MarcaAdmin(admin.ModelAdmin):
 @admin.register(Modelo)
 class ModeloAdmin(admin.ModelAdmin):
     list_display = ['nome', 'marca', 'subcategoria']
-    list_filter = ['marca', 'subcategoria']
+    list_filter = [('marca', FiltroTaxonomia), ('subcategoria', FiltroTaxonomia)]
     search_fields = ['nome']
 
 class FotoInstrumentoInline(admin.TabularInline):
@@ -32,7 +38,7 @@ class FotoInstrumentoInline(admin.TabularInline):
 @admin.register(Instrumento)
 class InstrumentoAdmin(admin.ModelAdmin):
     list_display = ['nome', 'marca', 'modelo', 'preco', 'status', 'data_aquisicao']
-    list_filter = ['status', 'estado', 'marca', 'categoria']
+    list_filter = ['status', 'estado', ('marca', FiltroTaxonomia), ('categoria', FiltroTaxonomia)]
     search_fields = ['nome', 'numero_serie', 'descricao']
     readonly_fields = ['created_at', 'updated_at']
     inlines = [FotoInstrumentoInline]
@@ -63,3 +69,15 @@ class FotoInstrumentoAdmin(admin.ModelAdmin):
         form = super().get_form(request, obj, **kwargs)
         form.base_fields['created_at'].initial = timezone.now()
         return form
+
+class EtapaGeracaoIAInline(admin.TabularInline):
+    model = EtapaGeracaoIA
+    extra = 0
+    readonly_fields = ['tabela', 'chave', 'criados', 'atualizados', 'falhou', 'created_at']
+
+@admin.register(GeracaoIA)
+class GeracaoIAAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'tabelas', 'quantidade', 'tentativas', 'worker', 'created_at', 'concluido_em']
+    list_filter = ['status']
+    readonly_fields = ['progresso', 'resultados', 'erro', 'tentativas', 'worker', 'iniciado_em', 'concluido_em', 'atualizado_em']
+    inlines = [EtapaGeracaoIAInline]
@@ -0,0 +1,157 @@
+"""
+Cache persistente das respostas da OpenAI usadas por `generate_data`.
+
+Cada resposta já validada (a lista JSON) é gravada em disco num arquivo
+cujo nome é o hash do prompt, do modelo e da quantidade pedida, de modo que
+rodar a geração de novo após uma falha parcial só paga pelas chamadas que
+mudaram. As entradas expiram após AI_CACHE_TTL segundos e, quando o
+diretório passa de AI_CACHE_MAX_BYTES, as menos usadas recentemente são
+removidas (o mtime do arquivo é atualizado a cada acerto). O tamanho do
+diretório é medido uma vez e depois somado a cada gravação, de modo que a
+listagem do diretório só acontece quando o total passa do limite; as
+gravações de outros processos entram na conta nessa nova medição.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_contadores = {'hits': 0, 'misses': 0, 'gravacoes': 0, 'despejos': 0}
+# Bytes de cada diretório de cache segundo este processo
+_tamanhos = {}
+
+def _contar(nome, quantidade=1):
+    with _lock:
+        _contadores[nome] += quantidade
+
+def contadores():
+    """Acertos, faltas, gravações e despejos deste processo"""
+    with _lock:
+        return dict(_contadores)
+
+def habilitado():
+    return settings.AI_CACHE_ENABLED
+
+def _diretorio():
+    return Path(settings.AI_CACHE_DIR)
+
+def chave(prompt, modelo, quantidade=None, variante=None):
+    """Hash estável do que determina a resposta"""
+    conteudo = json.dumps([modelo, quantidade, variante, prompt], ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+def _arquivo(chave_cache):
+    return _diretorio() / f'{chave_cache}.json'
+
+def obter(chave_cache):
+    """Retorna os dados guardados para a chave, ou None se não houver ou tiverem expirado"""
+    arquivo = _arquivo(chave_cache)
+    try:
+        with open(arquivo, encoding='utf-8') as f:
+            entrada = json.load(f)
+    except (OSError, ValueError):
+        _contar('misses')
+        return None
+
+    if time.time() - entrada.get('criado_em', 0) > settings.AI_CACHE_TTL:
+        arquivo.unlink(missing_ok=True)
+        _contar('misses')
+        return None
+
+    try:
+        os.utime(arquivo)  # marca como usado recentemente (LRU)
+    except OSError:
+        pass
+    _contar('hits')
+    return entrada['dados']
+
+def _tamanho(arquivo):
+    try:
+        return arquivo.stat().st_size
+    except OSError:
+        return 0
+
+def _somar(diretorio, bytes_):
+    """Soma ao total conhecido do diretório; None se ele ainda não foi medido"""
+    with _lock:
+        if diretorio not in _tamanhos:
+            return None
+        _tamanhos[diretorio] += bytes_
+        return _tamanhos[diretorio]
+
+def guardar(chave_cache, dados):
+    """Grava a resposta de forma atômica e despeja as entradas antigas se passar do limite"""
+    diretorio = _diretorio()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    arquivo = _arquivo(chave_cache)
+    fd, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'criado_em': time.time(), 'dados': dados}, f, ensure_ascii=False)
+        gravados = _tamanho(Path(temporario)) - _tamanho(arquivo)
+        os.replace(temporario, arquivo)
+    except OSError as e:
+        logger.warning(f"Não foi possível gravar no cache de IA: {e}")
+        Path(temporario).unlink(missing_ok=True)
+        return
+    _contar('gravacoes')
+    total = _somar(diretorio, gravados)
+    if total is None or total > settings.AI_CACHE_MAX_BYTES:
+        despejar()
+
+def _entradas():
+    entradas = []
+    for arquivo in _diretorio().glob('*.json'):
+        try:
+            estado = arquivo.stat()
+        except OSError:
+            continue
+        entradas.append((estado.st_mtime, estado.st_size, arquivo))
+    return entradas
+
+def despejar(max_bytes=None):
+    """
+    Remove as entradas usadas há mais tempo até o cache caber em `max_bytes`
+    e atualiza o total conhecido do diretório
+    """
+    max_bytes = settings.AI_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    diretorio = _diretorio()
+    entradas = _entradas()
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    removidas = 0
+    for _, tamanho, arquivo in sorted(entradas):
+        if total <= max_bytes:
+            break
+        arquivo.unlink(missing_ok=True)
+        total -= tamanho
+        removidas += 1
+    with _lock:
+        _tamanhos[diretorio] = total
+    if removidas:
+        _contar('despejos', removidas)
+    return removidas
+
+def limpar():
+    """Remove todas as entradas; retorna quantas eram"""
+    entradas = _entradas()
+    for _, _, arquivo in entradas:
+        arquivo.unlink(missing_ok=True)
+    with _lock:
+        _tamanhos.pop(_diretorio(), None)
+    return len(entradas)
+
+def estatisticas():
+    entradas = _entradas()
+    return {
+        'entradas': len(entradas),
+        'bytes': sum(tamanho for _, tamanho, _ in entradas),
+        **contadores(),
+    }
@@ -1,24 +1,45 @@
 import os
 import json
 import logging
+import math
 import re
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-from PIL import Image
-from io import BytesIO
+import threading
 from openai import OpenAI
 from django.conf import settings
+from .ai_pipeline import Metricas, aguardar_retentativa, e_retentavel
+from . import ai_cache, logos
 
 logger = logging.getLogger(__name__)
 
+MODELO = "gpt-3.5-turbo"
+# Nomes já recebidos repassados no prompt do chunk seguinte (os mais recentes)
+MAX_NOMES_NO_PROMPT = 100
+
 def setup_openai(api_key=None):
-    """Configura a API key da OpenAI"""
+    """
+    Configura o cliente da OpenAI. As novas tentativas ficam a cargo de
+    `_generate_data_chunk` (com backoff e limite de taxa), por isso o
+    cliente não repete requisições por conta própria.
+    """
     key_to_use = api_key or os.getenv('OPENAI_API_KEY') or settings.OPENAI_API_KEY
     logger.info(f"Using API key: {key_to_use[:6]}...{key_to_use[-4:] if key_to_use else 'None'}")
-    return OpenAI(api_key=key_to_use)
+    return OpenAI(
+        api_key=key_to_use,
+        base_url=settings.OPENAI_BASE_URL,
+        timeout=settings.AI_REQUEST_TIMEOUT,
+        max_retries=0,
+    )
 
 client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Cliente compartilhado entre as threads do pipeline"""
+    global client
+    with _client_lock:
+        if not client:
+            client = setup_openai()
+    return client
 
 def _clean_json_response(content):
     """
@@ -46,94 +67,287 @@ def _clean_json_response(content):
     
     return content
 
-def _generate_data_chunk(prompt, quantidade=None, max_retries=3):
+class ElementosJSON:
+    """
+    Parser incremental de um array JSON: `alimentar` recebe o texto conforme
+    chega do stream e retorna os elementos do array que acabaram de fechar.
+    Texto antes do primeiro `[` (ex.: ```json) é ignorado.
+    """
+
+    def __init__(self):
+        self.texto = ''
+        self.posicao = 0
+        self.profundidade = 0
+        self.inicio = None
+        self.em_string = False
+        self.escape = False
+        self.fechado = False
+
+    def _elemento(self, fim):
+        trecho = self.texto[self.inicio:fim].strip()
+        self.inicio = None
+        return json.loads(trecho)
+
+    def alimentar(self, pedaco):
+        self.texto += pedaco
+        elementos = []
+        while self.posicao < len(self.texto) and not self.fechado:
+            c = self.texto[self.posicao]
+            if self.em_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.em_string = False
+            elif self.profundidade == 0:
+                if c == '[':
+                    self.profundidade = 1
+            elif c in '{[':
+                if self.profundidade == 1 and self.inicio is None:
+                    self.inicio = self.posicao
+                self.profundidade += 1
+            elif c in '}]':
+                self.profundidade -= 1
+                if self.profundidade == 1:
+                    elementos.append(self._elemento(self.posicao + 1))
+                elif self.profundidade == 0:
+                    if self.inicio is not None:
+                        elementos.append(self._elemento(self.posicao))
+                    self.fechado = True
+            elif c == ',' and self.profundidade == 1:
+                if self.inicio is not None:
+                    elementos.append(self._elemento(self.posicao))
+            elif not c.isspace():
+                if self.profundidade == 1 and self.inicio is None:
+                    self.inicio = self.posicao
+                if c == '"':
+                    self.em_string = True
+            self.posicao += 1
+        return elementos
+
+    def terminar(self):
+        if not self.fechado:
+            raise ValueError("Resposta não contém JSON válido" if not self.profundidade else "Resposta JSON incompleta")
+
+def _mensagens(prompt):
+    return [
+        {
+            "role": "system", 
+            "content": "Você é um especialista em instrumentos musicais. Gere dados precisos e variados, na quantidade exata solicitada. SEMPRE retorne apenas JSON válido, sem texto adicional."
+        },
+        {"role": "user", "content": prompt}
+    ]
+
+PARAMETROS = {
+    'model': MODELO,
+    'temperature': 0.9,
+    'max_tokens': 3000,
+    'presence_penalty': 0.6,
+    'frequency_penalty': 0.8,
+}
+
+def _completar(prompt):
+    """Uma chamada sem stream: retorna a lista já validada"""
+    response = get_client().chat.completions.create(messages=_mensagens(prompt), **PARAMETROS)
+    content = response.choices[0].message.content.strip()
+    
+    # Limpar a resposta para garantir JSON válido
+    content = _clean_json_response(content)
+    
+    # Validar o JSON
+    data = json.loads(content)
+    if not isinstance(data, list):
+        raise ValueError("Resposta não é uma lista JSON válida")
+    return data
+
+def _completar_em_stream(prompt, ao_item):
     """
-    Função interna para gerar um chunk de dados
+    Uma chamada com stream: cada elemento do array é entregue a `ao_item`
+    assim que fecha, sem esperar o fim da resposta. Uma resposta truncada
+    levanta ValueError depois de entregar os elementos completos.
     """
+    parser = ElementosJSON()
+    stream = get_client().chat.completions.create(messages=_mensagens(prompt), stream=True, **PARAMETROS)
+    try:
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for elemento in parser.alimentar(chunk.choices[0].delta.content):
+                ao_item(elemento)
+            if parser.fechado:
+                break
+    finally:
+        stream.close()
+    parser.terminar()
+
+def _prompt_com_quantidade(prompt, quantidade):
+    if not quantidade:
+        return prompt
+    return f"IMPORTANTE: Gere EXATAMENTE {quantidade} itens.\n\n" + prompt
+
+def _generate_data_chunk(prompt, quantidade=None, max_retries=3, limitador=None, usar_cache=True, variante=None,
+                         ao_item=None, metricas=None, repetir_invalidas=True):
+    """
+    Função interna para gerar um chunk de dados. Cada requisição consome um
+    token do `limitador` (ver `ai_pipeline.TokenBucket`), se informado.
+
+    Respostas completas ficam no cache em disco (`ai_cache`); `variante`
+    distingue chunks diferentes do mesmo prompt e `usar_cache=False` força
+    uma nova chamada (o resultado substitui o que estava no cache).
+
+    Com `ao_item`, a resposta é lida em stream e cada item é passado a
+    `ao_item` assim que chega. Itens já entregues não são pedidos de novo:
+    as novas tentativas pedem apenas os que faltam.
+
+    Com `repetir_invalidas=False`, respostas truncadas ou com JSON inválido
+    levantam ValueError na hora e respostas com menos itens são aceitas,
+    para que quem chama ajuste o tamanho do chunk; só erros da API (429,
+    5xx, conexão) são repetidos. Cada requisição é contada em `metricas`.
+    """
+    full_prompt = _prompt_com_quantidade(prompt, quantidade)
+
+    chave_cache = None
+    if ai_cache.habilitado():
+        chave_cache = ai_cache.chave(full_prompt, MODELO, quantidade, variante)
+        if usar_cache:
+            dados = ai_cache.obter(chave_cache)
+            if dados is not None:
+                for item in dados if ao_item else []:
+                    ao_item(item)
+                return json.dumps(dados)
+
+    entregues = []
+
+    def entregar(item):
+        entregues.append(item)
+        ao_item(item)
+
+    data = []
     for attempt in range(max_retries):
         try:
-            # Adicionar a quantidade explicitamente no prompt se fornecida
-            full_prompt = prompt
-            if quantidade:
-                full_prompt = f"IMPORTANTE: Gere EXATAMENTE {quantidade} itens.\n\n" + prompt
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "Você é um especialista em instrumentos musicais. Gere dados precisos e variados, na quantidade exata solicitada. SEMPRE retorne apenas JSON válido, sem texto adicional."
-                    },
-                    {"role": "user", "content": full_prompt}
-                ],
-                temperature=0.9,
-                max_tokens=3000,
-                presence_penalty=0.6,
-                frequency_penalty=0.8
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Limpar a resposta para garantir JSON válido
-            content = _clean_json_response(content)
-            
-            # Validar o JSON e a quantidade
-            data = json.loads(content)
-            if not isinstance(data, list):
-                raise ValueError("Resposta não é uma lista JSON válida")
+            if limitador:
+                limitador.adquirir()
+            if metricas is not None:
+                metricas.somar(chamadas=1)
+            if ao_item:
+                faltam = quantidade - len(entregues) if quantidade else None
+                _completar_em_stream(full_prompt if not entregues else _prompt_com_quantidade(prompt, faltam), entregar)
+                data = list(entregues)
+            else:
+                data = _completar(full_prompt)
                 
-            if quantidade and len(data) < quantidade:
+            completa = not quantidade or len(data) >= quantidade
+            if not completa:
                 logger.warning(f"Tentativa {attempt + 1}: API retornou apenas {len(data)} itens de {quantidade}")
-                if attempt < max_retries - 1:
+                if repetir_invalidas and attempt < max_retries - 1:
                     continue
+            if chave_cache and (completa or not repetir_invalidas):
+                # Respostas incompletas só vão para o cache quando aceitas como estão;
+                # nos demais casos a próxima execução tenta de novo
+                ai_cache.guardar(chave_cache, data)
             
-            return content
+            return json.dumps(data)
 
         except Exception as e:
             logger.error(f"Erro na tentativa {attempt + 1}: {str(e)}")
-            if attempt == max_retries - 1:  # Se for a última tentativa
+            if attempt == max_retries - 1 or not e_retentavel(e) or (isinstance(e, ValueError) and not repetir_invalidas):
                 raise
+            aguardar_retentativa(attempt, e)
     
-    return "[]"
+    return json.dumps(entregues)
+
+def _prompt_chunk(prompt, quantidade, vistos):
+    """Prompt de um chunk, com os nomes já recebidos para que não se repitam"""
+    chunk_prompt = f"IMPORTANTE: Gere EXATAMENTE {quantidade} itens DIFERENTES dos já gerados anteriormente.\n\n" + prompt
+    if vistos:
+        nomes = ', '.join(json.dumps(nome, ensure_ascii=False) for nome in vistos[-MAX_NOMES_NO_PROMPT:])
+        chunk_prompt += f"\n\nNÃO repita nenhum destes nomes, já gerados: {nomes}"
+    return chunk_prompt
 
-def generate_data(prompt, quantidade=None, max_retries=3, chunk_size=10):
+def generate_data(prompt, quantidade=None, max_retries=3, chunk_size=None, limitador=None, usar_cache=True,
+                  ao_item=None, metricas=None, max_chamadas=None):
     """
     Gera dados usando a OpenAI API com suporte a múltiplas tentativas
     e validação de quantidade. Para grandes quantidades, divide em chunks.
+    Com `usar_cache=False` o cache de respostas é ignorado na leitura e,
+    com `ao_item`, cada item é entregue assim que chega (ver
+    `_generate_data_chunk`), sem repetir nomes entre chunks.
+
+    O tamanho do chunk começa em `chunk_size` (AI_CHUNK_SIZE), dobra a cada
+    resposta completa e cai pela metade após uma resposta truncada ou com
+    JSON inválido, dentro de AI_CHUNK_MIN..AI_CHUNK_MAX; depois de uma falha
+    não volta a passar do tamanho reduzido. Os nomes já
+    recebidos vão no prompt do chunk seguinte, e novos chunks são pedidos
+    até chegar a `quantidade` ou gastar `max_chamadas` requisições. As
+    chamadas e os itens entregues são somados em `metricas`.
     """
-    global client
-    if not client:
-        client = setup_openai()
+    tamanho = chunk_size or settings.AI_CHUNK_SIZE
+    custo = Metricas()
 
-    # Se a quantidade for grande, dividir em chunks menores
-    if quantidade and quantidade > chunk_size:
-        results = []
-        chunks = (quantidade + chunk_size - 1) // chunk_size  # Arredonda para cima
-        
-        for i in range(chunks):
-            items_to_generate = min(chunk_size, quantidade - (i * chunk_size))
-            chunk_prompt = f"IMPORTANTE: Gere EXATAMENTE {items_to_generate} itens DIFERENTES dos já gerados anteriormente.\n\n" + prompt
-            
-            try:
-                chunk_data = _generate_data_chunk(chunk_prompt, items_to_generate, max_retries)
-                if chunk_data:
-                    chunk_json = json.loads(chunk_data)
-                    results.extend(chunk_json)
-            except Exception as e:
-                logger.error(f"Erro ao gerar chunk {i+1}/{chunks}: {str(e)}")
-                continue
-        
-        # Garantir que não temos duplicatas
-        unique_results = []
-        seen_names = set()
-        for item in results:
-            if 'nome' in item and item['nome'] not in seen_names:
-                seen_names.add(item['nome'])
-                unique_results.append(item)
-        
-        return json.dumps(unique_results[:quantidade])
-    else:
-        return _generate_data_chunk(prompt, quantidade, max_retries)
+    if not quantidade or quantidade <= tamanho:
+        try:
+            dados = _generate_data_chunk(
+                prompt, quantidade, max_retries, limitador, usar_cache, ao_item=ao_item, metricas=custo,
+            )
+            custo.somar(itens=len(json.loads(dados)))
+            return dados
+        finally:
+            if metricas is not None:
+                metricas.incorporar(custo)
+
+    # Orçamento padrão: o dobro dos chunks no tamanho inicial, mais uma rodada de tentativas
+    max_chamadas = max_chamadas or 2 * math.ceil(quantidade / tamanho) + max_retries
+    results = []
+    vistos = []
+    nomes = set()
+
+    def aceitar(item):
+        nome = item.get('nome') if isinstance(item, dict) else None
+        if nome is None or nome in nomes or len(results) >= quantidade:
+            custo.somar(repetidos=1)
+            return
+        nomes.add(nome)
+        vistos.append(nome)
+        results.append(item)
+        if ao_item:
+            ao_item(item)
+
+    teto = settings.AI_CHUNK_MAX
+    rodada = 0
+    while len(results) < quantidade and rodada < max_chamadas and custo.chamadas < max_chamadas:
+        pedidos = min(tamanho, quantidade - len(results))
+        antes = len(results)
+        try:
+            chunk_data = _generate_data_chunk(
+                _prompt_chunk(prompt, pedidos, vistos), pedidos, max_retries, limitador, usar_cache,
+                variante=rodada, ao_item=aceitar if ao_item else None, metricas=custo, repetir_invalidas=False,
+            )
+            if not ao_item:
+                for item in json.loads(chunk_data):
+                    aceitar(item)
+            completa = True
+        except ValueError as e:
+            # Resposta truncada ou JSON inválido: os itens que chegaram inteiros ficam
+            logger.warning(f"Chunk {rodada + 1} de {pedidos} itens inválido ({e}); reduzindo o tamanho")
+            custo.somar(invalidas=1)
+            completa = False
+        except Exception as e:
+            logger.error(f"Erro ao gerar chunk {rodada + 1}: {str(e)}")
+            break
+        rodada += 1
+
+        if not completa:
+            tamanho = teto = max(settings.AI_CHUNK_MIN, tamanho // 2)
+        elif len(results) - antes >= pedidos:
+            tamanho = min(teto, tamanho * 2)
+
+    if len(results) < quantidade:
+        logger.warning(f"Gerados {len(results)} de {quantidade} itens com {custo.chamadas} chamadas")
+    custo.somar(itens=len(results))
+    if metricas is not None:
+        metricas.incorporar(custo)
+    return json.dumps(results)
 
 def generate_categorias(quantidade):
     """Gera categorias de instrumentos musicais usando GPT"""
@@ -251,147 +465,18 @@ def generate_instrumentos(quantidade, modelo):
 
 def buscar_logo_no_site(site_url):
     """
-    Busca logo no site usando várias estratégias
+    Busca logo no site usando várias estratégias (ver `logos.buscar_logo_no_site`)
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    try:
-        # Timeout de 5 segundos para não travar
-        response = requests.get(site_url, headers=headers, timeout=5)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Lista para armazenar possíveis URLs de logo
-        logo_candidates = []
-        
-        # 1. Verifica meta tags (Open Graph/Twitter)
-        for meta in soup.find_all('meta', property=['og:image', 'twitter:image']):
-            if meta.get('content'):
-                logo_candidates.append(urljoin(site_url, meta['content']))
-        
-        # 2. Busca imagens com 'logo' no nome/alt/class
-        for img in soup.find_all('img', src=True):
-            src = img['src']
-            alt = img.get('alt', '').lower()
-            class_name = ' '.join(img.get('class', [])).lower()
-            
-            # Padrões comuns de nomes de logos
-            if any(pattern in src.lower() or pattern in alt or pattern in class_name 
-                  for pattern in ['logo', 'brand', 'header-image', 'site-logo']):
-                logo_candidates.append(urljoin(site_url, src))
-        
-        # 3. Busca SVGs (comum para logos)
-        for svg in soup.find_all(['svg', 'object'], class_=True):
-            if any(pattern in ' '.join(svg.get('class', [])).lower() 
-                  for pattern in ['logo', 'brand']):
-                if svg.get('data'):
-                    logo_candidates.append(urljoin(site_url, svg['data']))
-        
-        # 4. Verifica cada candidato
-        for url in logo_candidates:
-            try:
-                # Verifica se a URL é válida
-                img_response = requests.head(url, headers=headers, timeout=3)
-                if img_response.status_code == 200:
-                    # Verifica o content-type
-                    content_type = img_response.headers.get('content-type', '')
-                    if any(t in content_type.lower() for t in ['image', 'svg']):
-                        # Se for imagem, verifica o tamanho
-                        if 'image' in content_type:
-                            img_data = requests.get(url, headers=headers, timeout=3)
-                            img = Image.open(BytesIO(img_data.content))
-                            width, height = img.size
-                            # Logo deve ter tamanho razoável
-                            if width >= 100 and height >= 100:
-                                return url
-                        else:  # Se for SVG, aceita
-                            return url
-            except:
-                continue
-        
-        # 5. Fallback: favicon em alta resolução
-        favicon_patterns = [
-            '/favicon-32x32.png',
-            '/favicon-96x96.png',
-            '/apple-touch-icon.png',
-            '/apple-touch-icon-precomposed.png',
-            '/favicon.ico'
-        ]
-        
-        for pattern in favicon_patterns:
-            try:
-                favicon_url = urljoin(site_url, pattern)
-                response = requests.head(favicon_url, headers=headers, timeout=2)
-                if response.status_code == 200:
-                    return favicon_url
-            except:
-                continue
-                
-    except Exception as e:
-        logger.error(f"Erro ao buscar logo no site {site_url}: {str(e)}")
-    
-    return None
+    return logos.buscar_logo_no_site(site_url)
 
 def generate_logo_url(marca_nome):
     """Gera URL do logotipo para uma marca específica"""
-    # Mapeamento de marcas para seus domínios
-    dominios_conhecidos = {
-        'fender': 'fender.com',
-        'gibson': 'gibson.com',
-        'ibanez': 'ibanez.com',
-        'yamaha': 'yamaha.com',
-        'roland': 'roland.com',
-        'marshall': 'marshall.com',
-        'gretsch': 'gretsch.com',
-        'epiphone': 'epiphone.com',
-        'esp': 'espguitars.com',
-        'prs': 'prsguitars.com',
-        'jackson': 'jacksonguitars.com',
-        'schecter': 'schecterguitars.com',
-        'dean': 'deanguitars.com',
-        'washburn': 'washburn.com',
-        'bc rich': 'bcrich.com',
-        'cort': 'cortguitars.com',
-        'kramer': 'kramerguitars.com',
-        'guild': 'guildguitars.com',
-        'rickenbacker': 'rickenbacker.com',
-        'charvel': 'charvel.com',
-        'evh': 'evhgear.com',
-        'ernie ball': 'ernieball.com',
-        'music man': 'music-man.com',
-        'squier': 'fender.com/squier',
-        'martin': 'martinguitar.com',
-        'taylor': 'taylorguitars.com',
-        'zildjian': 'zildjian.com',
-        'sabian': 'sabian.com',
-        'pearl': 'pearldrum.com'
-    }
-    
     try:
-        # Tentar encontrar uma correspondência exata
-        dominio = dominios_conhecidos.get(marca_nome.lower())
-        
-        # Se não encontrar, tentar encontrar uma correspondência parcial
-        if not dominio:
-            for known_brand, known_domain in dominios_conhecidos.items():
-                if known_brand in marca_nome.lower() or marca_nome.lower() in known_brand:
-                    dominio = known_domain
-                    break
+        dominio = logos.dominio_da_marca(marca_nome)
         
         if dominio:
-            # 1. Tentar Clearbit primeiro
-            clearbit_url = f"https://logo.clearbit.com/{dominio}"
-            try:
-                response = requests.head(clearbit_url)
-                if response.status_code == 200:
-                    return json.dumps({"logotipo_url": clearbit_url})
-            except:
-                pass
-            
-            # 2. Se Clearbit falhar, tentar scraping
-            site_url = f"https://{dominio}"
-            logo_url = buscar_logo_no_site(site_url)
+            # 1. Clearbit e 2. scraping do site, com prazo total e cache por domínio
+            logo_url = logos.descobrir_logo(f"https://{dominio}")
             if logo_url:
                 return json.dumps({"logotipo_url": logo_url})
         
@@ -407,7 +492,7 @@ def generate_logo_url(marca_nome):
         Retorne a descrição em até 100 palavras.
         """
         
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7
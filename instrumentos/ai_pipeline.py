@@ -0,0 +1,268 @@
+"""
+Execução concorrente das chamadas à OpenAI usadas para popular o catálogo.
+
+As tarefas de uma tabela (uma por categoria, por par marca/subcategoria etc.)
+são distribuídas num pool de threads com concorrência limitada. Todas as
+chamadas passam por um token bucket compartilhado, que limita as requisições
+por minuto, e erros transitórios (429, 5xx, falhas de conexão, JSON inválido)
+são repetidos com backoff exponencial e jitter. Os resultados são entregues
+à thread que chamou `executar` conforme ficam prontos, de modo que as
+gravações no banco continuam acontecendo numa única thread. Em modo stream,
+cada item também é entregue assim que chega, antes do fim da resposta.
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Erros que valem uma nova tentativa; os demais (autenticação, requisição inválida) sobem direto
+ERROS_RETENTAVEIS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    ValueError,
+)
+
+class TokenBucket:
+    """
+    Limita a taxa de requisições: `taxa` tokens por segundo, acumulando no
+    máximo `capacidade` (rajada). `adquirir` bloqueia até haver um token.
+    """
+
+    def __init__(self, taxa, capacidade=1, relogio=time.monotonic, dormir=time.sleep):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.relogio = relogio
+        self.dormir = dormir
+        self._atualizado = relogio()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def por_minuto(cls, requisicoes, capacidade=1, **kwargs):
+        return cls(requisicoes / 60, capacidade, **kwargs)
+
+    def _reabastecer(self):
+        agora = self.relogio()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                self._reabastecer()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.taxa
+            self.dormir(espera)
+
+def espera_com_jitter(tentativa, base=None, maximo=30.0):
+    """Backoff exponencial com jitter completo: uniforme entre 0 e base * 2^tentativa"""
+    base = settings.AI_RETRY_BASE_DELAY if base is None else base
+    return random.uniform(0, min(maximo, base * 2 ** tentativa))
+
+def _retry_after(erro):
+    """Segundos pedidos pelo servidor no cabeçalho Retry-After, se houver"""
+    response = getattr(erro, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+def aguardar_retentativa(tentativa, erro=None):
+    espera = max(espera_com_jitter(tentativa), _retry_after(erro))
+    logger.warning(f"Tentativa {tentativa + 1} falhou ({erro}); nova tentativa em {espera:.2f}s")
+    time.sleep(espera)
+
+def e_retentavel(erro):
+    return isinstance(erro, ERROS_RETENTAVEIS)
+
+@dataclass
+class Tarefa:
+    """Uma chamada de geração: `chave` identifica o alvo (ex.: id da categoria)"""
+    chave: object
+    prompt: str
+    quantidade: int = None
+
+@dataclass
+class Resultado:
+    """
+    Resposta de uma tarefa. Com `parcial`, `dados` é um único item recebido
+    em stream; a tarefa ainda termina com um Resultado não parcial.
+    """
+    tarefa: Tarefa
+    dados: str = None
+    erro: Exception = None
+    parcial: bool = False
+
+@dataclass
+class Metricas:
+    """
+    Custo da geração: requisições feitas à API (acertos do cache não contam),
+    itens entregues, respostas truncadas ou inválidas e itens repetidos.
+    Pode ser somada por várias threads ao mesmo tempo.
+    """
+    chamadas: int = 0
+    itens: int = 0
+    invalidas: int = 0
+    repetidos: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def somar(self, chamadas=0, itens=0, invalidas=0, repetidos=0):
+        with self._lock:
+            self.chamadas += chamadas
+            self.itens += itens
+            self.invalidas += invalidas
+            self.repetidos += repetidos
+
+    def incorporar(self, outra):
+        self.somar(outra.chamadas, outra.itens, outra.invalidas, outra.repetidos)
+
+    @property
+    def chamadas_por_item(self):
+        return round(self.chamadas / self.itens, 2) if self.itens else None
+
+    def as_dict(self):
+        return {
+            'chamadas': self.chamadas,
+            'itens': self.itens,
+            'invalidas': self.invalidas,
+            'repetidos': self.repetidos,
+            'chamadas_por_item': self.chamadas_por_item,
+        }
+
+@dataclass
+class Progresso:
+    """Andamento de uma tabela, repassado ao callback `ao_progredir`"""
+    tabela: str
+    total: int = 0
+    concluidas: int = 0
+    falhas: int = 0
+    inicio: float = field(default_factory=time.monotonic)
+    metricas: Metricas = field(default_factory=Metricas)
+
+    @property
+    def processadas(self):
+        return self.concluidas + self.falhas
+
+    @property
+    def percentual(self):
+        return 100 * self.processadas // self.total if self.total else 100
+
+    def as_dict(self):
+        return {
+            'tabela': self.tabela,
+            'total': self.total,
+            'concluidas': self.concluidas,
+            'falhas': self.falhas,
+            'percentual': self.percentual,
+            'segundos': round(time.monotonic() - self.inicio, 1),
+            **self.metricas.as_dict(),
+        }
+
+class PipelineIA:
+    """
+    Executa as tarefas de geração de uma tabela em paralelo.
+
+    `gerar(prompt, quantidade, limitador=...)` faz a chamada de fato; por
+    padrão é `ai_helpers.generate_data`, que consome um token do limitador a
+    cada requisição e repete erros transitórios com `aguardar_retentativa`.
+    Com `usar_cache=False` as respostas guardadas em `ai_cache` são ignoradas.
+    As chamadas feitas durante `executar` são somadas em `metricas`, as
+    métricas da tabela em execução.
+    """
+
+    def __init__(self, gerar=None, concorrencia=None, requisicoes_por_minuto=None,
+                 max_tentativas=None, ao_progredir=None, usar_cache=True):
+        if gerar is None:
+            from .ai_helpers import generate_data as gerar
+        self.gerar = gerar
+        self.concorrencia = concorrencia or settings.AI_CONCURRENCY
+        self.limitador = TokenBucket.por_minuto(
+            requisicoes_por_minuto or settings.AI_REQUESTS_PER_MINUTE,
+            capacidade=self.concorrencia,
+        )
+        self.max_tentativas = max_tentativas or settings.AI_MAX_RETRIES
+        self.ao_progredir = ao_progredir
+        self.usar_cache = usar_cache
+        self.progresso = {}
+        self.metricas = Metricas()
+
+    def gerar_tarefa(self, tarefa, usar_cache=True, ao_item=None):
+        """Uma chamada de geração com o limitador e as tentativas do pipeline"""
+        return self.gerar(
+            tarefa.prompt,
+            quantidade=tarefa.quantidade,
+            max_retries=self.max_tentativas,
+            limitador=self.limitador,
+            usar_cache=self.usar_cache and usar_cache,
+            ao_item=ao_item,
+            metricas=self.metricas,
+        )
+
+    def _notificar(self, progresso):
+        if self.ao_progredir:
+            self.ao_progredir(progresso.tabela, progresso.as_dict())
+
+    def executar(self, tabela, tarefas, funcao=None, stream=False):
+        """
+        Gera os resultados das tarefas conforme são concluídos. Falhas não
+        interrompem as demais tarefas: vêm como Resultado com `erro`.
+        `funcao(tarefa)` substitui a chamada simples de `gerar_tarefa` quando
+        uma tarefa precisa de mais de uma chamada (ex.: lotes com repescagem).
+        Com `stream`, cada item recebido também é gerado como um Resultado
+        `parcial`, para que seja gravado enquanto o resto da resposta chega.
+        """
+        if funcao is None:
+            funcao = self.gerar_tarefa
+        elif stream:
+            raise ValueError("stream só é suportado com a função de geração padrão")
+        tarefas = list(tarefas)
+        progresso = self.progresso[tabela] = Progresso(tabela, total=len(tarefas))
+        self.metricas = progresso.metricas
+        self._notificar(progresso)
+        if not tarefas:
+            return
+
+        # As threads só colocam resultados na fila; quem consome é a thread que chamou
+        fila = queue.Queue()
+
+        def rodar(tarefa):
+            try:
+                if stream:
+                    dados = funcao(tarefa, ao_item=lambda item: fila.put(Resultado(tarefa, dados=item, parcial=True)))
+                else:
+                    dados = funcao(tarefa)
+                fila.put(Resultado(tarefa, dados=dados))
+            except Exception as e:
+                fila.put(Resultado(tarefa, erro=e))
+
+        executor = ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix=f'ia-{tabela}')
+        try:
+            for tarefa in tarefas:
+                executor.submit(rodar, tarefa)
+            while progresso.processadas < progresso.total:
+                resultado = fila.get()
+                if not resultado.parcial:
+                    if resultado.erro:
+                        logger.error(f"Falha ao gerar {tabela} ({resultado.tarefa.chave}): {resultado.erro}")
+                        progresso.falhas += 1
+                    else:
+                        progresso.concluidas += 1
+                    self._notificar(progresso)
+                yield resultado
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        logger.info(
+            f"{tabela}: {progresso.concluidas}/{progresso.total} tarefas concluídas "
+            f"({progresso.falhas} falhas) em {progresso.as_dict()['segundos']}s, "
+            f"{progresso.metricas.chamadas} chamadas para {progresso.metricas.itens} itens"
+        )
@@ -0,0 +1,538 @@
+"""
+Geração de dados do catálogo com IA, usada pela página "Gerar Dados com IA".
+
+Cada tabela monta suas tarefas (uma chamada por categoria, por par
+marca/subcategoria etc.), que são executadas em paralelo pelo
+`PipelineIA`. As respostas são gravadas no banco à medida que chegam,
+sempre na thread que chamou `popular`.
+
+As respostas são gravadas em lote (`bulk.upsert`) e cada tarefa gravada é
+registrada no `checkpoint` na mesma transação da gravação. Com o checkpoint
+persistido de uma `GeracaoIA`, uma geração interrompida é retomada sem
+repetir tarefas nem duplicar registros.
+
+Com AI_STREAMING, as respostas são lidas em stream e cada item é gravado
+assim que chega, enquanto o restante da resposta ainda está sendo gerado;
+a tarefa é registrada no checkpoint quando a resposta termina.
+"""
+import json
+import logging
+import random
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento
+from .ai_pipeline import PipelineIA, Tarefa
+from . import bulk, ai_helpers
+
+logger = logging.getLogger(__name__)
+
+# Ordem de geração: cada tabela depende das anteriores
+TABELAS = ['categorias', 'subcategorias', 'marcas', 'modelos', 'instrumentos']
+
+# Limites da quantidade por tipo aceita pelo formulário de geração
+QUANTIDADE_MINIMA = 1
+QUANTIDADE_MAXIMA = 50
+
+PROMPT_CATEGORIAS = """
+Gere dados para categorias de instrumentos musicais no formato JSON.
+Use APENAS categorias reais e comuns em lojas de música.
+Cada categoria deve ter:
+- nome: Nome único da categoria (ex: Cordas, Sopro, Percussão)
+- descricao: Descrição técnica e precisa da categoria
+
+Exemplo:
+[
+    {
+        "nome": "Cordas",
+        "descricao": "Instrumentos que produzem som através da vibração de cordas, incluindo cordas dedilhadas, friccionadas ou percutidas"
+    }
+]
+"""
+
+PROMPT_SUBCATEGORIAS = """
+Gere dados para subcategorias da categoria '{categoria}' no formato JSON.
+Use APENAS subcategorias que realmente pertencem a esta categoria principal.
+Cada subcategoria deve ter:
+- nome: Nome específico da subcategoria
+- descricao: Descrição técnica e detalhada
+
+Para a categoria '{categoria}', gere subcategorias específicas e coerentes.
+Por exemplo, para "Cordas":
+[
+    {{
+        "nome": "Violões",
+        "descricao": "Instrumentos de cordas dedilhadas com caixa acústica, incluindo violões clássicos e folk"
+    }}
+]
+"""
+
+PROMPT_MARCAS = """
+Gere dados para marcas de instrumentos musicais no formato JSON.
+Inclua tanto marcas mundialmente famosas quanto marcas de médio porte.
+NÃO REPITA marcas já mencionadas.
+
+Cada marca deve ter:
+- nome: Nome oficial da marca
+- site: Site oficial da marca (URL completa e válida)
+- descricao: História detalhada da marca, incluindo ano de fundação e principais produtos
+- pais_origem: País onde a marca foi fundada
+
+Exemplos de marcas possíveis: Fender, Gibson, Yamaha, Ibanez, Roland, Korg, Pearl, Zildjian, Selmer, Buffet Crampon, etc.
+"""
+
+PROMPT_MODELOS = """
+Gere dados para modelos da marca '{marca}' na subcategoria '{subcategoria}' no formato JSON.
+IMPORTANTE: Gere APENAS se a marca realmente produz instrumentos desta subcategoria.
+Se a marca não produz instrumentos desta subcategoria, retorne array vazio [].
+
+Cada modelo deve ter:
+- nome: Nome oficial e completo do modelo
+- descricao: Descrição detalhada incluindo características técnicas
+
+Exemplo para Fender na subcategoria Guitarras Elétricas:
+[
+    {{
+        "nome": "Stratocaster American Professional II",
+        "descricao": "Guitarra elétrica de corpo sólido com 3 captadores single-coil V-Mod II, ponte tremolo, braço em maple e corpo em alder."
+    }}
+]
+"""
+
+PROMPT_INSTRUMENTOS = """
+Gere {quantidade} instrumentos musicais no formato JSON, exatamente um para cada
+modelo da lista abaixo. Cada instrumento deve repetir o "ref" do seu modelo.
+
+Modelos:
+{modelos}
+
+Use este formato exato:
+[
+    {{
+        "ref": 1,
+        "numero_serie": "ABC123456",
+        "preco": 1999.99,
+        "valor_venda": 2100.00,
+        "estado": "novo",
+        "status": "disponivel",
+        "descricao": "Descrição do instrumento"
+    }}
+]
+
+Regras:
+1. ref: o número do modelo na lista acima
+2. numero_serie: alfanumérico, único
+3. preco: entre 500 e 50000
+4. valor_venda: próximo ao preço
+5. estado: novo, usado ou restaurado
+6. status: disponivel, vendido, reservado ou manutencao
+"""
+
+class Checkpoint:
+    """
+    Ponto de retomada em memória, usado quando a geração não é persistida.
+    `GeracaoIA` implementa a mesma interface gravando no banco.
+    """
+
+    def __init__(self):
+        self.etapas = {}
+        self.resultados = {}
+
+    def tarefas_concluidas(self, tabela):
+        return set(self.etapas.get(tabela, {}))
+
+    def resumo_parcial(self, tabela):
+        etapas = self.etapas.get(tabela, {}).values()
+        return {
+            'created': sum(criados for criados, _, _ in etapas),
+            'updated': sum(atualizados for _, atualizados, _ in etapas),
+            'failed': sum(1 for _, _, falhou in etapas if falhou),
+        }
+
+    def registrar_tarefa(self, tabela, chave, criados=0, atualizados=0, falhou=False):
+        self.etapas.setdefault(tabela, {})[chave] = (criados, atualizados, falhou)
+
+    def resultado_tabela(self, tabela):
+        return self.resultados.get(tabela)
+
+    def concluir_tabela(self, tabela, resultado):
+        self.resultados[tabela] = resultado
+
+def chave_tarefa(chave):
+    """Representação estável da chave de uma tarefa, usada no checkpoint"""
+    return json.dumps(chave)
+
+def _itens(resultado):
+    """Lista de dicts da resposta de uma tarefa, ou levanta o erro da tarefa"""
+    if resultado.erro:
+        raise resultado.erro
+    dados = resultado.dados
+    if isinstance(dados, str):
+        dados = json.loads(dados)
+    if isinstance(dados, dict):
+        dados = [dados]
+    return dados
+
+def _contagem(resultado):
+    """(criados, atualizados) de um bulk.upsert, como contados pelo get_or_create"""
+    return len(resultado.criados), len(resultado.atualizados)
+
+def _consumir(pipeline, checkpoint, tabela, tarefas, gravar, funcao=None):
+    """
+    Executa as tarefas ainda não registradas no checkpoint e grava cada
+    resposta com `gravar(tarefa, itens)`, que retorna (criados, atualizados).
+    Em stream, `gravar` é chamada com cada item assim que ele chega.
+    Monta o resumo da tabela somando o que já havia sido feito.
+    """
+    concluidas = checkpoint.tarefas_concluidas(tabela)
+    pendentes = [tarefa for tarefa in tarefas if chave_tarefa(tarefa.chave) not in concluidas]
+    if len(pendentes) < len(tarefas):
+        logger.info(f"{tabela}: retomando com {len(pendentes)} de {len(tarefas)} tarefas pendentes")
+
+    stream = funcao is None and settings.AI_STREAMING
+    gravados = {}  # chave -> [criados, atualizados] dos itens já gravados em stream
+    primeiro_erro = None
+    for resultado in pipeline.executar(tabela, pendentes, funcao, stream=stream):
+        chave = chave_tarefa(resultado.tarefa.chave)
+        if resultado.parcial:
+            try:
+                with transaction.atomic():
+                    criados, atualizados = gravar(resultado.tarefa, [resultado.dados])
+            except Exception as e:
+                logger.error(f"Erro ao gravar item de {tabela} ({resultado.tarefa.chave}): {e}")
+                primeiro_erro = primeiro_erro or e
+                continue
+            contagem = gravados.setdefault(chave, [0, 0])
+            contagem[0] += criados
+            contagem[1] += atualizados
+            continue
+
+        try:
+            if stream:
+                _itens(resultado)  # levanta o erro da tarefa, se houver
+                checkpoint.registrar_tarefa(tabela, chave, *gravados.pop(chave, (0, 0)))
+            else:
+                itens = _itens(resultado)
+                with transaction.atomic():
+                    criados, atualizados = gravar(resultado.tarefa, itens)
+                    checkpoint.registrar_tarefa(tabela, chave, criados, atualizados)
+        except Exception as e:
+            logger.error(f"Erro ao gravar {tabela} ({resultado.tarefa.chave}): {e}")
+            primeiro_erro = primeiro_erro or e
+            checkpoint.registrar_tarefa(tabela, chave, *gravados.pop(chave, (0, 0)), falhou=True)
+
+    resumo = checkpoint.resumo_parcial(tabela)
+    if tarefas and resumo['failed'] == len(tarefas):
+        return {'error': str(primeiro_erro or 'Todas as chamadas falharam')}
+    return resumo
+
+def popular_categorias(pipeline, checkpoint, quantidade):
+    def gravar(tarefa, itens):
+        linhas = [{'nome': cat_data['nome'], 'descricao': cat_data['descricao']} for cat_data in itens]
+        return _contagem(bulk.upsert(Categoria, linhas, chave=['nome'], campos=['descricao']))
+
+    return _consumir(pipeline, checkpoint, 'categorias', [Tarefa(None, PROMPT_CATEGORIAS, quantidade)], gravar)
+
+def popular_subcategorias(pipeline, checkpoint, quantidade):
+    tarefas = [
+        Tarefa(categoria.pk, PROMPT_SUBCATEGORIAS.format(categoria=categoria.nome), quantidade)
+        for categoria in Categoria.objects.all()
+    ]
+
+    def gravar(tarefa, itens):
+        linhas = [
+            {'nome': subcat_data['nome'], 'categoria_id': tarefa.chave, 'descricao': subcat_data['descricao']}
+            for subcat_data in itens
+        ]
+        return _contagem(bulk.upsert(SubCategoria, linhas, chave=['nome', 'categoria_id'], campos=['descricao']))
+
+    return _consumir(pipeline, checkpoint, 'subcategorias', tarefas, gravar)
+
+def popular_marcas(pipeline, checkpoint, quantidade):
+    marcas_processadas = set()
+
+    def gravar(tarefa, itens):
+        linhas = []
+        for marca_data in itens:
+            # Pular se já processamos esta marca
+            if marca_data['nome'] in marcas_processadas:
+                continue
+            linhas.append({
+                'nome': marca_data['nome'],
+                'site': marca_data['site'],
+                'descricao': marca_data['descricao'],
+                'pais_origem': marca_data['pais_origem'],
+            })
+            marcas_processadas.add(marca_data['nome'])
+        return _contagem(bulk.upsert(Marca, linhas, chave=['nome'], campos=['site', 'descricao', 'pais_origem']))
+
+    resultado = _consumir(pipeline, checkpoint, 'marcas', [Tarefa(None, PROMPT_MARCAS, quantidade)], gravar)
+    if 'error' not in resultado:
+        resultado['unique_processed'] = len(marcas_processadas)
+    return resultado
+
+def popular_modelos(pipeline, checkpoint, quantidade):
+    if not SubCategoria.objects.exists():
+        return {'error': 'Não existem subcategorias'}
+
+    marcas = list(Marca.objects.all())
+    subcategorias = list(SubCategoria.objects.all())
+    tarefas = [
+        Tarefa(
+            (marca.pk, subcategoria.pk),
+            PROMPT_MODELOS.format(marca=marca.nome, subcategoria=subcategoria.nome),
+            quantidade
+        )
+        for marca in marcas
+        for subcategoria in subcategorias
+    ]
+
+    def gravar(tarefa, itens):
+        marca_id, subcategoria_id = tarefa.chave
+        linhas = [
+            {
+                'nome': modelo_data['nome'],
+                'marca_id': marca_id,
+                'descricao': modelo_data['descricao'],
+                'subcategoria_id': subcategoria_id,
+            }
+            for modelo_data in itens
+        ]
+        return _contagem(bulk.upsert(Modelo, linhas, chave=['nome', 'marca_id'], campos=['descricao', 'subcategoria_id']))
+
+    return _consumir(pipeline, checkpoint, 'modelos', tarefas, gravar)
+
+def _decimal(valor, campo):
+    try:
+        numero = Decimal(str(valor))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{campo} inválido: {valor!r}")
+    # DecimalField(max_digits=10, decimal_places=2)
+    if not numero.is_finite() or numero <= 0 or numero >= Decimal('1e8'):
+        raise ValueError(f"{campo} fora do intervalo: {valor!r}")
+    return numero.quantize(Decimal('0.01'))
+
+def validar_instrumento(dados):
+    """
+    Valida um instrumento gerado pela IA e retorna os campos prontos para o
+    modelo. Levanta ValueError se o item não puder ser aproveitado.
+    """
+    if not isinstance(dados, dict):
+        raise ValueError(f"Item não é um objeto: {dados!r}")
+    numero_serie = str(dados.get('numero_serie') or '').strip()
+    if not numero_serie or len(numero_serie) > 100:
+        raise ValueError(f"numero_serie inválido: {dados.get('numero_serie')!r}")
+    estado = dados.get('estado') or 'novo'
+    if estado not in dict(Instrumento.ESTADO_CHOICES):
+        raise ValueError(f"estado inválido: {estado!r}")
+    status = dados.get('status') or 'disponivel'
+    if status not in dict(Instrumento.STATUS_CHOICES):
+        raise ValueError(f"status inválido: {status!r}")
+    valor_venda = dados.get('valor_venda')
+    return {
+        'numero_serie': numero_serie,
+        'preco': _decimal(dados.get('preco'), 'preco'),
+        'valor_venda': _decimal(valor_venda, 'valor_venda') if valor_venda not in (None, '') else None,
+        'estado': estado,
+        'status': status,
+        'descricao': str(dados.get('descricao') or ''),
+    }
+
+def prompt_instrumentos(modelos):
+    linhas = '\n'.join(
+        f'{ref}. Modelo "{modelo.nome}" da marca "{modelo.marca.nome}"'
+        for ref, modelo in enumerate(modelos, start=1)
+    )
+    return PROMPT_INSTRUMENTOS.format(quantidade=len(modelos), modelos=linhas)
+
+def gerar_lote_instrumentos(pipeline, modelos, max_rodadas=None):
+    """
+    Gera um instrumento para cada modelo da lista em uma única chamada.
+    Os itens são validados um a um; os aceitos são mantidos e só os modelos
+    que ficaram sem instrumento válido são pedidos de novo, num lote menor,
+    por até `max_rodadas` rodadas. Retorna a lista de itens válidos, cada um
+    com a `posicao` do seu modelo na lista.
+    """
+    max_rodadas = max_rodadas or settings.AI_MAX_RETRIES
+    aceitos = {}
+    pendentes = list(range(len(modelos)))
+    for rodada in range(max_rodadas):
+        if not pendentes:
+            break
+        if rodada:
+            logger.info(f"Repescagem de {len(pendentes)} de {len(modelos)} instrumentos (rodada {rodada + 1})")
+        try:
+            # Os modelos são sorteados: o mesmo prompt pode aparecer em dois lotes e
+            # precisa gerar instrumentos diferentes, por isso o cache não é lido aqui
+            resposta = pipeline.gerar_tarefa(
+                Tarefa(None, prompt_instrumentos([modelos[p] for p in pendentes])), usar_cache=False,
+            )
+            itens = json.loads(resposta)
+        except Exception as e:
+            if rodada == max_rodadas - 1 and not aceitos:
+                raise
+            logger.warning(f"Lote de {len(pendentes)} instrumentos falhou: {e}")
+            continue
+
+        for item in itens if isinstance(itens, list) else [itens]:
+            try:
+                ref = int(item.get('ref')) if isinstance(item, dict) else 0
+                if not 1 <= ref <= len(pendentes) or pendentes[ref - 1] in aceitos:
+                    raise ValueError(f"ref inválido ou repetido: {ref}")
+                aceitos[pendentes[ref - 1]] = validar_instrumento(item)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Instrumento descartado: {e}")
+        pendentes = [posicao for posicao in pendentes if posicao not in aceitos]
+
+    if pendentes:
+        logger.warning(f"{len(pendentes)} de {len(modelos)} instrumentos sem item válido após {max_rodadas} rodadas")
+    return [{**dados, 'posicao': posicao} for posicao, dados in sorted(aceitos.items())]
+
+def popular_instrumentos(pipeline, checkpoint, quantidade):
+    modelos = list(Modelo.objects.select_related('marca', 'subcategoria__categoria'))
+    if not modelos:
+        return {'error': 'Não existem modelos'}
+
+    # Cada instrumento é de um modelo escolhido ao acaso; uma chamada gera um
+    # lote de até AI_INSTRUMENTOS_POR_LOTE. A chave da tarefa é o número do
+    # lote, que não muda ao retomar a geração.
+    escolhidos = random.choices(modelos, k=quantidade)
+    tamanho = settings.AI_INSTRUMENTOS_POR_LOTE
+    lotes = [escolhidos[inicio:inicio + tamanho] for inicio in range(0, quantidade, tamanho)]
+    tarefas = [Tarefa(numero, None, len(lote)) for numero, lote in enumerate(lotes)]
+
+    def gerar(tarefa):
+        return gerar_lote_instrumentos(pipeline, lotes[tarefa.chave])
+
+    def gravar(tarefa, itens):
+        lote = lotes[tarefa.chave]
+        instrumentos = []
+        for instrumento_data in itens:
+            modelo = lote[instrumento_data.pop('posicao')]
+            instrumentos.append(Instrumento(
+                modelo=modelo,
+                marca=modelo.marca,
+                subcategoria=modelo.subcategoria,
+                categoria=modelo.subcategoria.categoria,
+                **instrumento_data
+            ))
+        return len(bulk.criar(Instrumento, instrumentos)), 0
+
+    resultado = _consumir(pipeline, checkpoint, 'instrumentos', tarefas, gravar, gerar)
+    if 'error' not in resultado:
+        resultado['missing'] = max(0, quantidade - resultado['created'])
+    return resultado
+
+# Geração em uma única chamada (backup/views.ai_populate): cria o que não
+# existe e ignora o resto, como o get_or_create por linha que ela fazia.
+# (tabela, modelo, campos além do nome)
+TABELAS_UMA_CHAMADA = [
+    ('categorias', Categoria, ['descricao']),
+    ('marcas', Marca, ['pais_origem', 'site']),
+    ('modelos', Modelo, ['descricao']),
+]
+QUANTIDADES_UMA_CHAMADA = {'categorias': 10, 'marcas': 20, 'modelos': 30}
+
+# Linhas gravadas por upsert; um lote que falha é refeito linha a linha
+TAMANHO_LOTE_UMA_CHAMADA = 100
+
+def prompt_uma_chamada(tabelas):
+    descricoes = {
+        'categorias': 'categorias de instrumentos (nome e descrição)',
+        'marcas': 'marcas famosas (nome, país de origem e site)',
+        'modelos': 'modelos populares (nome e descrição)',
+    }
+    partes = [
+        f"{posicao}. {QUANTIDADES_UMA_CHAMADA[tabela]} {descricoes[tabela]}"
+        for posicao, (tabela, _, _) in enumerate(TABELAS_UMA_CHAMADA, 1) if tabela in tabelas
+    ]
+    formatos = [
+        f'    "{tabela}": [{json.dumps(dict.fromkeys(["nome"] + campos, ""))}]'
+        for tabela, _, campos in TABELAS_UMA_CHAMADA if tabela in tabelas
+    ]
+    return (
+        "Gere uma lista em formato JSON com dados de instrumentos musicais contendo:\n"
+        + "\n".join(partes)
+        + "\n\nFormato:\n{\n" + ",\n".join(formatos) + "\n}"
+    )
+
+def _gravar_sem_atualizar(model, itens, campos):
+    """
+    Cria os itens que ainda não existem, em lotes, e retorna (criados,
+    ignorados). Como no get_or_create por linha, um item é ignorado quando
+    já existe, quando falta um campo ou quando a gravação dele falha: se um
+    lote falha, ele é refeito linha a linha para que só as linhas com erro
+    fiquem de fora.
+    """
+    chaves = ['nome'] + campos
+    linhas = [
+        {campo: item[campo] for campo in chaves}
+        for item in itens
+        if isinstance(item, dict) and all(campo in item for campo in chaves)
+    ]
+    criados, ignorados = 0, len(itens) - len(linhas)
+    for inicio in range(0, len(linhas), TAMANHO_LOTE_UMA_CHAMADA):
+        lote = linhas[inicio:inicio + TAMANHO_LOTE_UMA_CHAMADA]
+        try:
+            resultados = [bulk.upsert(model, lote, chave=['nome'], campos=campos, atualizar=False)]
+        except (DatabaseError, ValidationError):
+            resultados = []
+            for linha in lote:
+                try:
+                    resultados.append(bulk.upsert(model, [linha], chave=['nome'], campos=campos, atualizar=False))
+                except (DatabaseError, ValidationError) as e:
+                    logger.error(f"Erro ao gravar {model.__name__} {linha['nome']!r}: {e}")
+                    ignorados += 1
+        for resultado in resultados:
+            criados += len(resultado.criados)
+            ignorados += resultado.ignorados
+    return criados, ignorados
+
+def popular_uma_chamada(tabelas):
+    """
+    Gera categorias, marcas e modelos numa única chamada à IA e grava o que
+    ainda não existe. Retorna {tabela: (criados, ignorados)} das tabelas
+    presentes na resposta.
+    """
+    response = ai_helpers.get_client().chat.completions.create(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "Você é um especialista em instrumentos musicais."},
+            {"role": "user", "content": prompt_uma_chamada(tabelas)}
+        ]
+    )
+    dados = json.loads(response.choices[0].message.content)
+
+    contagens = {}
+    for tabela, model, campos in TABELAS_UMA_CHAMADA:
+        if tabela in tabelas and tabela in dados:
+            contagens[tabela] = _gravar_sem_atualizar(model, dados[tabela], campos)
+    return contagens
+
+POPULADORES = {
+    'categorias': popular_categorias,
+    'subcategorias': popular_subcategorias,
+    'marcas': popular_marcas,
+    'modelos': popular_modelos,
+    'instrumentos': popular_instrumentos,
+}
+
+def popular(tabelas, quantidade, pipeline=None, ao_progredir=None, checkpoint=None):
+    """
+    Gera as tabelas pedidas, na ordem de dependência. Retorna um dict
+    tabela -> {'created', 'updated', 'failed'} ou {'error'}. Tabelas já
+    concluídas no checkpoint não são geradas de novo.
+    """
+    pipeline = pipeline or PipelineIA(ao_progredir=ao_progredir)
+    checkpoint = checkpoint or Checkpoint()
+    results = {}
+    for tabela in TABELAS:
+        if tabela not in tabelas:
+            continue
+        resultado = checkpoint.resultado_tabela(tabela)
+        if resultado is None:
+            resultado = POPULADORES[tabela](pipeline, checkpoint, quantidade)
+            checkpoint.concluir_tabela(tabela, resultado)
+        results[tabela] = resultado
+    return results
@@ -0,0 +1,144 @@
+"""
+Benchmark das páginas e APIs de leitura sobre o catálogo sintético.
+
+`medir` faz requests pelo client de teste a cada rota de ROTAS e grava, por
+rota, as consultas SQL (com `orcamento.Registro`) e a latência: uma vez com
+os caches frios (dashboard, taxonomia, lookups) e `repeticoes` vezes com
+eles quentes. As páginas de detalhe usam os registros mais populares do
+catálogo, que são o pior caso. O comando `benchmark_catalogo` roda `medir`
+em cada tamanho de `sintetico.TAMANHOS`, grava o relatório em JSON e o
+compara (`comparar`) com uma linha de base guardada: as consultas sempre, a
+latência só quando pedida e medida no mesmo `ambiente` da linha de base.
+"""
+import os
+import platform
+import statistics
+import time
+import django
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento
+from .dashboard import invalidar_estatisticas
+from . import orcamento, versoes, taxonomia
+
+# Rota -> função que recebe os alvos e retorna (args, parâmetros GET)
+ROTAS = {
+    'home': lambda alvos: ([], {}),
+    'inicial': lambda alvos: ([], {}),
+    'categoria_list': lambda alvos: ([], {}),
+    'categoria_detail': lambda alvos: ([alvos['categoria']], {}),
+    'subcategoria_list': lambda alvos: ([], {}),
+    'subcategoria_detail': lambda alvos: ([alvos['subcategoria']], {}),
+    'marca_list': lambda alvos: ([], {}),
+    'modelo_list': lambda alvos: ([], {}),
+    'modelo_detail': lambda alvos: ([alvos['modelo']], {}),
+    'instrumento_list': lambda alvos: ([], {}),
+    'instrumento_detail': lambda alvos: ([alvos['instrumento']], {}),
+    'modelos_por_marca': lambda alvos: ([alvos['marca']], {}),
+    'subcategorias_por_categoria': lambda alvos: ([alvos['categoria']], {}),
+    'taxonomia_api': lambda alvos: ([], {}),
+    'busca_api': lambda alvos: ([], {'q': alvos['busca']}),
+}
+
+def alvos():
+    """Os registros mais populares de cada tabela, usados nas páginas de detalhe"""
+    def mais_popular(model):
+        return model.objects.order_by('-total_instrumentos', 'pk').values_list('pk', flat=True).first()
+
+    marca = mais_popular(Marca)
+    modelo = mais_popular(Modelo)
+    return {
+        'categoria': mais_popular(Categoria),
+        'subcategoria': mais_popular(SubCategoria),
+        'marca': marca,
+        'modelo': modelo,
+        'instrumento': Instrumento.objects.filter(modelo_id=modelo).order_by('pk').values_list('pk', flat=True).first(),
+        'busca': (Marca.objects.filter(pk=marca).values_list('nome', flat=True).first() or '')[:3],
+    }
+
+def esfriar_caches():
+    """Invalida o que as rotas guardam em cache, sem esvaziar o cache inteiro"""
+    invalidar_estatisticas()
+    versoes.incrementar(*versoes.TABELAS)
+    taxonomia.descartar()
+
+def _requisitar(client, url, parametros):
+    with orcamento.Registro() as registro:
+        inicio = time.perf_counter()
+        resposta = client.get(url, parametros)
+        if resposta.streaming:
+            b''.join(resposta.streaming_content)
+        duracao = (time.perf_counter() - inicio) * 1000
+    return resposta.status_code, len(registro), duracao
+
+def medir(repeticoes=5, rotas=None):
+    """{rota: {status, orcamento, consultas_frio, consultas, frio_ms, mediana_ms, p95_ms, max_ms}}"""
+    client = Client()
+    escolhidos = alvos()
+    resultado = {}
+    for rota in rotas or ROTAS:
+        args, parametros = ROTAS[rota](escolhidos)
+        url = reverse(rota, args=args)
+        esfriar_caches()
+        status, consultas_frio, frio_ms = _requisitar(client, url, parametros)
+        quentes = [_requisitar(client, url, parametros) for _ in range(repeticoes)]
+        duracoes = sorted(duracao for _, _, duracao in quentes)
+        resultado[rota] = {
+            'status': status,
+            'orcamento': orcamento.orcamento(rota),
+            'consultas_frio': consultas_frio,
+            'consultas': max(consultas for _, consultas, _ in quentes),
+            'frio_ms': round(frio_ms, 2),
+            'mediana_ms': round(statistics.median(duracoes), 2),
+            'p95_ms': round(duracoes[min(len(duracoes) - 1, round(0.95 * (len(duracoes) - 1)))], 2),
+            'max_ms': round(duracoes[-1], 2),
+        }
+    return resultado
+
+def ambiente():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'banco': connection.vendor,
+        'maquina': platform.machine(),
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+    }
+
+def mesmo_ambiente(resultado, base):
+    """Se as latências dos dois relatórios são comparáveis"""
+    return resultado.get('ambiente') is not None and resultado.get('ambiente') == base.get('ambiente')
+
+def comparar(resultado, base, latencia=False, tolerancia=0.5, folga_ms=5.0):
+    """
+    Regressões de `resultado` em relação a `base` (relatórios do comando):
+    uma rota que passou a fazer mais consultas ou que estourou o orçamento.
+    Com `latencia`, e se os dois relatórios vêm do mesmo ambiente, também
+    uma rota cuja mediana passou de base * (1 + tolerancia) + folga_ms; em
+    máquinas diferentes os milissegundos não dizem nada. Tamanhos e rotas
+    ausentes da base são ignorados.
+    """
+    latencia = latencia and mesmo_ambiente(resultado, base)
+    regressoes = []
+    for tamanho, medicao in resultado.get('tamanhos', {}).items():
+        rotas_base = base.get('tamanhos', {}).get(tamanho, {}).get('rotas', {})
+        for rota, atual in medicao['rotas'].items():
+            if atual['orcamento'] is not None and atual['consultas_frio'] > atual['orcamento']:
+                regressoes.append(
+                    f"{tamanho} {rota}: {atual['consultas_frio']} consultas, orçamento de {atual['orcamento']}"
+                )
+            anterior = rotas_base.get(rota)
+            if anterior is None:
+                continue
+            for campo in ('consultas_frio', 'consultas'):
+                if atual[campo] > anterior[campo]:
+                    regressoes.append(f"{tamanho} {rota}: {campo} {anterior[campo]} -> {atual[campo]}")
+            if not latencia:
+                continue
+            limite = anterior['mediana_ms'] * (1 + tolerancia) + folga_ms
+            if atual['mediana_ms'] > limite:
+                regressoes.append(
+                    f"{tamanho} {rota}: mediana {anterior['mediana_ms']} ms -> {atual['mediana_ms']} ms (limite {limite:.2f} ms)"
+                )
+    return regressoes
@@ -0,0 +1,102 @@
+"""
+Gravação em lote do catálogo, usada pela geração com IA.
+
+`upsert` troca o get_or_create + save() por linha por um SELECT dos
+registros existentes, um bulk_create e um bulk_update, numa única
+transação. Como bulk_create/bulk_update não disparam signals, os efeitos
+que os signals aplicariam (nome_normalizado, índice de busca, contadores,
+cache do dashboard e versões da taxonomia) vêm das mesmas funções de
+`efeitos`, chamadas aqui para o lote inteiro.
+"""
+from dataclasses import dataclass, field
+from django.db import transaction
+from . import efeitos
+
+@dataclass
+class ResultadoUpsert:
+    """Objetos gravados; `anteriores` guarda os valores de antes da atualização (por pk)"""
+    criados: list = field(default_factory=list)
+    atualizados: list = field(default_factory=list)
+    ignorados: int = 0
+    anteriores: dict = field(default_factory=dict)
+
+def _tem_restricao_unica(model, chave):
+    """Se há um índice único exatamente sobre a chave (exigido por update_conflicts)"""
+    campos = {model._meta.get_field(nome).name for nome in chave}
+    if len(campos) == 1 and model._meta.get_field(next(iter(campos))).unique:
+        return True
+    return any(set(constraint.fields) == campos for constraint in model._meta.total_unique_constraints)
+
+def upsert(model, linhas, chave, campos, atualizar=True, batch_size=500):
+    """
+    Cria ou atualiza `linhas` (dicts com os campos da `chave` e de `campos`).
+
+    Com `atualizar=False`, linhas que já existem são apenas contadas em
+    `ignorados` (como um get_or_create com defaults). Linhas repetidas na
+    mesma chamada contam como atualização do registro criado pela primeira,
+    exatamente como acontecia com get_or_create seguido de save().
+    Retorna um ResultadoUpsert.
+    """
+    chave, campos = tuple(chave), list(campos)
+    resultado = ResultadoUpsert()
+    if not linhas:
+        return resultado
+
+    def chave_de(dados):
+        return tuple(dados[nome] if isinstance(dados, dict) else getattr(dados, nome) for nome in chave)
+
+    with transaction.atomic():
+        filtro = {f'{nome}__in': {linha[nome] for linha in linhas} for nome in chave}
+        existentes = {chave_de(obj): obj for obj in model.objects.filter(**filtro)}
+        resultado.anteriores = {
+            obj.pk: {nome: getattr(obj, nome) for nome in campos} for obj in existentes.values()
+        }
+
+        novos = {}
+        atualizados = {}
+        for linha in linhas:
+            k = chave_de(linha)
+            if k not in novos and k not in existentes:
+                novos[k] = model(**{nome: linha[nome] for nome in chave + tuple(campos)})
+                continue
+            if not atualizar:
+                resultado.ignorados += 1
+                continue
+            obj = novos.get(k) or existentes[k]
+            for nome in campos:
+                setattr(obj, nome, linha[nome])
+            if k in existentes:
+                atualizados[k] = obj
+            resultado.atualizados.append(obj)
+
+        novos = list(novos.values())
+        efeitos.normalizar(novos + list(atualizados.values()))
+        campos_gravados = campos + (['nome_normalizado'] if hasattr(model, 'nome_normalizado') else [])
+        if novos:
+            if atualizar and _tem_restricao_unica(model, chave):
+                # Protege contra o mesmo registro criado por outra transação entre o SELECT e o INSERT
+                model.objects.bulk_create(
+                    novos, batch_size=batch_size, update_conflicts=True,
+                    unique_fields=[model._meta.get_field(nome).name for nome in chave],
+                    update_fields=campos_gravados,
+                )
+            else:
+                model.objects.bulk_create(novos, batch_size=batch_size)
+        if atualizados:
+            model.objects.bulk_update(list(atualizados.values()), campos_gravados, batch_size=batch_size)
+
+        # Repetições de objetos novos contam como atualização, mas não são "existentes"
+        resultado.criados = novos
+        efeitos.apos_gravar(model, novos, atualizados.values(), resultado.anteriores)
+    return resultado
+
+def criar(model, objetos, batch_size=500):
+    """bulk_create de objetos sem chave natural (instrumentos), com os efeitos dos signals"""
+    objetos = list(objetos)
+    if not objetos:
+        return objetos
+    with transaction.atomic():
+        efeitos.normalizar(objetos)
+        model.objects.bulk_create(objetos, batch_size=batch_size)
+        efeitos.apos_gravar(model, criados=objetos)
+    return objetos
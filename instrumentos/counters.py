@@ -0,0 +1,153 @@
+"""
+Contadores desnormalizados do catálogo.
+
+Categoria, SubCategoria, Marca e Modelo guardam o total de instrumentos
+(seguindo a cadeia modelo -> subcategoria -> categoria / modelo -> marca) e a
+soma de preco/valor_venda desses instrumentos. Os contadores são mantidos
+incrementalmente com UPDATEs usando F() a partir dos signals e podem ser
+reconstruídos do zero com `recalcular_contadores`.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, DecimalField, IntegerField
+from django.db.models.functions import Coalesce
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, ContadoresMixin
+
+CONTADORES = ContadoresMixin.CAMPOS_CONTADORES
+
+def _incrementar(model, pk, instrumentos=0, preco=Decimal('0'), valor_venda=Decimal('0')):
+    if pk is None or not (instrumentos or preco or valor_venda):
+        return
+    model.objects.filter(pk=pk).update(
+        total_instrumentos=F('total_instrumentos') + instrumentos,
+        total_preco=F('total_preco') + preco,
+        total_valor_venda=F('total_valor_venda') + valor_venda,
+    )
+
+def cadeia_do_modelo(modelo_id):
+    """Retorna (subcategoria_id, categoria_id, marca_id) de um modelo"""
+    cadeia = Modelo.objects.filter(pk=modelo_id).values_list(
+        'subcategoria_id', 'subcategoria__categoria_id', 'marca_id'
+    ).first()
+    return cadeia or (None, None, None)
+
+def _aplicar_na_cadeia(subcategoria_id, categoria_id, marca_id, **delta):
+    _incrementar(SubCategoria, subcategoria_id, **delta)
+    _incrementar(Categoria, categoria_id, **delta)
+    _incrementar(Marca, marca_id, **delta)
+
+def aplicar_instrumento(modelo_id, sinal, preco=None, valor_venda=None):
+    """
+    Soma (sinal=1) ou subtrai (sinal=-1) um instrumento dos contadores do
+    seu modelo e de toda a cadeia de classificação
+    """
+    if modelo_id is None:
+        return
+    delta = {
+        'instrumentos': sinal,
+        'preco': sinal * (preco or Decimal('0')),
+        'valor_venda': sinal * (valor_venda or Decimal('0')),
+    }
+    _incrementar(Modelo, modelo_id, **delta)
+    _aplicar_na_cadeia(*cadeia_do_modelo(modelo_id), **delta)
+
+def aplicar_instrumentos(instrumentos):
+    """
+    Soma aos contadores um lote de instrumentos recém-criados (ex.: por
+    bulk_create, que não dispara signals), com um UPDATE por registro
+    afetado em vez de um por instrumento
+    """
+    deltas = {}
+    for instrumento in instrumentos:
+        if instrumento.modelo_id is None:
+            continue
+        total = deltas.setdefault(instrumento.modelo_id, [0, Decimal('0'), Decimal('0')])
+        total[0] += 1
+        total[1] += Decimal(str(instrumento.preco or 0))
+        total[2] += Decimal(str(instrumento.valor_venda or 0))
+    if not deltas:
+        return
+
+    cadeias = Modelo.objects.filter(pk__in=deltas).values_list(
+        'pk', 'subcategoria_id', 'subcategoria__categoria_id', 'marca_id'
+    )
+    por_registro = {}
+    for modelo_id, subcategoria_id, categoria_id, marca_id in cadeias:
+        for chave in ((Modelo, modelo_id), (SubCategoria, subcategoria_id), (Categoria, categoria_id), (Marca, marca_id)):
+            total = por_registro.setdefault(chave, [0, Decimal('0'), Decimal('0')])
+            for i, valor in enumerate(deltas[modelo_id]):
+                total[i] += valor
+    for (model, pk), (quantidade, preco, valor_venda) in por_registro.items():
+        _incrementar(model, pk, instrumentos=quantidade, preco=preco, valor_venda=valor_venda)
+
+def mover_modelo(totais, origem, destino):
+    """
+    Transfere os totais de um modelo da cadeia de origem para a de destino.
+    `origem` e `destino` são tuplas (subcategoria_id, categoria_id, marca_id).
+    """
+    instrumentos, preco, valor_venda = totais
+    if origem == destino or not (instrumentos or preco or valor_venda):
+        return
+    _aplicar_na_cadeia(*origem, instrumentos=-instrumentos, preco=-preco, valor_venda=-valor_venda)
+    _aplicar_na_cadeia(*destino, instrumentos=instrumentos, preco=preco, valor_venda=valor_venda)
+
+def mover_subcategoria(subcategoria, categoria_origem_id, categoria_destino_id):
+    """Transfere uma subcategoria (e seus totais) entre categorias"""
+    if categoria_origem_id == categoria_destino_id:
+        return
+    delta = {
+        'instrumentos': subcategoria.total_instrumentos,
+        'preco': subcategoria.total_preco,
+        'valor_venda': subcategoria.total_valor_venda,
+    }
+    ajustar_total_subcategorias(categoria_origem_id, -1)
+    ajustar_total_subcategorias(categoria_destino_id, 1)
+    _incrementar(Categoria, categoria_origem_id, **{k: -v for k, v in delta.items()})
+    _incrementar(Categoria, categoria_destino_id, **delta)
+
+def ajustar_total_subcategorias(categoria_id, delta):
+    if categoria_id is None:
+        return
+    Categoria.objects.filter(pk=categoria_id).update(
+        total_subcategorias=F('total_subcategorias') + delta
+    )
+
+def _totais_por(campo):
+    instrumentos = Instrumento.objects.filter(**{campo: OuterRef('pk')}).order_by().values(campo)
+    decimal = DecimalField(max_digits=14, decimal_places=2)
+    return {
+        'total_instrumentos': Coalesce(
+            Subquery(instrumentos.annotate(total=Count('pk')).values('total'), output_field=IntegerField()),
+            0
+        ),
+        'total_preco': Coalesce(
+            Subquery(instrumentos.annotate(total=Sum('preco')).values('total'), output_field=decimal),
+            Decimal('0'), output_field=decimal
+        ),
+        'total_valor_venda': Coalesce(
+            Subquery(instrumentos.annotate(total=Sum('valor_venda')).values('total'), output_field=decimal),
+            Decimal('0'), output_field=decimal
+        ),
+    }
+
+def recalcular_contadores():
+    """
+    Reconstrói todos os contadores a partir dos dados, com um único UPDATE
+    por tabela. Usado pelo comando `recalcular_contadores`.
+    """
+    subcategorias = SubCategoria.objects.filter(categoria=OuterRef('pk')).order_by().values('categoria')
+
+    with transaction.atomic():
+        atualizados = {
+            'modelos': Modelo.objects.update(**_totais_por('modelo')),
+            'subcategorias': SubCategoria.objects.update(**_totais_por('modelo__subcategoria')),
+            'marcas': Marca.objects.update(**_totais_por('modelo__marca')),
+            'categorias': Categoria.objects.update(
+                total_subcategorias=Coalesce(
+                    Subquery(subcategorias.annotate(total=Count('pk')).values('total'), output_field=IntegerField()),
+                    0
+                ),
+                **_totais_por('modelo__subcategoria__categoria')
+            ),
+        }
+    return atualizados
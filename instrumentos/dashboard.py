@@ -0,0 +1,109 @@
+import logging
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum, Value, CharField
+from django.db.models.functions import Coalesce
+from .models import Categoria, SubCategoria, Marca, Instrumento
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_KEY = 'instrumentos:dashboard'
+
+def _totais_instrumentos():
+    """Totais gerais de instrumentos em um único aggregate, sem joins"""
+    return Instrumento.objects.aggregate(
+        total=Count('id'),
+        preco=Coalesce(Sum('preco'), Decimal('0')),
+        valor_venda=Coalesce(Sum('valor_venda'), Decimal('0')),
+    )
+
+def _contar_cadastros():
+    """Conta categorias, subcategorias e marcas cadastradas em uma única consulta"""
+    def _contagem(model, tabela):
+        return (
+            model.objects.order_by()
+            .annotate(tabela=Value(tabela, output_field=CharField()))
+            .values('tabela')
+            .annotate(total=Count('id'))
+            .values_list('tabela', 'total')
+        )
+
+    consulta = _contagem(Categoria, 'categorias').union(
+        _contagem(SubCategoria, 'subcategorias'),
+        _contagem(Marca, 'marcas'),
+        all=True,
+    )
+    totais = {'categorias': 0, 'subcategorias': 0, 'marcas': 0}
+    totais.update(dict(consulta))
+    return totais
+
+def _com_instrumentos(model, *campos):
+    """
+    Lista os registros com instrumentos a partir dos contadores desnormalizados
+    (ver `instrumentos.counters`), sem recontar a tabela de instrumentos
+    """
+    return list(
+        model.objects.filter(total_instrumentos__gt=0)
+        .order_by('-total_instrumentos', 'nome')
+        .values('id', 'nome', 'total_instrumentos', *campos)
+    )
+
+def calcular_estatisticas():
+    """
+    Calcula todas as estatísticas do dashboard sem usar o cache
+    """
+    totais = _totais_instrumentos()
+    categorias = _com_instrumentos(Categoria)
+    marcas = _com_instrumentos(Marca)
+    subcategorias = [
+        {
+            'id': subcategoria['id'],
+            'nome': subcategoria['nome'],
+            'categoria': {
+                'id': subcategoria['categoria_id'],
+                'nome': subcategoria['categoria__nome'],
+            },
+            'total_instrumentos': subcategoria['total_instrumentos'],
+        }
+        for subcategoria in _com_instrumentos(SubCategoria, 'categoria_id', 'categoria__nome')
+    ]
+
+    total_aquisicao = totais['preco']
+    total_mercado = totais['valor_venda']
+    diferenca_total = total_mercado - total_aquisicao
+    if total_aquisicao > 0:
+        percentual_valorizacao = (diferenca_total / total_aquisicao) * Decimal('100')
+    else:
+        percentual_valorizacao = Decimal('0')
+
+    return {
+        'total_instrumentos': totais['total'],
+        'total_categorias': len(categorias),
+        'total_subcategorias': len(subcategorias),
+        'total_marcas': len(marcas),
+        'categorias': categorias,
+        'subcategorias': subcategorias,
+        'marcas': marcas,
+        'total_aquisicao': total_aquisicao,
+        'total_mercado': total_mercado,
+        'diferenca_total': diferenca_total,
+        'percentual_valorizacao': percentual_valorizacao,
+        'cadastros': _contar_cadastros(),
+    }
+
+def get_estatisticas():
+    """
+    Retorna as estatísticas do dashboard, calculando-as apenas quando
+    não estiverem no cache
+    """
+    estatisticas = cache.get(DASHBOARD_CACHE_KEY)
+    if estatisticas is None:
+        estatisticas = calcular_estatisticas()
+        cache.set(DASHBOARD_CACHE_KEY, estatisticas, settings.DASHBOARD_CACHE_TIMEOUT)
+    return estatisticas
+
+def invalidar_estatisticas():
+    """Remove as estatísticas do cache para que sejam recalculadas no próximo acesso"""
+    logger.debug("Invalidando cache do dashboard")
+    cache.delete(DASHBOARD_CACHE_KEY)
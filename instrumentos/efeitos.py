@@ -0,0 +1,134 @@
+"""
+Efeitos das gravações no catálogo: nome_normalizado, contadores
+desnormalizados, índice de busca, cache do dashboard e versões da taxonomia.
+
+Os receivers de `signals` aplicam estes efeitos a cada objeto salvo ou
+excluído, e `bulk` aos lotes gravados com bulk_create/bulk_update, que não
+disparam signals. Os dois caminhos chamam as mesmas funções.
+"""
+from collections import Counter
+from decimal import Decimal
+from django.db import transaction
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento
+from .dashboard import invalidar_estatisticas
+from . import counters, search, versoes, taxonomia
+
+CATALOGO = (Categoria, SubCategoria, Marca, Modelo, Instrumento)
+
+# Valores de antes da gravação de que os contadores precisam, por modelo
+CAMPOS_ANTERIORES = {
+    Instrumento: ('modelo_id', 'preco', 'valor_venda'),
+    Modelo: (
+        'subcategoria_id', 'subcategoria__categoria_id', 'marca_id',
+        'total_instrumentos', 'total_preco', 'total_valor_venda',
+    ),
+    SubCategoria: ('categoria_id',),
+}
+
+def _decimal(valor):
+    # Valores vindos de formulários/JSON podem chegar como str ou float
+    return Decimal(str(valor)) if valor not in (None, '') else None
+
+def normalizar(objetos):
+    """Preenche nome_normalizado antes da gravação"""
+    for obj in objetos:
+        if hasattr(obj, 'nome_normalizado'):
+            obj.nome_normalizado = search.normalizar(obj.nome)
+
+def invalidar(model):
+    """Cache do dashboard e versão da tabela, após a transação ser confirmada"""
+    transaction.on_commit(invalidar_estatisticas)
+    tabela = model._meta.model_name
+    if tabela in versoes.TABELAS:
+        # A cópia local sai na hora; os outros processos percebem pela versão, após o commit
+        taxonomia.descartar(tabela)
+        transaction.on_commit(lambda: versoes.incrementar(tabela))
+
+def _contar_instrumentos(criados, atualizados, anteriores):
+    counters.aplicar_instrumentos(criados)
+    for instrumento in atualizados:
+        anterior = anteriores.get(instrumento.pk)
+        if anterior is None:
+            continue
+        atual = (instrumento.modelo_id, _decimal(instrumento.preco), _decimal(instrumento.valor_venda))
+        antes = tuple(anterior.get(campo, valor) for campo, valor in zip(CAMPOS_ANTERIORES[Instrumento], atual))
+        if antes == atual:
+            continue
+        modelo_id, preco, valor_venda = antes
+        counters.aplicar_instrumento(modelo_id, -1, _decimal(preco), _decimal(valor_venda))
+        modelo_id, preco, valor_venda = atual
+        counters.aplicar_instrumento(modelo_id, 1, preco, valor_venda)
+
+def _contar_modelos(atualizados, anteriores):
+    # Um modelo que mudou de subcategoria ou de marca leva os seus totais junto
+    for modelo in atualizados:
+        anterior = anteriores.get(modelo.pk)
+        if anterior is None:
+            continue
+        subcategoria_id = anterior.get('subcategoria_id', modelo.subcategoria_id)
+        marca_id = anterior.get('marca_id', modelo.marca_id)
+        if (subcategoria_id, marca_id) == (modelo.subcategoria_id, modelo.marca_id):
+            continue
+        if 'total_instrumentos' in anterior:
+            totais = (anterior['total_instrumentos'], anterior['total_preco'], anterior['total_valor_venda'])
+        else:
+            modelo.refresh_from_db(fields=counters.CONTADORES)
+            totais = (modelo.total_instrumentos, modelo.total_preco, modelo.total_valor_venda)
+        if 'subcategoria__categoria_id' in anterior:
+            categoria_id = anterior['subcategoria__categoria_id']
+        else:
+            categoria_id = SubCategoria.objects.filter(pk=subcategoria_id).values_list('categoria_id', flat=True).first()
+        counters.mover_modelo(totais, (subcategoria_id, categoria_id, marca_id), counters.cadeia_do_modelo(modelo.pk))
+
+def _contar_subcategorias(criados, atualizados, anteriores):
+    for categoria_id, total in Counter(obj.categoria_id for obj in criados).items():
+        counters.ajustar_total_subcategorias(categoria_id, total)
+    for subcategoria in atualizados:
+        categoria_id = anteriores.get(subcategoria.pk, {}).get('categoria_id', subcategoria.categoria_id)
+        if categoria_id != subcategoria.categoria_id:
+            subcategoria.refresh_from_db(fields=counters.CONTADORES)
+            counters.mover_subcategoria(subcategoria, categoria_id, subcategoria.categoria_id)
+
+def apos_gravar(model, criados=(), atualizados=(), anteriores=None):
+    """
+    Efeitos de ter criado `criados` e atualizado `atualizados`. `anteriores`
+    leva, por pk dos atualizados, os valores de CAMPOS_ANTERIORES de antes da
+    gravação; um campo ausente é tratado como inalterado.
+    """
+    criados, atualizados, anteriores = list(criados), list(atualizados), anteriores or {}
+    if model not in CATALOGO or not (criados or atualizados):
+        return
+
+    if model is Instrumento:
+        _contar_instrumentos(criados, atualizados, anteriores)
+    elif model is Modelo:
+        _contar_modelos(atualizados, anteriores)
+    elif model is SubCategoria:
+        _contar_subcategorias(criados, atualizados, anteriores)
+
+    search.indexar_lote(model, [obj.pk for obj in criados + atualizados])
+    if model is Categoria:
+        # O nome da categoria faz parte do índice das suas subcategorias
+        for categoria in atualizados:
+            search.indexar_subcategorias(categoria)
+    invalidar(model)
+
+def apos_remover(model, instance):
+    """Efeitos de ter excluído `instance`"""
+    if model not in CATALOGO:
+        return
+    if model is Instrumento:
+        counters.aplicar_instrumento(instance.modelo_id, -1, _decimal(instance.preco), _decimal(instance.valor_venda))
+    elif model is Modelo:
+        # Instrumento.modelo é PROTECT, então normalmente os totais já são zero
+        totais = (instance.total_instrumentos, instance.total_preco, instance.total_valor_venda)
+        if any(totais):
+            categoria_id = SubCategoria.objects.filter(
+                pk=instance.subcategoria_id
+            ).values_list('categoria_id', flat=True).first()
+            counters.mover_modelo(totais, (instance.subcategoria_id, categoria_id, instance.marca_id), (None, None, None))
+    elif model is SubCategoria:
+        counters.ajustar_total_subcategorias(instance.categoria_id, -1)
+
+    search.remover(instance)
+    invalidar(model)
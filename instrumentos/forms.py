@@ -1,6 +1,9 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import inlineformset_factory
+from PIL import Image
 from .models import Categoria, Modelo, Instrumento, Marca, SubCategoria, FotoInstrumento
+from . import imagens, taxonomia
 
 class CategoriaForm(forms.ModelForm):
     class Meta:
@@ -18,6 +21,12 @@ class SubCategoriaForm(forms.ModelForm):
             'descricao': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Opções da taxonomia em memória, sem consultar a tabela a cada renderização
+        campo = self.fields['categoria']
+        campo.choices = taxonomia.escolhas('categoria', vazio=campo.empty_label)
+
 class MarcaForm(forms.ModelForm):
     class Meta:
         model = Marca
@@ -34,6 +43,12 @@ class ModeloForm(forms.ModelForm):
             'descricao': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Opções da taxonomia em memória: o __str__ de cada subcategoria consultaria a categoria
+        for campo in ('marca', 'subcategoria'):
+            self.fields[campo].choices = taxonomia.escolhas(campo, vazio=self.fields[campo].empty_label)
+
 class InstrumentoCreateForm(forms.ModelForm):
     class Meta:
         model = Instrumento
@@ -59,30 +74,40 @@ class InstrumentoCreateForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['subcategoria'].queryset = SubCategoria.objects.none()
         self.fields['modelo'].queryset = Modelo.objects.none()
+        categoria_id = self._id_selecionado('categoria')
+        marca_id = self._id_selecionado('marca')
 
-        if 'categoria' in self.data:
-            try:
-                categoria_id = int(self.data.get('categoria'))
-                self.fields['subcategoria'].queryset = SubCategoria.objects.filter(categoria_id=categoria_id)
-            except (ValueError, TypeError):
-                pass
-        elif self.instance.pk and self.instance.categoria:
-            self.fields['subcategoria'].queryset = self.instance.categoria.subcategoria_set.all()
+        if categoria_id is not None:
+            self.fields['subcategoria'].queryset = SubCategoria.objects.filter(categoria_id=categoria_id)
+        if marca_id is not None:
+            self.fields['modelo'].queryset = Modelo.objects.filter(marca_id=marca_id)
 
-        if 'marca' in self.data:
-            try:
-                marca_id = int(self.data.get('marca'))
-                self.fields['modelo'].queryset = Modelo.objects.filter(marca_id=marca_id)
-            except (ValueError, TypeError):
-                pass
-        elif self.instance.pk and self.instance.marca:
-            self.fields['modelo'].queryset = self.instance.marca.modelo_set.all()
+        # As opções exibidas vêm da taxonomia em memória; os querysets acima
+        # só são consultados para validar o que foi enviado
+        for campo, filtros in (
+            ('categoria', {}),
+            ('marca', {}),
+            ('subcategoria', {'categoria_id': categoria_id}),
+            ('modelo', {'marca_id': marca_id}),
+        ):
+            if filtros and None in filtros.values():
+                continue
+            self.fields[campo].choices = taxonomia.escolhas(campo, vazio=self.fields[campo].empty_label, **filtros)
 
         # Tornar campos não obrigatórios
         self.fields['valor_venda'].required = False
         self.fields['data_venda'].required = False
         self.fields['descricao'].required = False
 
+    def _id_selecionado(self, campo):
+        """Id de `campo` enviado no formulário ou, na edição, o do instrumento"""
+        if campo in self.data:
+            try:
+                return int(self.data.get(campo))
+            except (ValueError, TypeError):
+                return None
+        return getattr(self.instance, f'{campo}_id', None) if self.instance.pk else None
+
 class FotoInstrumentoForm(forms.ModelForm):
     class Meta:
         model = FotoInstrumento
@@ -92,6 +117,16 @@ class FotoInstrumentoForm(forms.ModelForm):
             'descricao': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
+    def clean_imagem(self):
+        """Normaliza só os arquivos recém-enviados; a imagem já gravada fica como está"""
+        imagem = self.cleaned_data.get('imagem')
+        if isinstance(imagem, UploadedFile):
+            try:
+                return imagens.normalizar_upload(imagem)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                raise forms.ValidationError('Não foi possível processar a imagem enviada.')
+        return imagem
+
 # Formset para as fotos do instrumento
 FotoInstrumentoFormSet = inlineformset_factory(
     Instrumento,
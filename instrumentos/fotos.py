@@ -0,0 +1,31 @@
+"""
+Bloco de fotos (carrossel e miniaturas) da página do instrumento.
+
+O HTML é renderizado uma vez e guardado no cache por instrumento; as fotos
+só são consultadas quando o bloco não está no cache. Qualquer mudança nas
+fotos (signals, variantes geradas, upload em lote) chama `invalidar`.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+logger = logging.getLogger(__name__)
+
+def chave(instrumento_id):
+    return f'instrumentos:fotos:{instrumento_id}'
+
+def bloco_de_fotos(instrumento):
+    """HTML do bloco de fotos do instrumento, do cache ou renderizado agora"""
+    html = cache.get(chave(instrumento.pk))
+    if html is None:
+        html = render_to_string('instrumentos/instrumento_fotos.html', {
+            'instrumento': instrumento,
+            'fotos': list(instrumento.fotos.order_by('ordem', 'pk')),
+        })
+        cache.set(chave(instrumento.pk), html, settings.FOTOS_CACHE_TIMEOUT)
+    return html
+
+def invalidar(instrumento_id):
+    logger.debug(f"Invalidando bloco de fotos do instrumento {instrumento_id}")
+    cache.delete(chave(instrumento_id))
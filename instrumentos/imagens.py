@@ -0,0 +1,202 @@
+"""
+Variantes responsivas das imagens do catálogo (fotos dos instrumentos e
+logotipos das marcas).
+
+Para cada original são geradas cópias reduzidas em IMAGEM_LARGURAS, em WebP
+e num formato de fallback (JPEG, ou PNG quando a imagem tem transparência),
+gravadas ao lado do original: `instrumentos/foto.jpg` ganha
+`instrumentos/foto.w320.webp`, `instrumentos/foto.w320.jpg` etc. O que foi
+gerado fica num JSONField do próprio registro, de modo que as template tags
+(`imagem_responsiva`, `srcset`) montam o `srcset` sem tocar no storage.
+
+A geração roda num pool de threads (o Pillow libera o GIL ao redimensionar
+e codificar) depois do commit do upload; com IMAGEM_WORKERS = 0 roda na
+hora, na própria thread.
+
+Antes disso, `normalizar_upload` trata o arquivo enviado: aplica a
+orientação do EXIF, limita as dimensões a IMAGEM_DIMENSAO_MAXIMA, descarta
+os metadados e recomprime, de modo que o original guardado não é mais a
+foto de 10 MB do celular.
+"""
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageFile, ImageOps
+from . import fotos
+
+logger = logging.getLogger(__name__)
+
+WEBP = 'webp'
+EXTENSOES = {'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+OPCOES = {
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'optimize': True},
+}
+
+# Campo de imagem -> campo com as variantes geradas, por modelo
+CAMPOS = {
+    'FotoInstrumento': ('imagem', 'variantes'),
+    'Marca': ('logotipo', 'logotipo_variantes'),
+}
+
+VARIANTE = re.compile(r'\.w\d+\.(?:webp|jpg|png)$')
+
+def nome_variante(nome, largura, formato):
+    raiz, _ = os.path.splitext(nome)
+    return f"{raiz}.w{largura}.{EXTENSOES[formato]}"
+
+def eh_variante(nome):
+    return bool(VARIANTE.search(nome))
+
+def nomes_variantes(nome, variantes):
+    """Arquivos de todas as variantes descritas em `variantes`"""
+    if not variantes:
+        return []
+    return [
+        nome_variante(nome, largura, formato)
+        for largura in variantes.get('larguras', [])
+        for formato in (WEBP, variantes['formato'])
+    ]
+
+def _tem_transparencia(imagem):
+    return imagem.mode in ('RGBA', 'LA', 'PA') or (imagem.mode == 'P' and 'transparency' in imagem.info)
+
+def gerar_variantes(nome, storage=default_storage):
+    """
+    Gera e grava as variantes de um original e retorna a descrição delas:
+    {'largura': largura do original, 'larguras': [...], 'formato': fallback}.
+    Só são geradas larguras menores que a do original. Não acessa o banco.
+    """
+    with storage.open(nome, 'rb') as arquivo:
+        imagem = Image.open(arquivo)
+        imagem = ImageOps.exif_transpose(imagem)
+        imagem.load()
+
+    transparente = _tem_transparencia(imagem)
+    formato = 'png' if transparente else 'jpeg'
+    imagem = imagem.convert('RGBA' if transparente else 'RGB')
+    larguras = sorted((largura for largura in settings.IMAGEM_LARGURAS if largura < imagem.width), reverse=True)
+
+    # Da maior para a menor, cada redução parte da anterior (menos pixels a reamostrar)
+    atual = imagem
+    for largura in larguras:
+        altura = max(1, round(imagem.height * largura / imagem.width))
+        atual = atual.resize((largura, altura), Image.LANCZOS)
+        for formato_variante in (WEBP, formato):
+            saida = BytesIO()
+            atual.save(saida, formato_variante.upper(), **OPCOES[formato_variante])
+            destino = nome_variante(nome, largura, formato_variante)
+            if storage.exists(destino):
+                storage.delete(destino)
+            storage.save(destino, ContentFile(saida.getvalue()))
+
+    return {'largura': imagem.width, 'larguras': sorted(larguras), 'formato': formato}
+
+def _decodificar(arquivo):
+    """Decodifica a imagem alimentando o parser com os pedaços do upload, sem ler o arquivo inteiro"""
+    parser = ImageFile.Parser()
+    for pedaco in arquivo.chunks():
+        parser.feed(pedaco)
+    return parser.close()
+
+def normalizar_upload(arquivo):
+    """
+    Retorna uma cópia normalizada do UploadedFile `arquivo`: orientação do
+    EXIF aplicada, lado maior limitado a IMAGEM_DIMENSAO_MAXIMA, sem EXIF nem
+    outros metadados (só o perfil ICC é mantido, para não alterar as cores)
+    e recomprimida em JPEG, ou PNG quando há transparência.
+    """
+    imagem = _decodificar(arquivo)
+    perfil_icc = imagem.info.get('icc_profile')
+    imagem = ImageOps.exif_transpose(imagem)
+
+    dimensao_maxima = settings.IMAGEM_DIMENSAO_MAXIMA
+    imagem.thumbnail((dimensao_maxima, dimensao_maxima), Image.LANCZOS)
+
+    transparente = _tem_transparencia(imagem)
+    formato = 'png' if transparente else 'jpeg'
+    # Uma imagem nova carrega só os pixels: nada de EXIF, XMP ou comentários
+    limpa = Image.new('RGBA' if transparente else 'RGB', imagem.size)
+    limpa.paste(imagem.convert(limpa.mode))
+
+    opcoes = dict(OPCOES[formato])
+    if formato == 'jpeg':
+        opcoes['quality'] = settings.IMAGEM_QUALIDADE
+    if perfil_icc:
+        opcoes['icc_profile'] = perfil_icc
+    saida = BytesIO()
+    limpa.save(saida, formato.upper(), **opcoes)
+
+    raiz, _ = os.path.splitext(os.path.basename(arquivo.name))
+    return ContentFile(saida.getvalue(), name=f"{raiz}.{EXTENSOES[formato]}")
+
+def remover_variantes(nome, storage=default_storage):
+    """Remove as variantes de `nome` encontradas no storage, sem depender da descrição gravada"""
+    diretorio, arquivo = os.path.split(nome)
+    raiz = os.path.splitext(arquivo)[0]
+    try:
+        _, arquivos = storage.listdir(diretorio)
+    except FileNotFoundError:
+        return
+    for outro in arquivos:
+        if outro.startswith(raiz + '.') and eh_variante(outro) and VARIANTE.sub('', outro) == raiz:
+            destino = f'{diretorio}/{outro}' if diretorio else outro
+            try:
+                storage.delete(destino)
+            except OSError as e:
+                logger.warning(f"Não foi possível remover a variante {destino}: {e}")
+
+def atualizar_variantes(obj, storage=default_storage):
+    """Gera as variantes do registro e grava a descrição, sem disparar signals"""
+    model = type(obj)
+    campo_imagem, campo_variantes = CAMPOS[model.__name__]
+    nome = getattr(obj, campo_imagem).name
+    if not nome:
+        return None
+    # Com o armazenamento por conteúdo, outro registro pode já usar o mesmo arquivo
+    variantes = (
+        model.objects.filter(**{campo_imagem: nome}).exclude(pk=obj.pk).exclude(**{campo_variantes: {}})
+        .values_list(campo_variantes, flat=True).first()
+    ) or gerar_variantes(nome, storage)
+    model.objects.filter(pk=obj.pk).update(**{campo_variantes: variantes})
+    setattr(obj, campo_variantes, variantes)
+    if hasattr(obj, 'instrumento_id'):
+        # O bloco de fotos em cache ainda aponta só para o original
+        fotos.invalidar(obj.instrumento_id)
+    return variantes
+
+# Pool de geração
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGEM_WORKERS, thread_name_prefix='imagens')
+    return _executor
+
+def _processar(model, pk):
+    try:
+        obj = model.objects.filter(pk=pk).first()
+        if obj is not None:
+            atualizar_variantes(obj)
+    except Exception:
+        logger.exception(f"Falha ao gerar as variantes de {model.__name__} {pk}")
+    finally:
+        close_old_connections()
+
+def agendar(model, pk):
+    """Gera as variantes do registro no pool (ou na hora, com IMAGEM_WORKERS = 0)"""
+    if settings.IMAGEM_WORKERS:
+        return _pool().submit(_processar, model, pk)
+    _processar(model, pk)
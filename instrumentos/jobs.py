@@ -0,0 +1,104 @@
+"""
+Fila de gerações com IA no próprio banco de dados, sem broker externo.
+
+A view apenas cria uma `GeracaoIA` pendente; o comando
+`processar_geracoes` reserva as gerações uma a uma e as executa. A reserva
+é um UPDATE condicional, seguro com vários workers em qualquer banco. Uma
+geração cujo worker parou de dar sinal por mais de AI_JOB_STALE_SECONDS é
+reservada de novo e retomada a partir das etapas já registradas.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import GeracaoIA
+from .ai_pipeline import PipelineIA
+from .ai_populate import popular
+from . import ai_cache
+
+logger = logging.getLogger(__name__)
+
+def nome_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enfileirar(tabelas, quantidade, ignorar_cache=False):
+    return GeracaoIA.objects.create(tabelas=list(tabelas), quantidade=quantidade, ignorar_cache=ignorar_cache)
+
+def _disponiveis(agora):
+    """Pendentes ou em execução com worker inativo"""
+    limite = agora - timedelta(seconds=settings.AI_JOB_STALE_SECONDS)
+    return Q(status=GeracaoIA.PENDENTE) | Q(status=GeracaoIA.EXECUTANDO, atualizado_em__lt=limite)
+
+def _abandonar_esgotadas(agora):
+    """Marca como falhas as gerações abandonadas que já esgotaram as tentativas"""
+    GeracaoIA.objects.filter(
+        _disponiveis(agora) & Q(status=GeracaoIA.EXECUTANDO),
+        tentativas__gte=settings.AI_JOB_MAX_ATTEMPTS,
+    ).update(
+        status=GeracaoIA.FALHOU,
+        erro='Worker interrompido; tentativas esgotadas',
+        concluido_em=agora,
+        atualizado_em=agora,
+    )
+
+def reservar_proxima(worker=None):
+    """Reserva a geração disponível mais antiga, ou retorna None"""
+    agora = timezone.now()
+    _abandonar_esgotadas(agora)
+    candidatas = GeracaoIA.objects.filter(_disponiveis(agora)).order_by('created_at', 'pk')
+    for pk in candidatas.values_list('pk', flat=True)[:10]:
+        reservadas = GeracaoIA.objects.filter(_disponiveis(agora), pk=pk).update(
+            status=GeracaoIA.EXECUTANDO,
+            worker=worker or nome_worker(),
+            tentativas=F('tentativas') + 1,
+            atualizado_em=agora,
+        )
+        if reservadas:
+            geracao = GeracaoIA.objects.get(pk=pk)
+            if geracao.iniciado_em is None:
+                geracao.atualizar_campos(iniciado_em=agora)
+            return geracao
+    return None
+
+def executar(geracao):
+    """Executa (ou retoma) uma geração reservada e grava o resultado"""
+    logger.info(f"Executando geração {geracao.pk}: {geracao.tabelas} x {geracao.quantidade}")
+    cache_antes = ai_cache.contadores()
+    try:
+        resultados = popular(
+            geracao.tabelas,
+            geracao.quantidade,
+            pipeline=PipelineIA(ao_progredir=geracao.atualizar_progresso, usar_cache=not geracao.ignorar_cache),
+            checkpoint=geracao,
+        )
+    except Exception as e:
+        logger.exception(f"Geração {geracao.pk} falhou")
+        geracao.atualizar_campos(status=GeracaoIA.FALHOU, erro=str(e), concluido_em=timezone.now())
+    else:
+        geracao.atualizar_campos(status=GeracaoIA.CONCLUIDA, resultados=resultados, concluido_em=timezone.now())
+    cache_depois = ai_cache.contadores()
+    logger.info(
+        f"Geração {geracao.pk}: cache de IA com {cache_depois['hits'] - cache_antes['hits']} acertos "
+        f"e {cache_depois['misses'] - cache_antes['misses']} faltas"
+    )
+    return geracao
+
+def processar_fila(worker=None, uma_vez=False, intervalo=5):
+    """
+    Processa gerações até a fila esvaziar (`uma_vez`) ou indefinidamente,
+    consultando a fila a cada `intervalo` segundos. Retorna quantas executou.
+    """
+    executadas = 0
+    while True:
+        geracao = reservar_proxima(worker)
+        if geracao is not None:
+            executar(geracao)
+            executadas += 1
+            continue
+        if uma_vez:
+            return executadas
+        time.sleep(intervalo)
@@ -0,0 +1,443 @@
+"""
+Descoberta do logotipo de uma marca a partir do site oficial.
+
+Todas as requisições usam uma sessão `requests` compartilhada, com pool de
+conexões keep-alive. Da página inicial são lidos no máximo
+LOGO_HTML_MAX_BYTES. Os candidatos encontrados nela (og:image, imagens com
+"logo" no nome etc.) são verificados em paralelo com HEAD, e a busca termina
+no primeiro aceitável ou quando o prazo total (LOGO_PRAZO) acaba. O logo
+encontrado fica no cache do Django por domínio; "nenhum logo" só quando a
+busca foi até o fim, sem prazo esgotado nem erros de rede ou do servidor.
+
+`preencher_logos` (comando `preencher_logos`) faz isso para todas as marcas
+sem logotipo: resolve várias marcas ao mesmo tempo, baixa e normaliza as
+imagens e grava em `logos/`, registrando num arquivo de checkpoint as marcas
+já processadas para que uma execução interrompida seja retomada.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as PrazoEsgotado
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image, ImageFile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.text import slugify
+from .models import Marca
+from . import imagens, midia
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Padrões comuns de nomes de logos
+PADROES_LOGO = ['logo', 'brand', 'header-image', 'site-logo']
+
+# Fallback: favicon em alta resolução
+FAVICONS = [
+    '/favicon-32x32.png',
+    '/favicon-96x96.png',
+    '/apple-touch-icon.png',
+    '/apple-touch-icon-precomposed.png',
+    '/favicon.ico'
+]
+
+# Logo deve ter tamanho razoável
+TAMANHO_MINIMO = 100
+
+# Menor timeout passado ao requests, que não aceita zero (segundos)
+TIMEOUT_MINIMO = 0.01
+
+# Começo de uma imagem lido para conhecer as dimensões (bytes)
+BYTES_DIMENSOES = 64 * 1024
+
+# Mapeamento de marcas para seus domínios
+DOMINIOS_CONHECIDOS = {
+    'fender': 'fender.com',
+    'gibson': 'gibson.com',
+    'ibanez': 'ibanez.com',
+    'yamaha': 'yamaha.com',
+    'roland': 'roland.com',
+    'marshall': 'marshall.com',
+    'gretsch': 'gretsch.com',
+    'epiphone': 'epiphone.com',
+    'esp': 'espguitars.com',
+    'prs': 'prsguitars.com',
+    'jackson': 'jacksonguitars.com',
+    'schecter': 'schecterguitars.com',
+    'dean': 'deanguitars.com',
+    'washburn': 'washburn.com',
+    'bc rich': 'bcrich.com',
+    'cort': 'cortguitars.com',
+    'kramer': 'kramerguitars.com',
+    'guild': 'guildguitars.com',
+    'rickenbacker': 'rickenbacker.com',
+    'charvel': 'charvel.com',
+    'evh': 'evhgear.com',
+    'ernie ball': 'ernieball.com',
+    'music man': 'music-man.com',
+    'squier': 'fender.com/squier',
+    'martin': 'martinguitar.com',
+    'taylor': 'taylorguitars.com',
+    'zildjian': 'zildjian.com',
+    'sabian': 'sabian.com',
+    'pearl': 'pearldrum.com'
+}
+
+def dominio_da_marca(marca_nome):
+    """Domínio conhecido da marca, pelo nome exato ou por correspondência parcial"""
+    nome = marca_nome.lower()
+    dominio = DOMINIOS_CONHECIDOS.get(nome)
+    if not dominio:
+        for marca_conhecida, dominio_conhecido in DOMINIOS_CONHECIDOS.items():
+            if marca_conhecida in nome or nome in marca_conhecida:
+                return dominio_conhecido
+    return dominio
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+def sessao():
+    """Sessão compartilhada entre as threads, com uma conexão por worker no pool"""
+    global _sessao
+    with _sessao_lock:
+        if _sessao is None:
+            _sessao = requests.Session()
+            adaptador = requests.adapters.HTTPAdapter(
+                pool_connections=settings.LOGO_CONCORRENCIA, pool_maxsize=settings.LOGO_CONCORRENCIA
+            )
+            _sessao.mount('http://', adaptador)
+            _sessao.mount('https://', adaptador)
+            _sessao.headers['User-Agent'] = USER_AGENT
+    return _sessao
+
+class Prazo:
+    """
+    Tempo restante de uma busca; cada requisição usa no máximo o que sobra.
+    Quem faz uma requisição confere `disponivel()` antes: o requests recusa
+    timeout zero com ValueError, que não é um RequestException. `incompleta`
+    marca a busca que não teve uma resposta definitiva (prazo esgotado, erro
+    de rede ou do servidor): o seu "nenhum logo" não vai para o cache.
+    """
+
+    def __init__(self, segundos):
+        self.fim = time.monotonic() + segundos
+        self.incompleta = False
+
+    def restante(self):
+        return max(0.0, self.fim - time.monotonic())
+
+    def timeout(self):
+        # O prazo pode acabar entre a conferência e a requisição
+        return max(TIMEOUT_MINIMO, min(settings.LOGO_TIMEOUT, self.restante()))
+
+    @property
+    def esgotado(self):
+        return self.restante() <= 0
+
+    def disponivel(self):
+        """Se ainda há tempo para uma requisição; sem tempo, a busca fica incompleta"""
+        if self.esgotado:
+            self.incompleta = True
+            return False
+        return True
+
+def extrair_candidatos(html, site_url):
+    """URLs de possíveis logos na página, na ordem de preferência"""
+    soup = BeautifulSoup(html, 'html.parser')
+    candidatos = []
+
+    # 1. Verifica meta tags (Open Graph/Twitter)
+    for meta in soup.find_all('meta', property=['og:image', 'twitter:image']):
+        if meta.get('content'):
+            candidatos.append(urljoin(site_url, meta['content']))
+
+    # 2. Busca imagens com 'logo' no nome/alt/class
+    for img in soup.find_all('img', src=True):
+        src = img['src']
+        alt = img.get('alt', '').lower()
+        class_name = ' '.join(img.get('class', [])).lower()
+        if any(padrao in src.lower() or padrao in alt or padrao in class_name for padrao in PADROES_LOGO):
+            candidatos.append(urljoin(site_url, src))
+
+    # 3. Busca SVGs (comum para logos)
+    for svg in soup.find_all(['svg', 'object'], class_=True):
+        if any(padrao in ' '.join(svg.get('class', [])).lower() for padrao in ['logo', 'brand']):
+            if svg.get('data'):
+                candidatos.append(urljoin(site_url, svg['data']))
+
+    return list(dict.fromkeys(candidatos))
+
+def _dimensoes(resposta):
+    """Lê só o começo da imagem, até o cabeçalho informar largura e altura"""
+    parser = ImageFile.Parser()
+    for pedaco in resposta.iter_content(4096):
+        parser.feed(pedaco)
+        if parser.image:
+            return parser.image.size
+    return None
+
+def _ok(resposta, prazo):
+    """Se a resposta é 200 (ou 206, de um GET parcial); erros do servidor deixam a busca incompleta"""
+    if resposta.status_code >= 500 or resposta.status_code == 429:
+        prazo.incompleta = True
+    return resposta.status_code in (200, 206)
+
+def _head(url, prazo):
+    """
+    HEAD seguindo redirecionamentos. Servidores que recusam HEAD (405)
+    recebem um GET em stream, fechado sem ler o corpo.
+    """
+    resposta = sessao().head(url, timeout=prazo.timeout(), allow_redirects=True)
+    if resposta.status_code == 405 and prazo.disponivel():
+        resposta = sessao().get(url, stream=True, timeout=prazo.timeout())
+        resposta.close()
+    return resposta
+
+def verificar_imagem(url, prazo):
+    """
+    Retorna a URL se for um SVG ou uma imagem de pelo menos TAMANHO_MINIMO
+    pixels. O HEAD descarta o que não existe ou não é imagem; das imagens
+    rasterizadas, um GET parcial lê só o começo, até as dimensões.
+    """
+    if not prazo.disponivel():
+        return None
+    resposta = _head(url, prazo)
+    if not _ok(resposta, prazo):
+        return None
+    content_type = resposta.headers.get('content-type', '').lower()
+    if 'svg' in content_type:
+        return url
+    if 'image' not in content_type or not prazo.disponivel():
+        return None
+    intervalo = {'Range': f'bytes=0-{BYTES_DIMENSOES - 1}'}
+    with sessao().get(resposta.url, stream=True, timeout=prazo.timeout(), headers=intervalo) as resposta:
+        if not _ok(resposta, prazo):
+            return None
+        dimensoes = _dimensoes(resposta)
+    if dimensoes and min(dimensoes) >= TAMANHO_MINIMO:
+        return url
+    return None
+
+def verificar_existe(url, prazo):
+    """Retorna a URL se um HEAD (ou o GET, se o servidor recusar HEAD) responder 200"""
+    if not prazo.disponivel():
+        return None
+    return url if _ok(_head(url, prazo), prazo) else None
+
+def primeiro_aceito(verificar, urls, prazo):
+    """
+    Verifica as URLs em paralelo e retorna a primeira aceita por
+    `verificar(url, prazo)`, sem esperar as demais; None se nenhuma for
+    aceita dentro do prazo. Verificações ainda na fila são canceladas.
+    """
+    if not urls or not prazo.disponivel():
+        return None
+    executor = ThreadPoolExecutor(max_workers=min(settings.LOGO_CONCORRENCIA, len(urls)), thread_name_prefix='logo')
+    try:
+        futuros = {executor.submit(verificar, url, prazo): url for url in urls}
+        for futuro in as_completed(futuros, timeout=prazo.restante()):
+            try:
+                aceito = futuro.result()
+            except requests.RequestException as e:
+                prazo.incompleta = True
+                logger.debug(f"Candidato {futuros[futuro]} não pôde ser verificado: {e}")
+                continue
+            except Exception as e:
+                logger.debug(f"Candidato {futuros[futuro]} descartado: {e}")
+                continue
+            if aceito:
+                return aceito
+    except PrazoEsgotado:
+        prazo.incompleta = True
+        logger.info(f"Prazo esgotado verificando {len(urls)} candidatos a logo")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+def _ler_ate(resposta, limite):
+    """Corpo da resposta, parando de ler em `limite` bytes"""
+    corpo = bytearray()
+    for pedaco in resposta.iter_content(64 * 1024):
+        corpo += pedaco[:limite - len(corpo)]
+        if len(corpo) >= limite:
+            break
+    return bytes(corpo)
+
+def buscar_logo_no_site(site_url, prazo=None):
+    """
+    Busca logo no site usando várias estratégias; os favicons só são
+    verificados se nenhum candidato da página servir.
+    """
+    prazo = prazo or Prazo(settings.LOGO_PRAZO)
+    candidatos = []
+    if not prazo.disponivel():
+        return None
+    try:
+        with sessao().get(site_url, stream=True, timeout=prazo.timeout()) as resposta:
+            if _ok(resposta, prazo):
+                candidatos = extrair_candidatos(_ler_ate(resposta, settings.LOGO_HTML_MAX_BYTES), site_url)
+    except requests.RequestException as e:
+        prazo.incompleta = True
+        logger.error(f"Erro ao buscar logo no site {site_url}: {str(e)}")
+
+    return (
+        primeiro_aceito(verificar_imagem, candidatos, prazo)
+        or primeiro_aceito(verificar_existe, [urljoin(site_url, favicon) for favicon in FAVICONS], prazo)
+    )
+
+def descobrir_logo(site_url):
+    """
+    Logo do domínio de `site_url`: o Clearbit (LOGO_CLEARBIT_URL) primeiro e
+    depois o próprio site, dentro de um único prazo. Usa o cache por domínio;
+    uma busca incompleta sem logo não é guardada e se repete na próxima vez.
+    """
+    dominio = urlparse(site_url).netloc
+    chave = f'logo:{dominio}'
+    url = cache.get(chave)
+    if url is not None:
+        return url or None
+
+    prazo = Prazo(settings.LOGO_PRAZO)
+    url = None
+    if settings.LOGO_CLEARBIT_URL:
+        try:
+            url = verificar_existe(settings.LOGO_CLEARBIT_URL.format(dominio=dominio), prazo)
+        except requests.RequestException as e:
+            prazo.incompleta = True
+            logger.debug(f"Clearbit indisponível para {dominio}: {e}")
+    url = url or buscar_logo_no_site(site_url, prazo)
+
+    if url or not prazo.incompleta:
+        cache.set(chave, url or '', settings.LOGO_CACHE_TTL)
+    return url
+
+# Preenchimento em lote
+
+def site_da_marca(marca):
+    """Site usado para procurar o logo: o cadastrado ou o de um domínio conhecido"""
+    if marca.site:
+        return marca.site
+    dominio = dominio_da_marca(marca.nome)
+    return f"https://{dominio}" if dominio else None
+
+def baixar_logo(url):
+    """
+    Baixa o logo e o normaliza: PNG com transparência preservada, reduzido
+    para caber em LOGO_TAMANHO_MAXIMO pixels. SVGs são mantidos como estão.
+    Retorna (extensão, bytes); levanta ValueError se não for uma imagem.
+    """
+    with sessao().get(url, stream=True, timeout=settings.LOGO_TIMEOUT) as resposta:
+        resposta.raise_for_status()
+        conteudo = BytesIO()
+        for pedaco in resposta.iter_content(64 * 1024):
+            conteudo.write(pedaco)
+            if conteudo.tell() > settings.LOGO_MAX_BYTES:
+                raise ValueError(f"Logo maior que {settings.LOGO_MAX_BYTES} bytes")
+        content_type = resposta.headers.get('content-type', '').lower()
+
+    if 'svg' in content_type:
+        return 'svg', conteudo.getvalue()
+    conteudo.seek(0)
+    try:
+        imagem = Image.open(conteudo)
+        imagem.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Imagem inválida: {e}")
+    imagem = imagem.convert('RGBA')
+    imagem.thumbnail((settings.LOGO_TAMANHO_MAXIMO, settings.LOGO_TAMANHO_MAXIMO))
+    saida = BytesIO()
+    imagem.save(saida, 'PNG', optimize=True)
+    return 'png', saida.getvalue()
+
+def resolver_logo(marca):
+    """Busca e baixa o logo de uma marca (roda nas threads de trabalho, sem tocar no banco)"""
+    site = site_da_marca(marca)
+    if not site:
+        return None
+    url = descobrir_logo(site)
+    if not url:
+        return None
+    extensao, conteudo = baixar_logo(url)
+    return f"{slugify(marca.nome) or marca.pk}.{extensao}", conteudo
+
+class CheckpointArquivo:
+    """Marcas já processadas (pk -> situação), gravadas num arquivo JSON"""
+
+    def __init__(self, caminho):
+        self.caminho = Path(caminho)
+        try:
+            self.processadas = json.loads(self.caminho.read_text())
+        except (OSError, ValueError):
+            self.processadas = {}
+
+    def registrar(self, pk, situacao):
+        self.processadas[str(pk)] = situacao
+
+    def salvar(self):
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(dir=self.caminho.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.processadas, f)
+        os.replace(temporario, self.caminho)
+
+def preencher_logos(checkpoint, concorrencia=None, repetir_falhas=False, ao_progredir=None, salvar_a_cada=10):
+    """
+    Resolve o logo de todas as marcas sem logotipo, `concorrencia` marcas
+    por vez, e grava os arquivos na thread que chamou. Marcas registradas no
+    checkpoint são puladas (as sem logo ou com erro só com `repetir_falhas`).
+    `ao_progredir(resumo)` é chamada a cada marca. Retorna o resumo.
+    """
+    marcas = Marca.objects.filter(logotipo__in=['', None]).only('pk', 'nome', 'site').order_by('pk')
+    ignorar = {
+        pk for pk, situacao in checkpoint.processadas.items()
+        if situacao == 'salvo' or not repetir_falhas
+    }
+    pendentes = [marca for marca in marcas if str(marca.pk) not in ignorar]
+    resumo = {'total': len(pendentes), 'processadas': 0, 'salvos': 0, 'sem_logo': 0, 'erros': 0, 'por_segundo': 0.0}
+    inicio = time.monotonic()
+
+    executor = ThreadPoolExecutor(max_workers=concorrencia or settings.LOGO_CONCORRENCIA, thread_name_prefix='logos')
+    try:
+        futuros = {executor.submit(resolver_logo, marca): marca for marca in pendentes}
+        for futuro in as_completed(futuros):
+            marca = futuros[futuro]
+            try:
+                logo = futuro.result()
+                if logo:
+                    nome, conteudo = logo
+                    marca.logotipo.save(nome, ContentFile(conteudo), save=False)
+                    with transaction.atomic():
+                        Marca.objects.filter(pk=marca.pk).update(logotipo=marca.logotipo.name)
+                        midia.referenciar(marca.logotipo.name)
+                    # SVG é vetorial: as variantes só existem para imagens rasterizadas
+                    if not nome.endswith('.svg'):
+                        imagens.agendar(Marca, marca.pk)
+                    situacao, contador = 'salvo', 'salvos'
+                else:
+                    situacao, contador = 'sem_logo', 'sem_logo'
+            except Exception as e:
+                logger.warning(f"Logo de {marca.nome} não foi salvo: {e}")
+                situacao, contador = 'erro', 'erros'
+
+            checkpoint.registrar(marca.pk, situacao)
+            resumo[contador] += 1
+            resumo['processadas'] += 1
+            resumo['por_segundo'] = round(resumo['processadas'] / max(time.monotonic() - inicio, 1e-6), 2)
+            if resumo['processadas'] % salvar_a_cada == 0:
+                checkpoint.salvar()
+            if ao_progredir:
+                ao_progredir(dict(resumo))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        checkpoint.salvar()
+    return resumo
@@ -0,0 +1,105 @@
+import json
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from instrumentos import benchmark, sintetico
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latência e consultas SQL das páginas e APIs de leitura sobre catálogos sintéticos '
+        'de cada tamanho, num banco de teste separado, e compara com a linha de base'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanhos', nargs='+', default=['1k', '100k'], help='Tamanhos do catálogo (1k, 100k, 1m ou números)'
+        )
+        parser.add_argument('--repeticoes', type=int, default=5, help='Requests com os caches quentes por rota')
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--saida', default=str(settings.BASE_DIR / 'cache' / 'benchmark.json'), help='Relatório em JSON')
+        parser.add_argument('--base', default=str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'), help='Linha de base')
+        parser.add_argument('--salvar-base', action='store_true', help='Grava o resultado como a nova linha de base')
+        parser.add_argument(
+            '--latencia', action='store_true',
+            help='Compara também as medianas, se a linha de base foi medida no mesmo ambiente'
+        )
+        parser.add_argument('--tolerancia', type=float, default=0.5, help='Aumento relativo da mediana aceito')
+        parser.add_argument('--folga-ms', type=float, default=5.0, help='Aumento absoluto da mediana aceito')
+        parser.add_argument('--manter-banco', action='store_true', help='Reaproveita o banco de teste entre execuções')
+
+    def handle(self, *args, **options):
+        try:
+            tamanhos = {nome: sintetico.tamanho(nome) for nome in options['tamanhos']}
+        except ValueError as e:
+            raise CommandError(f'Tamanho inválido: {e}')
+
+        relatorio = {
+            'gerado_em': timezone.now().isoformat(),
+            'semente': options['semente'],
+            'repeticoes': options['repeticoes'],
+            'ambiente': benchmark.ambiente(),
+            'tamanhos': {},
+        }
+        # Banco de teste e cache local: o catálogo e os caches de produção não são tocados
+        setup_test_environment()
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['manter_banco'])
+        try:
+            with override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+                ORCAMENTO_CONSULTAS=False,
+            ):
+                for nome, instrumentos in tamanhos.items():
+                    relatorio['tamanhos'][nome] = self.medir_tamanho(nome, instrumentos, options)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0, keepdb=options['manter_banco'])
+            teardown_test_environment()
+
+        saida = Path(options['saida'])
+        saida.parent.mkdir(parents=True, exist_ok=True)
+        saida.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False))
+        self.stdout.write(f'Relatório gravado em {saida}')
+
+        base = Path(options['base'])
+        if options['salvar_base']:
+            base.parent.mkdir(parents=True, exist_ok=True)
+            base.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False))
+            self.stdout.write(self.style.SUCCESS(f'Linha de base gravada em {base}'))
+            return
+        if not base.exists():
+            self.stdout.write(self.style.WARNING(f'Sem linha de base em {base}; use --salvar-base para criar'))
+            return
+        linha_de_base = json.loads(base.read_text())
+        if options['latencia'] and not benchmark.mesmo_ambiente(relatorio, linha_de_base):
+            self.stdout.write(self.style.WARNING(
+                'A linha de base foi medida em outro ambiente; só as consultas são comparadas'
+            ))
+        regressoes = benchmark.comparar(
+            relatorio, linha_de_base, latencia=options['latencia'],
+            tolerancia=options['tolerancia'], folga_ms=options['folga_ms'],
+        )
+        if regressoes:
+            for regressao in regressoes:
+                self.stdout.write(self.style.ERROR(regressao))
+            raise CommandError(f'{len(regressoes)} regressões em relação a {base}')
+        self.stdout.write(self.style.SUCCESS('Nenhuma regressão em relação à linha de base'))
+
+    def medir_tamanho(self, nome, instrumentos, options):
+        self.stdout.write(f'{nome}: gerando {instrumentos} instrumentos...')
+        sintetico.limpar()
+        inicio = time.perf_counter()
+        criados = sintetico.gerar(instrumentos, semente=options['semente'])
+        geracao = time.perf_counter() - inicio
+
+        rotas = benchmark.medir(repeticoes=options['repeticoes'])
+        for rota, medicao in rotas.items():
+            self.stdout.write(
+                f"  {rota:<28} {medicao['status']} {medicao['consultas_frio']:>3}/{medicao['consultas']:<3} consultas "
+                f"frio {medicao['frio_ms']:>9.2f} ms  mediana {medicao['mediana_ms']:>9.2f} ms"
+            )
+        return {'registros': criados, 'geracao_s': round(geracao, 2), 'rotas': rotas}
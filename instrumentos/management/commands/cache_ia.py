@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from instrumentos import ai_cache
+
+
+class Command(BaseCommand):
+    help = 'Mostra o tamanho do cache de respostas da IA, remove entradas antigas ou o esvazia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limpar', action='store_true', help='Remove todas as entradas do cache')
+        parser.add_argument('--despejar', action='store_true', help='Aplica o limite AI_CACHE_MAX_BYTES agora')
+
+    def handle(self, *args, **options):
+        if options['limpar']:
+            self.stdout.write(f'{ai_cache.limpar()} entradas removidas')
+        elif options['despejar']:
+            self.stdout.write(f'{ai_cache.despejar()} entradas antigas removidas')
+        estatisticas = ai_cache.estatisticas()
+        self.stdout.write(f"{estatisticas['entradas']} entradas, {estatisticas['bytes'] / 1024:.1f} KB")
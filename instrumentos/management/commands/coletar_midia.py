@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from instrumentos import midia
+
+
+class Command(BaseCommand):
+    help = 'Remove as fotos e logotipos que nenhum registro usa mais, junto com as suas variantes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--carencia', type=int, default=settings.MIDIA_CARENCIA,
+            help='Não remove arquivos modificados há menos que estes segundos'
+        )
+        parser.add_argument(
+            '--varrer', action='store_true',
+            help='Também procura nos diretórios de upload arquivos que nenhum registro conhece'
+        )
+        parser.add_argument('--recalcular', action='store_true', help='Reconstrói as contagens de referências antes')
+        parser.add_argument('--simular', action='store_true', help='Só informa o que seria removido')
+
+    def handle(self, *args, **options):
+        if options['recalcular']:
+            em_uso = midia.recalcular()
+            self.stdout.write(f'{em_uso} arquivos em uso')
+        resultado = midia.coletar(
+            carencia=options['carencia'], varrer=options['varrer'], simular=options['simular']
+        )
+        acao = 'seriam removidos' if options['simular'] else 'removidos'
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['removidos']} arquivos {acao} ({resultado['bytes'] / 1024:.1f} KB), "
+            f"{resultado['mantidos']} mantidos"
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from instrumentos import sintetico
+
+
+class Command(BaseCommand):
+    help = 'Gera um catálogo sintético determinístico (sem a OpenAI) para testes de carga e benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tamanho', help="Número de instrumentos: 1k, 100k, 1m ou um número")
+        parser.add_argument('--semente', type=int, default=42, help='Semente do gerador (mesma semente, mesmo catálogo)')
+        parser.add_argument('--lote', type=int, default=5000, help='Instrumentos por bulk_create')
+        parser.add_argument('--limpar', action='store_true', help='Apaga o catálogo existente antes (sem confirmação)')
+        parser.add_argument('--sem-indice', action='store_true', help='Não reconstrói o índice de busca no fim')
+
+    def handle(self, *args, **options):
+        try:
+            instrumentos = sintetico.tamanho(options['tamanho'])
+        except ValueError:
+            raise CommandError(f"Tamanho inválido: {options['tamanho']}")
+        if options['limpar']:
+            sintetico.limpar()
+
+        def progresso(gravados, total):
+            self.stdout.write(f'{gravados}/{total} instrumentos', ending='\r')
+
+        try:
+            criados = sintetico.gerar(
+                instrumentos, semente=options['semente'], tamanho_lote=options['lote'],
+                reindexar=not options['sem_indice'], progresso=progresso,
+            )
+        except sintetico.CatalogoNaoVazio as e:
+            raise CommandError(f'{e} (use --limpar)')
+        self.stdout.write('')
+        for tabela, total in criados.items():
+            self.stdout.write(f'{tabela}: {total}')
+        self.stdout.write(self.style.SUCCESS('Catálogo sintético gerado com sucesso!'))
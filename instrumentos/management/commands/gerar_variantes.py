@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from instrumentos import imagens
+from instrumentos.models import FotoInstrumento, Marca
+
+
+class Command(BaseCommand):
+    help = 'Gera as variantes responsivas das fotos e logotipos que ainda não as têm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Imagens processadas ao mesmo tempo')
+        parser.add_argument('--forcar', action='store_true', help='Gera de novo mesmo as que já têm variantes')
+
+    def handle(self, *args, **options):
+        for model in (FotoInstrumento, Marca):
+            campo_imagem, campo_variantes = imagens.CAMPOS[model.__name__]
+            registros = model.objects.exclude(**{campo_imagem: ''}).exclude(**{f'{campo_imagem}__isnull': True})
+            if not options['forcar']:
+                registros = registros.filter(**{campo_variantes: {}})
+            registros = list(registros.only('pk', campo_imagem))
+
+            geradas = erros = 0
+            # O pool só lê e grava arquivos; o banco é atualizado aqui, na thread principal
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                futuros = {
+                    pool.submit(imagens.gerar_variantes, getattr(obj, campo_imagem).name): obj
+                    for obj in registros
+                }
+                for futuro in as_completed(futuros):
+                    obj = futuros[futuro]
+                    try:
+                        variantes = futuro.result()
+                    except Exception as e:
+                        erros += 1
+                        self.stderr.write(f"{model.__name__} {obj.pk}: {e}")
+                        continue
+                    model.objects.filter(pk=obj.pk).update(**{campo_variantes: variantes})
+                    geradas += 1
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{model._meta.verbose_name_plural}: {geradas} com variantes geradas, {erros} erros"
+            ))
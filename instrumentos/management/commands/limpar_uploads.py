@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from instrumentos.uploads import limpar_abandonados
+
+
+class Command(BaseCommand):
+    help = 'Remove os uploads de fotos em pedaços abandonados e os seus arquivos parciais'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horas', type=int, help='Uploads sem atividade há mais que estas horas (padrão: UPLOAD_ABANDONO_HORAS)'
+        )
+
+    def handle(self, *args, **options):
+        removidos = limpar_abandonados(options['horas'])
+        self.stdout.write(self.style.SUCCESS(f'{removidos} uploads abandonados removidos'))
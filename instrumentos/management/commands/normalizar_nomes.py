@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from instrumentos.search import normalizar_nomes
+
+
+class Command(BaseCommand):
+    help = 'Preenche a coluna nome_normalizado (sem acentos e em minúsculas) de todo o catálogo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help='Registros por bulk_update')
+
+    def handle(self, *args, **options):
+        for tipo, total in normalizar_nomes(tamanho_lote=options['lote']).items():
+            self.stdout.write(f'{tipo}: {total} registros atualizados')
+        self.stdout.write(self.style.SUCCESS('Nomes normalizados com sucesso!'))
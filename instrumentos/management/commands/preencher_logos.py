@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from instrumentos.logos import CheckpointArquivo, preencher_logos
+
+
+class Command(BaseCommand):
+    help = 'Busca, baixa e grava o logotipo de todas as marcas que ainda não têm um'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concorrencia', type=int, default=4, help='Marcas resolvidas ao mesmo tempo')
+        parser.add_argument(
+            '--checkpoint', default=str(settings.BASE_DIR / 'cache' / 'preencher_logos.json'),
+            help='Arquivo com as marcas já processadas, usado para retomar a execução'
+        )
+        parser.add_argument('--repetir-falhas', action='store_true', help='Tenta de novo as marcas sem logo ou com erro')
+        parser.add_argument('--reiniciar', action='store_true', help='Ignora o checkpoint existente')
+        parser.add_argument('--relatorio', type=int, default=25, help='Mostra o andamento a cada N marcas')
+
+    def handle(self, *args, **options):
+        checkpoint = CheckpointArquivo(options['checkpoint'])
+        if options['reiniciar']:
+            checkpoint.processadas = {}
+
+        def ao_progredir(resumo):
+            if resumo['processadas'] % options['relatorio'] == 0:
+                self.stdout.write(self.linha(resumo))
+
+        resumo = preencher_logos(
+            checkpoint,
+            concorrencia=options['concorrencia'],
+            repetir_falhas=options['repetir_falhas'],
+            ao_progredir=ao_progredir,
+        )
+        self.stdout.write(self.style.SUCCESS(self.linha(resumo)))
+
+    def linha(self, resumo):
+        return (
+            f"{resumo['processadas']}/{resumo['total']} marcas: {resumo['salvos']} logos salvos, "
+            f"{resumo['sem_logo']} sem logo, {resumo['erros']} erros ({resumo['por_segundo']} marcas/s)"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from instrumentos.jobs import processar_fila
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de gerações com IA: executa e retoma as gerações enfileiradas pela página de IA'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true', help='Sai quando a fila estiver vazia')
+        parser.add_argument('--intervalo', type=float, default=5, help='Segundos entre consultas à fila vazia')
+
+    def handle(self, *args, **options):
+        executadas = processar_fila(uma_vez=options['uma_vez'], intervalo=options['intervalo'])
+        self.stdout.write(self.style.SUCCESS(f'{executadas} gerações processadas'))
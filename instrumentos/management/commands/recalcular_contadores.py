@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from instrumentos.counters import recalcular_contadores
+from instrumentos.dashboard import invalidar_estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói do zero os contadores de instrumentos de categorias, subcategorias, marcas e modelos'
+
+    def handle(self, *args, **options):
+        atualizados = recalcular_contadores()
+        invalidar_estatisticas()
+        for tabela, total in atualizados.items():
+            self.stdout.write(f'{tabela}: {total} registros recalculados')
+        self.stdout.write(self.style.SUCCESS('Contadores recalculados com sucesso!'))
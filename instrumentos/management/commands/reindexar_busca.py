@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from instrumentos.search import reindexar, disponivel
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de busca textual (FTS5) do catálogo'
+
+    def handle(self, *args, **options):
+        if not disponivel():
+            self.stdout.write(self.style.WARNING('Busca textual disponível apenas no SQLite; nada a fazer.'))
+            return
+        for tipo, total in reindexar().items():
+            self.stdout.write(f'{tipo}: {total} registros indexados')
+        self.stdout.write(self.style.SUCCESS('Índice de busca reconstruído com sucesso!'))
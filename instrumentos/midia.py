@@ -0,0 +1,126 @@
+"""
+Contagem de referências dos arquivos do armazenamento por conteúdo.
+
+Os signals de FotoInstrumento e Marca chamam `referenciar` quando um
+registro passa a usar um arquivo e `liberar` quando deixa de usar (troca de
+imagem ou exclusão), na mesma transação da gravação. Nada é apagado nessa
+hora: `coletar` (comando `coletar_midia`) remove depois os arquivos sem
+referências, junto com as variantes geradas por `imagens`. `recalcular`
+reconstrói as contagens a partir dos registros, como `recalcular_contadores`.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import ArquivoMidia, FotoInstrumento, Marca
+from . import imagens
+
+logger = logging.getLogger(__name__)
+
+# Modelos com arquivos no armazenamento por conteúdo
+MODELOS = (FotoInstrumento, Marca)
+
+def _ajustar(nome, delta):
+    atualizados = ArquivoMidia.objects.filter(nome=nome).update(
+        referencias=F('referencias') + delta, atualizado_em=timezone.now()
+    )
+    if not atualizados:
+        arquivo, criado = ArquivoMidia.objects.get_or_create(nome=nome, defaults={'referencias': max(delta, 0)})
+        if not criado:
+            _ajustar(nome, delta)
+
+def referenciar(nome):
+    if nome:
+        _ajustar(nome, 1)
+
+def liberar(nome):
+    if nome:
+        _ajustar(nome, -1)
+
+def _campo_imagem(model):
+    return model._meta.get_field(imagens.CAMPOS[model.__name__][0])
+
+def nomes_referenciados():
+    """Quantos registros usam cada arquivo, lido direto das tabelas"""
+    referencias = Counter()
+    for model in MODELOS:
+        campo = _campo_imagem(model).name
+        nomes = model.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+        referencias.update(nomes.values_list(campo, flat=True))
+    return referencias
+
+def recalcular():
+    """Reconstrói as contagens do zero; retorna quantos arquivos estão em uso"""
+    referencias = nomes_referenciados()
+    with transaction.atomic():
+        ArquivoMidia.objects.exclude(nome__in=list(referencias)).update(referencias=0)
+        existentes = set(ArquivoMidia.objects.filter(nome__in=list(referencias)).values_list('nome', flat=True))
+        ArquivoMidia.objects.bulk_create(
+            [ArquivoMidia(nome=nome, referencias=total) for nome, total in referencias.items() if nome not in existentes]
+        )
+        for nome in existentes:
+            ArquivoMidia.objects.filter(nome=nome).update(referencias=referencias[nome])
+    return len(referencias)
+
+def _arquivos_no_storage(storage, diretorio):
+    """Originais gravados sob `diretorio` (as variantes ficam de fora: vão junto com o original)"""
+    try:
+        subdiretorios, arquivos = storage.listdir(diretorio)
+    except FileNotFoundError:
+        return
+    for nome in arquivos:
+        caminho = f'{diretorio}/{nome}'
+        if not imagens.eh_variante(caminho) and not nome.endswith('.upload'):
+            yield caminho
+    for subdiretorio in subdiretorios:
+        yield from _arquivos_no_storage(storage, f'{diretorio}/{subdiretorio}')
+
+def coletar(carencia=3600, varrer=False, simular=False):
+    """
+    Remove os arquivos sem referências e as suas variantes. Com `varrer`,
+    também os arquivos dos diretórios de upload que nenhum registro conhece
+    (uploads antigos, transações desfeitas). Arquivos modificados há menos
+    de `carencia` segundos ficam, para não disputar com um upload em curso,
+    e a contagem é conferida com as tabelas antes de apagar qualquer coisa.
+    Retorna {'removidos', 'bytes', 'mantidos'}.
+    """
+    referenciados = nomes_referenciados()
+    candidatos = set(ArquivoMidia.objects.filter(referencias__lte=0).values_list('nome', flat=True))
+    # Todos os campos usam o mesmo armazenamento por conteúdo
+    storage = _campo_imagem(MODELOS[0]).storage
+    if varrer:
+        for diretorio in {_campo_imagem(model).upload_to.rstrip('/') for model in MODELOS}:
+            candidatos.update(_arquivos_no_storage(storage, diretorio))
+
+    limite = time.time() - carencia
+    resultado = {'removidos': 0, 'bytes': 0, 'mantidos': 0}
+    for nome in sorted(candidatos):
+        if referenciados[nome]:
+            # Contagem defasada (ex.: loaddata): corrige em vez de apagar
+            if not simular:
+                ArquivoMidia.objects.update_or_create(nome=nome, defaults={'referencias': referenciados[nome]})
+            resultado['mantidos'] += 1
+            continue
+        caminho = storage.path(nome)
+        try:
+            estado = os.stat(caminho)
+        except FileNotFoundError:
+            estado = None
+        if estado and estado.st_mtime > limite:
+            resultado['mantidos'] += 1
+            continue
+
+        if estado:
+            resultado['removidos'] += 1
+            resultado['bytes'] += estado.st_size
+        if simular:
+            continue
+        if estado:
+            storage.delete(nome)
+            imagens.remover_variantes(nome, storage)
+            logger.info(f"Arquivo sem referências removido: {nome}")
+        ArquivoMidia.objects.filter(nome=nome, referencias__lte=0).delete()
+    return resultado
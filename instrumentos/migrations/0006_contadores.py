@@ -0,0 +1,122 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def _totais_por(Instrumento, campo):
+    instrumentos = Instrumento.objects.filter(**{campo: OuterRef('pk')}).order_by().values(campo)
+    decimal = models.DecimalField(max_digits=14, decimal_places=2)
+    return {
+        'total_instrumentos': Coalesce(
+            Subquery(instrumentos.annotate(total=Count('pk')).values('total'), output_field=models.IntegerField()),
+            0
+        ),
+        'total_preco': Coalesce(
+            Subquery(instrumentos.annotate(total=Sum('preco')).values('total'), output_field=decimal),
+            Decimal('0'), output_field=decimal
+        ),
+        'total_valor_venda': Coalesce(
+            Subquery(instrumentos.annotate(total=Sum('valor_venda')).values('total'), output_field=decimal),
+            Decimal('0'), output_field=decimal
+        ),
+    }
+
+
+def popular_contadores(apps, schema_editor):
+    """Calcula os contadores a partir dos dados, com um UPDATE por tabela"""
+    Categoria = apps.get_model('instrumentos', 'Categoria')
+    SubCategoria = apps.get_model('instrumentos', 'SubCategoria')
+    Marca = apps.get_model('instrumentos', 'Marca')
+    Modelo = apps.get_model('instrumentos', 'Modelo')
+    Instrumento = apps.get_model('instrumentos', 'Instrumento')
+
+    subcategorias = SubCategoria.objects.filter(categoria=OuterRef('pk')).order_by().values('categoria')
+    Modelo.objects.update(**_totais_por(Instrumento, 'modelo'))
+    SubCategoria.objects.update(**_totais_por(Instrumento, 'modelo__subcategoria'))
+    Marca.objects.update(**_totais_por(Instrumento, 'modelo__marca'))
+    Categoria.objects.update(
+        total_subcategorias=Coalesce(
+            Subquery(subcategorias.annotate(total=Count('pk')).values('total'), output_field=models.IntegerField()),
+            0
+        ),
+        **_totais_por(Instrumento, 'modelo__subcategoria__categoria')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0005_alter_fotoinstrumento_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='total_instrumentos',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='total_preco',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='total_subcategorias',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='total_valor_venda',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='marca',
+            name='total_instrumentos',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='marca',
+            name='total_preco',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='marca',
+            name='total_valor_venda',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='modelo',
+            name='total_instrumentos',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='modelo',
+            name='total_preco',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='modelo',
+            name='total_valor_venda',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='subcategoria',
+            name='total_instrumentos',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subcategoria',
+            name='total_preco',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='subcategoria',
+            name='total_valor_venda',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.RunPython(popular_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0006_contadores'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['-created_at', 'id'], name='instr_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['status', '-created_at', 'id'], name='instr_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['estado', '-created_at', 'id'], name='instr_estado_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['marca', '-created_at', 'id'], name='instr_marca_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['modelo', '-created_at', 'id'], name='instr_modelo_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['categoria', '-created_at', 'id'], name='instr_categoria_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumento',
+            index=models.Index(fields=['numero_serie'], name='instr_numero_serie_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='modelo',
+            index=models.Index(fields=['marca', 'nome'], name='modelo_marca_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subcategoria',
+            index=models.Index(fields=['categoria', 'nome'], name='subcat_categoria_nome_idx'),
+        ),
+    ]
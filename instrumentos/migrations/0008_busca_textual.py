@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# Cópia fixa do esquema de instrumentos.search neste ponto do histórico
+CRIAR_TABELA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS instrumentos_busca USING fts5(
+    nome, descricao, extra,
+    tokenize = "unicode61 remove_diacritics 2"
+)
+"""
+INSERIR = "INSERT OR REPLACE INTO instrumentos_busca (rowid, nome, descricao, extra) VALUES (%s, %s, %s, %s)"
+OTIMIZAR = "INSERT INTO instrumentos_busca (instrumentos_busca) VALUES ('optimize')"
+REMOVER_TABELA = "DROP TABLE IF EXISTS instrumentos_busca"
+
+# modelo -> (código no rowid, campo do valor extra)
+TIPOS = {
+    'Categoria': (1, None),
+    'SubCategoria': (2, 'categoria__nome'),
+    'Marca': (3, 'pais_origem'),
+    'Modelo': (4, None),
+    'Instrumento': (5, 'numero_serie'),
+}
+
+
+def criar_indice_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CRIAR_TABELA)
+        for nome_modelo, (codigo, extra) in TIPOS.items():
+            model = apps.get_model('instrumentos', nome_modelo)
+            campos = ['pk', 'nome', 'descricao'] + ([extra] if extra else [])
+            lote = []
+            for valores in model.objects.order_by().values_list(*campos).iterator(chunk_size=2000):
+                pk, nome, descricao = valores[:3]
+                lote.append((pk * 8 + codigo, nome or '', descricao or '', (valores[3] if extra else None) or ''))
+                if len(lote) >= 2000:
+                    cursor.executemany(INSERIR, lote)
+                    lote = []
+            if lote:
+                cursor.executemany(INSERIR, lote)
+        cursor.execute(OTIMIZAR)
+
+
+def remover_indice_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(REMOVER_TABELA)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0007_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
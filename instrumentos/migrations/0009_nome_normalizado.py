@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+import unicodedata
+from django.db import migrations, models
+
+
+def normalizar(texto):
+    """Cópia fixa de instrumentos.search.normalizar neste ponto do histórico"""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.casefold().split())
+
+
+def popular_nomes_normalizados(apps, schema_editor):
+    for nome_modelo in ('Categoria', 'SubCategoria', 'Marca', 'Modelo', 'Instrumento'):
+        model = apps.get_model('instrumentos', nome_modelo)
+        lote = []
+        for pk, nome in model.objects.order_by('pk').values_list('pk', 'nome').iterator(chunk_size=2000):
+            normalizado = normalizar(nome)
+            if normalizado:
+                lote.append(model(pk=pk, nome_normalizado=normalizado))
+            if len(lote) >= 2000:
+                model.objects.bulk_update(lote, ['nome_normalizado'])
+                lote = []
+        if lote:
+            model.objects.bulk_update(lote, ['nome_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0008_busca_textual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='instrumento',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='marca',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='modelo',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='subcategoria',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(popular_nomes_normalizados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0009_nome_normalizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeracaoIA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabelas', models.JSONField(default=list)),
+                ('quantidade', models.PositiveIntegerField(default=10)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('executando', 'Executando'), ('concluida', 'Concluída'), ('falhou', 'Falhou')], default='pendente', max_length=20)),
+                ('progresso', models.JSONField(blank=True, default=dict)),
+                ('resultados', models.JSONField(blank=True, default=dict)),
+                ('erro', models.TextField(blank=True)),
+                ('tentativas', models.PositiveIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Geração com IA',
+                'verbose_name_plural': 'Gerações com IA',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='geracao_status_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EtapaGeracaoIA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabela', models.CharField(max_length=20)),
+                ('chave', models.CharField(max_length=100)),
+                ('criados', models.PositiveIntegerField(default=0)),
+                ('atualizados', models.PositiveIntegerField(default=0)),
+                ('falhou', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('geracao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='etapas', to='instrumentos.geracaoia')),
+            ],
+            options={
+                'verbose_name': 'Etapa da Geração com IA',
+                'verbose_name_plural': 'Etapas da Geração com IA',
+                'constraints': [models.UniqueConstraint(fields=('geracao', 'tabela', 'chave'), name='unique_etapa_geracao_tabela_chave')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0010_geracoes_ia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geracaoia',
+            name='ignorar_cache',
+            field=models.BooleanField(default=False),
+        ),
+    ]
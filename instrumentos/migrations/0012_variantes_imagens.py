@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0011_geracaoia_ignorar_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoinstrumento',
+            name='variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='marca',
+            name='logotipo_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:59
+
+import instrumentos.storage
+from collections import Counter
+from django.db import migrations, models
+
+# Cópia fixa dos campos de imagem contados em instrumentos.midia
+CAMPOS_IMAGEM = {
+    'FotoInstrumento': 'imagem',
+    'Marca': 'logotipo',
+}
+
+
+def contar_referencias(apps, schema_editor):
+    """Registra os arquivos já gravados com as suas contagens, como midia.recalcular"""
+    ArquivoMidia = apps.get_model('instrumentos', 'ArquivoMidia')
+    referencias = Counter()
+    for nome_modelo, campo in CAMPOS_IMAGEM.items():
+        model = apps.get_model('instrumentos', nome_modelo)
+        nomes = model.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+        referencias.update(nomes.values_list(campo, flat=True).iterator(chunk_size=2000))
+    ArquivoMidia.objects.bulk_create(
+        [ArquivoMidia(nome=nome, referencias=total) for nome, total in referencias.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0012_variantes_imagens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoMidia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=255, unique=True)),
+                ('referencias', models.IntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Arquivo de Mídia',
+                'verbose_name_plural': 'Arquivos de Mídia',
+            },
+        ),
+        migrations.AlterField(
+            model_name='fotoinstrumento',
+            name='imagem',
+            field=models.ImageField(blank=True, null=True, storage=instrumentos.storage.armazenamento_por_conteudo, upload_to='instrumentos/'),
+        ),
+        migrations.AlterField(
+            model_name='marca',
+            name='logotipo',
+            field=models.ImageField(blank=True, help_text='Upload de logotipo da marca. Recomendado: PNG com fundo transparente, mínimo 300x300 pixels.', null=True, storage=instrumentos.storage.armazenamento_por_conteudo, upload_to='logos/'),
+        ),
+        migrations.RunPython(contar_referencias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:01
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instrumentos', '0013_armazenamento_por_conteudo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadFoto',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=255)),
+                ('descricao', models.CharField(blank=True, max_length=200)),
+                ('tamanho', models.PositiveBigIntegerField()),
+                ('recebido', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('recebendo', 'Recebendo'), ('concluido', 'Concluído'), ('falhou', 'Falhou')], default='recebendo', max_length=20)),
+                ('erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('foto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='instrumentos.fotoinstrumento')),
+                ('instrumento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads_fotos', to='instrumentos.instrumento')),
+            ],
+            options={
+                'verbose_name': 'Upload de Foto',
+                'verbose_name_plural': 'Uploads de Fotos',
+                'ordering': ['criado_em'],
+            },
+        ),
+    ]
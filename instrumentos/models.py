@@ -1,10 +1,40 @@
+import uuid
+from django.conf import settings
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.utils import timezone
+from .storage import armazenamento_por_conteudo
 
-class Categoria(models.Model):
+class ContadoresMixin(models.Model):
+    """
+    Contadores desnormalizados de instrumentos, mantidos por `instrumentos.counters`
+    """
+    total_instrumentos = models.IntegerField(default=0, editable=False)
+    total_preco = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+    total_valor_venda = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+
+    CAMPOS_CONTADORES = ('total_instrumentos', 'total_preco', 'total_valor_venda')
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # Os contadores são atualizados com F() pelos signals; uma instância
+        # carregada antes disso não pode sobrescrevê-los com valores antigos
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CAMPOS_CONTADORES
+            ]
+        super().save(*args, **kwargs)
+
+class Categoria(ContadoresMixin):
     nome = models.CharField(max_length=100, unique=True)
+    nome_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
     descricao = models.TextField(blank=True)
+    total_subcategorias = models.IntegerField(default=0, editable=False)
+
+    CAMPOS_CONTADORES = ContadoresMixin.CAMPOS_CONTADORES + ('total_subcategorias',)
 
     def __str__(self):
         return self.nome
@@ -14,8 +44,9 @@ class Categoria(models.Model):
         verbose_name_plural = 'Categorias'
         ordering = ['nome']
 
-class SubCategoria(models.Model):
+class SubCategoria(ContadoresMixin):
     nome = models.CharField(max_length=100)
+    nome_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
     categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='subcategorias')
     descricao = models.TextField(blank=True)
 
@@ -26,6 +57,10 @@ class SubCategoria(models.Model):
         verbose_name = 'Subcategoria'
         verbose_name_plural = 'Subcategorias'
         ordering = ['categoria__nome', 'nome']
+        indexes = [
+            # SubCategoriaListView: filtro por categoria ordenado por nome
+            models.Index(fields=['categoria', 'nome'], name='subcat_categoria_nome_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['nome', 'categoria'],
@@ -33,18 +68,22 @@ class SubCategoria(models.Model):
             )
         ]
 
-class Marca(models.Model):
+class Marca(ContadoresMixin):
     nome = models.CharField(max_length=100)
+    nome_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
     descricao = models.TextField(blank=True, null=True)
     pais_origem = models.CharField(max_length=100, blank=True, null=True)
     logotipo = models.ImageField(
         upload_to='logos/', 
+        storage=armazenamento_por_conteudo,
         blank=True, 
         null=True,
         help_text='Upload de logotipo da marca. Recomendado: PNG com fundo transparente, mínimo 300x300 pixels.'
 
     )
     site = models.URLField(blank=True, null=True, help_text='Site oficial da marca')
+    # Variantes reduzidas do logotipo geradas por `imagens.gerar_variantes`
+    logotipo_variantes = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['nome']
@@ -54,8 +93,9 @@ class Marca(models.Model):
     def __str__(self):
         return self.nome
 
-class Modelo(models.Model):
+class Modelo(ContadoresMixin):
     nome = models.CharField(max_length=100)
+    nome_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
     marca = models.ForeignKey(Marca, on_delete=models.CASCADE, related_name='modelos', default=1)
     subcategoria = models.ForeignKey(SubCategoria, on_delete=models.CASCADE, related_name='modelos')
     descricao = models.TextField(blank=True)
@@ -67,6 +107,10 @@ class Modelo(models.Model):
         verbose_name = 'Modelo'
         verbose_name_plural = 'Modelos'
         ordering = ['marca__nome', 'nome']
+        indexes = [
+            # ModeloListView: filtro por marca já ordenado por nome
+            models.Index(fields=['marca', 'nome'], name='modelo_marca_nome_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['nome', 'marca'],
@@ -89,6 +133,7 @@ class Instrumento(models.Model):
     ]
 
     nome = models.CharField(max_length=200, null=True, blank=True)  
+    nome_normalizado = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
     numero_serie = models.CharField(max_length=100, blank=True, null=True)
     categoria = models.ForeignKey(Categoria, on_delete=models.PROTECT, null=True)
     subcategoria = models.ForeignKey(SubCategoria, on_delete=models.PROTECT, null=True)
@@ -111,12 +156,24 @@ class Instrumento(models.Model):
         verbose_name = 'Instrumento'
         verbose_name_plural = 'Instrumentos'
         ordering = ['-created_at']
+        indexes = [
+            # InstrumentoListView pagina por (-created_at, id), com ou sem filtros
+            models.Index(fields=['-created_at', 'id'], name='instr_created_idx'),
+            models.Index(fields=['status', '-created_at', 'id'], name='instr_status_created_idx'),
+            models.Index(fields=['estado', '-created_at', 'id'], name='instr_estado_created_idx'),
+            models.Index(fields=['marca', '-created_at', 'id'], name='instr_marca_created_idx'),
+            models.Index(fields=['modelo', '-created_at', 'id'], name='instr_modelo_created_idx'),
+            models.Index(fields=['categoria', '-created_at', 'id'], name='instr_categoria_created_idx'),
+            models.Index(fields=['numero_serie'], name='instr_numero_serie_idx'),
+        ]
 
 class FotoInstrumento(models.Model):
     instrumento = models.ForeignKey(Instrumento, on_delete=models.CASCADE, related_name='fotos')
-    imagem = models.ImageField(upload_to='instrumentos/', null=True, blank=True)
+    imagem = models.ImageField(upload_to='instrumentos/', storage=armazenamento_por_conteudo, null=True, blank=True)
     descricao = models.CharField(max_length=200, blank=True, null=True)
     ordem = models.PositiveIntegerField(default=0)
+    # Variantes reduzidas da imagem geradas por `imagens.gerar_variantes`
+    variantes = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Foto {self.ordem} - {self.instrumento}"
@@ -124,4 +181,194 @@ class FotoInstrumento(models.Model):
     class Meta:
         verbose_name = 'Foto do Instrumento'
         verbose_name_plural = 'Fotos do Instrumento'
-        ordering = ['ordem']
\ No newline at end of file
+        ordering = ['ordem']
+
+class ArquivoMidia(models.Model):
+    """
+    Arquivo do armazenamento por conteúdo e quantos registros o usam,
+    mantido por `instrumentos.midia`. Arquivos sem referências são removidos
+    pelo comando `coletar_midia`.
+    """
+    nome = models.CharField(max_length=255, unique=True)
+    referencias = models.IntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Arquivo de Mídia'
+        verbose_name_plural = 'Arquivos de Mídia'
+
+    def __str__(self):
+        return f"{self.nome} ({self.referencias})"
+
+class UploadFoto(models.Model):
+    """
+    Upload de uma foto enviado em pedaços pela API de `instrumentos.uploads`.
+    `recebido` é o ponto de retomada: o cliente consulta o upload e continua
+    a partir dele. Ao concluir, a foto gerada fica em `foto`. Só o `usuario`
+    que abriu o upload pode enviar pedaços e concluí-lo.
+    """
+    RECEBENDO = 'recebendo'
+    CONCLUIDO = 'concluido'
+    FALHOU = 'falhou'
+    STATUS_CHOICES = [
+        (RECEBENDO, 'Recebendo'),
+        (CONCLUIDO, 'Concluído'),
+        (FALHOU, 'Falhou'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    instrumento = models.ForeignKey(Instrumento, on_delete=models.CASCADE, related_name='uploads_fotos')
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, related_name='+')
+    nome = models.CharField(max_length=255)
+    descricao = models.CharField(max_length=200, blank=True)
+    tamanho = models.PositiveBigIntegerField()
+    recebido = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=RECEBENDO)
+    erro = models.TextField(blank=True)
+    foto = models.ForeignKey(FotoInstrumento, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    criado_em = models.DateTimeField(default=timezone.now)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Upload de Foto'
+        verbose_name_plural = 'Uploads de Fotos'
+        ordering = ['criado_em']
+
+    def __str__(self):
+        return f"{self.nome} ({self.recebido}/{self.tamanho})"
+
+    @property
+    def completo(self):
+        return self.recebido >= self.tamanho
+
+    def as_dict(self):
+        return {
+            'id': str(self.pk),
+            'nome': self.nome,
+            'tamanho': self.tamanho,
+            'recebido': self.recebido,
+            'status': self.status,
+            'erro': self.erro,
+            'foto_id': self.foto_id,
+        }
+
+class GeracaoIA(models.Model):
+    """
+    Geração de dados com IA enfileirada pela página "Gerar Dados com IA" e
+    executada pelo comando `processar_geracoes`. Cada tarefa concluída fica
+    registrada em `EtapaGeracaoIA`, o que permite retomar a geração do ponto
+    em que parou se o worker cair.
+    """
+    PENDENTE = 'pendente'
+    EXECUTANDO = 'executando'
+    CONCLUIDA = 'concluida'
+    FALHOU = 'falhou'
+    STATUS_CHOICES = [
+        (PENDENTE, 'Pendente'),
+        (EXECUTANDO, 'Executando'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHOU, 'Falhou'),
+    ]
+
+    tabelas = models.JSONField(default=list)
+    quantidade = models.PositiveIntegerField(default=10)
+    # Faz todas as chamadas de novo em vez de reaproveitar as respostas do cache (ai_cache)
+    ignorar_cache = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDENTE)
+    progresso = models.JSONField(default=dict, blank=True)
+    resultados = models.JSONField(default=dict, blank=True)
+    erro = models.TextField(blank=True)
+    tentativas = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+    # Heartbeat do worker: uma geração em execução sem atualização recente é retomada por outro
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Geração {self.pk} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = 'Geração com IA'
+        verbose_name_plural = 'Gerações com IA'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='geracao_status_created_idx'),
+        ]
+
+    @property
+    def finalizada(self):
+        return self.status in (self.CONCLUIDA, self.FALHOU)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'tabelas': self.tabelas,
+            'quantidade': self.quantidade,
+            'ignorar_cache': self.ignorar_cache,
+            'progresso': self.progresso,
+            'resultados': self.resultados,
+            'erro': self.erro,
+            'finalizada': self.finalizada,
+        }
+
+    # Ponto de retomada usado por `ai_populate.popular`
+
+    def atualizar_campos(self, **campos):
+        """Atualiza os campos (e o heartbeat) direto no banco, sem save()"""
+        campos['atualizado_em'] = timezone.now()
+        for nome, valor in campos.items():
+            setattr(self, nome, valor)
+        GeracaoIA.objects.filter(pk=self.pk).update(**campos)
+
+    def tarefas_concluidas(self, tabela):
+        return set(self.etapas.filter(tabela=tabela).values_list('chave', flat=True))
+
+    def resumo_parcial(self, tabela):
+        totais = self.etapas.filter(tabela=tabela).aggregate(
+            created=models.Sum('criados'),
+            updated=models.Sum('atualizados'),
+            failed=models.Count('id', filter=models.Q(falhou=True)),
+        )
+        return {chave: valor or 0 for chave, valor in totais.items()}
+
+    def registrar_tarefa(self, tabela, chave, criados=0, atualizados=0, falhou=False):
+        EtapaGeracaoIA.objects.create(
+            geracao=self, tabela=tabela, chave=chave,
+            criados=criados, atualizados=atualizados, falhou=falhou
+        )
+
+    def resultado_tabela(self, tabela):
+        return self.resultados.get(tabela)
+
+    def concluir_tabela(self, tabela, resultado):
+        self.atualizar_campos(resultados={**self.resultados, tabela: resultado})
+
+    def atualizar_progresso(self, tabela, progresso):
+        self.atualizar_campos(progresso={**self.progresso, tabela: progresso})
+
+class EtapaGeracaoIA(models.Model):
+    """Tarefa já gravada de uma geração (ex.: subcategorias de uma categoria)"""
+    geracao = models.ForeignKey(GeracaoIA, on_delete=models.CASCADE, related_name='etapas')
+    tabela = models.CharField(max_length=20)
+    chave = models.CharField(max_length=100)
+    criados = models.PositiveIntegerField(default=0)
+    atualizados = models.PositiveIntegerField(default=0)
+    falhou = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.geracao} - {self.tabela} {self.chave}"
+
+    class Meta:
+        verbose_name = 'Etapa da Geração com IA'
+        verbose_name_plural = 'Etapas da Geração com IA'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['geracao', 'tabela', 'chave'],
+                name='unique_etapa_geracao_tabela_chave'
+            )
+        ]
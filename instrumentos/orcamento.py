@@ -0,0 +1,110 @@
+"""
+Orçamento de consultas SQL por request.
+
+Cada rota de `instrumentos/urls.py` declara em ORCAMENTOS quantas consultas
+pode fazer. `Registro` grava as consultas de um trecho de código (via
+`execute_wrapper`, sem depender de DEBUG) e agrupa as que se repetem com o
+mesmo texto e parâmetros diferentes: o padrão de um N+1, como um
+`{{ modelo.marca.nome }}` num loop sem select_related.
+
+`OrcamentoConsultasMiddleware`, ativo com ORCAMENTO_CONSULTAS (padrão:
+DEBUG), mede cada request, devolve o total no cabeçalho X-Consultas-SQL e,
+quando a rota estoura o orçamento, registra um aviso com os suspeitos de
+N+1, ou levanta `OrcamentoEstourado` com ORCAMENTO_CONSULTAS_ESTOURO =
+'erro'. Nos testes, `OrcamentoConsultasMixin` (tests.py) faz a mesma
+conferência e falha o teste.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+# Repetições do mesmo SQL num request a partir das quais é suspeito de N+1
+LIMIAR_REPETICOES = 3
+
+class OrcamentoEstourado(AssertionError):
+    pass
+
+# Listas de parâmetros de tamanho variável (IN (%s, %s, ...)) contam como o mesmo SQL
+_LISTA_PARAMETROS = re.compile(r'%s(?:\s*,\s*%s)+')
+
+def normalizar(sql):
+    return _LISTA_PARAMETROS.sub('%s, ...', ' '.join(sql.split()))
+
+class Registro:
+    """
+    Grava as consultas feitas, em todas as conexões, dentro do `with`:
+    `consultas` é a lista de SQLs (com %s no lugar dos parâmetros).
+    """
+    def __init__(self):
+        self.consultas = []
+        self._pilha = None
+
+    def __enter__(self):
+        self._pilha = ExitStack()
+        for conexao in connections.all():
+            self._pilha.enter_context(conexao.execute_wrapper(self._gravar))
+        return self
+
+    def __exit__(self, *excecao):
+        self._pilha.close()
+
+    def _gravar(self, execute, sql, params, many, context):
+        self.consultas.append(normalizar(sql))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.consultas)
+
+    def suspeitos(self, limiar=LIMIAR_REPETICOES):
+        """[(sql, vezes)] das consultas repetidas `limiar` vezes ou mais, das mais repetidas às menos"""
+        return [(sql, vezes) for sql, vezes in Counter(self.consultas).most_common() if vezes >= limiar]
+
+    def relatorio(self, rota, limite):
+        linhas = [f"{rota}: {len(self)} consultas SQL, orçamento de {limite}"]
+        suspeitos = self.suspeitos()
+        if suspeitos:
+            linhas.append('Possíveis N+1:')
+            linhas += [f"  {vezes}x {sql[:300]}" for sql, vezes in suspeitos]
+        else:
+            linhas += [f"  {sql[:300]}" for sql in self.consultas]
+        return '\n'.join(linhas)
+
+def orcamento(rota):
+    """Consultas permitidas à rota (nome da URL), ou None se ela não declarou orçamento"""
+    from .urls import ORCAMENTOS
+    return ORCAMENTOS.get(rota)
+
+def rota_do_request(request):
+    if request.resolver_match is not None:
+        return request.resolver_match.view_name
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return None
+
+class OrcamentoConsultasMiddleware:
+    def __init__(self, get_response):
+        if not settings.ORCAMENTO_CONSULTAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with Registro() as registro:
+            response = self.get_response(request)
+        response['X-Consultas-SQL'] = str(len(registro))
+
+        rota = rota_do_request(request)
+        limite = orcamento(rota)
+        if limite is not None and len(registro) > limite:
+            relatorio = registro.relatorio(rota, limite)
+            if settings.ORCAMENTO_CONSULTAS_ESTOURO == 'erro':
+                raise OrcamentoEstourado(relatorio)
+            logger.warning(relatorio)
+        return response
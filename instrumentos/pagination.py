@@ -0,0 +1,118 @@
+"""
+Paginação por cursor (keyset) ordenada por (-created_at, id).
+
+Em vez de OFFSET, cada página filtra a partir da última linha da página
+anterior, de modo que a página 1000 custa o mesmo que a página 1.
+O cursor é opaco para o cliente: codifica a direção ('>' para a próxima
+página, '<' para a anterior), o created_at e o id da linha de referência.
+"""
+import base64
+from dataclasses import dataclass
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+ORDENACAO = ('-created_at', 'id')
+ORDENACAO_INVERSA = ('created_at', '-id')
+
+class CursorInvalido(ValueError):
+    pass
+
+def codificar_cursor(direcao, obj):
+    created_at = obj['created_at'] if isinstance(obj, dict) else obj.created_at
+    pk = obj['id'] if isinstance(obj, dict) else obj.pk
+    valor = f"{direcao}|{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Retorna (direcao, created_at, id) ou levanta CursorInvalido"""
+    try:
+        valor = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direcao, created_at, pk = valor.split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CursorInvalido(str(e))
+    if direcao not in ('>', '<') or created_at is None:
+        raise CursorInvalido(cursor)
+    return direcao, created_at, pk
+
+# O created_at__lte/gte por fora é redundante, mas é ele que o SQLite usa
+# para buscar o intervalo no índice; só com o OR ele percorre o índice
+# desde o início e as páginas profundas ficam cada vez mais lentas.
+def _depois(created_at, pk):
+    return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__gt=pk))
+
+def _antes(created_at, pk):
+    return Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(id__lt=pk))
+
+@dataclass
+class PaginaCursor:
+    object_list: list
+    next_cursor: str = None
+    previous_cursor: str = None
+    page_size: int = 0
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+def paginar(queryset, cursor=None, page_size=20):
+    """
+    Retorna uma PaginaCursor com no máximo `page_size` itens. Cada página
+    custa uma única consulta com LIMIT page_size + 1.
+    """
+    direcao, referencia = '>', None
+    if cursor:
+        direcao, created_at, pk = decodificar_cursor(cursor)
+        referencia = (created_at, pk)
+
+    if direcao == '<':
+        itens = list(
+            queryset.filter(_antes(*referencia)).order_by(*ORDENACAO_INVERSA)[:page_size + 1]
+        )
+        tem_mais = len(itens) > page_size
+        itens = itens[:page_size][::-1]
+        tem_anterior, tem_proxima = tem_mais, True
+    else:
+        if referencia:
+            queryset = queryset.filter(_depois(*referencia))
+        itens = list(queryset.order_by(*ORDENACAO)[:page_size + 1])
+        tem_proxima = len(itens) > page_size
+        itens = itens[:page_size]
+        tem_anterior = referencia is not None
+
+    return PaginaCursor(
+        object_list=itens,
+        next_cursor=codificar_cursor('>', itens[-1]) if itens and tem_proxima else None,
+        previous_cursor=codificar_cursor('<', itens[0]) if itens and tem_anterior else None,
+        page_size=page_size,
+    )
+
+def iterar_paginas(queryset, cursor=None, chunk_size=500, limite=None):
+    """
+    Percorre o queryset em páginas de `chunk_size` seguindo os cursores, sem
+    nunca manter mais de uma página em memória. Para após `limite` itens.
+    """
+    entregues = 0
+    while limite is None or entregues < limite:
+        tamanho = chunk_size if limite is None else min(chunk_size, limite - entregues)
+        pagina = paginar(queryset, cursor, tamanho)
+        yield pagina
+        entregues += len(pagina)
+        if not pagina.has_next:
+            return
+        cursor = pagina.next_cursor
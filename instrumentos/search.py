@@ -0,0 +1,254 @@
+"""
+Busca textual do catálogo com um índice FTS5 do SQLite.
+
+Todas as tabelas do catálogo são indexadas numa única tabela virtual
+`instrumentos_busca` (nome, descricao e um campo extra com país de origem,
+número de série etc.). O rowid de cada linha codifica o tipo e o id do
+objeto (id * 8 + código do tipo), o que permite atualizar e filtrar sem
+colunas auxiliares. O índice é mantido pelos signals e pode ser
+reconstruído com o comando `reindexar_busca`.
+
+Em bancos sem FTS5 a busca textual recorre a `icontains`. A busca pelo
+começo do nome (`filtrar_nome`), em qualquer banco, usa a coluna
+`nome_normalizado` (nome sem acentos e em casefold) e é resolvida com um
+intervalo no índice da coluna.
+"""
+import re
+import unicodedata
+from django.apps import apps as django_apps
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TABELA = 'instrumentos_busca'
+
+# tipo -> (código no rowid, modelo, campos de busca com icontains)
+TIPOS = {
+    'categoria': (1, 'Categoria', ['nome', 'descricao']),
+    'subcategoria': (2, 'SubCategoria', ['nome', 'descricao', 'categoria__nome']),
+    'marca': (3, 'Marca', ['nome', 'descricao', 'pais_origem']),
+    'modelo': (4, 'Modelo', ['nome', 'descricao']),
+    'instrumento': (5, 'Instrumento', ['nome', 'descricao', 'numero_serie']),
+}
+TIPO_POR_CODIGO = {codigo: tipo for tipo, (codigo, _, _) in TIPOS.items()}
+TIPO_POR_MODELO = {modelo: tipo for tipo, (_, modelo, _) in TIPOS.items()}
+
+SQL_CRIAR_TABELA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5(
+    nome, descricao, extra,
+    tokenize = "unicode61 remove_diacritics 2"
+)
+"""
+
+# Maior code point válido: qualquer texto que comece com o prefixo é menor que prefixo + FIM
+FIM_PREFIXO = '\U0010ffff'
+
+def normalizar(texto):
+    """
+    Remove acentos, aplica casefold e colapsa espaços:
+    '  Violão  Clássico' -> 'violao classico'
+    """
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.casefold().split())
+
+def filtro_prefixo(termo, campo='nome_normalizado'):
+    """
+    Q para nomes que começam com o termo, ignorando acentos e maiúsculas.
+    Usa >= e < em vez de LIKE para que o banco faça um seek no índice.
+    """
+    prefixo = normalizar(termo)
+    if not prefixo:
+        return Q()
+    return Q(**{f'{campo}__gte': prefixo, f'{campo}__lt': prefixo + FIM_PREFIXO})
+
+def filtrar_nome(queryset, termo):
+    """Restringe um queryset do catálogo aos nomes que começam com o termo (busca no índice)"""
+    return queryset.filter(filtro_prefixo(termo))
+
+def normalizar_nomes(tamanho_lote=2000):
+    """
+    Preenche `nome_normalizado` em todas as tabelas do catálogo com
+    bulk_update em lotes, gravando apenas as linhas desatualizadas.
+    Retorna o número de linhas alteradas por tipo.
+    """
+    totais = {}
+    for tipo, (_, nome_modelo, _) in TIPOS.items():
+        model = django_apps.get_model('instrumentos', nome_modelo)
+        totais[tipo] = 0
+        lote = []
+        linhas = model.objects.order_by('pk').values_list('pk', 'nome', 'nome_normalizado')
+        for pk, nome, atual in linhas.iterator(chunk_size=tamanho_lote):
+            normalizado = normalizar(nome)
+            if normalizado != atual:
+                lote.append(model(pk=pk, nome_normalizado=normalizado))
+            if len(lote) >= tamanho_lote:
+                model.objects.bulk_update(lote, ['nome_normalizado'])
+                totais[tipo] += len(lote)
+                lote = []
+        if lote:
+            model.objects.bulk_update(lote, ['nome_normalizado'])
+            totais[tipo] += len(lote)
+    return totais
+
+def disponivel():
+    return connection.vendor == 'sqlite'
+
+def _rowid(tipo, pk):
+    return pk * 8 + TIPOS[tipo][0]
+
+def _linhas(tipo, pks=None):
+    """Gera (rowid, nome, descricao, extra) para os objetos de um tipo"""
+    _, nome_modelo, _ = TIPOS[tipo]
+    model = django_apps.get_model('instrumentos', nome_modelo)
+    extra = {
+        'subcategoria': 'categoria__nome',
+        'marca': 'pais_origem',
+        'instrumento': 'numero_serie',
+    }.get(tipo)
+    campos = ['pk', 'nome', 'descricao'] + ([extra] if extra else [])
+
+    queryset = model.objects.order_by()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    for valores in queryset.values_list(*campos).iterator(chunk_size=2000):
+        pk, nome, descricao = valores[:3]
+        yield (_rowid(tipo, pk), nome or '', descricao or '', (valores[3] if extra else None) or '')
+
+def _gravar(cursor, linhas):
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {TABELA} (rowid, nome, descricao, extra) VALUES (%s, %s, %s, %s)",
+        linhas
+    )
+
+def indexar(instance):
+    """Insere ou atualiza um objeto do catálogo no índice"""
+    tipo = TIPO_POR_MODELO.get(type(instance).__name__)
+    if tipo is None or not disponivel():
+        return
+    with connection.cursor() as cursor:
+        _gravar(cursor, list(_linhas(tipo, pks=[instance.pk])))
+
+def indexar_lote(model, pks):
+    """Insere ou atualiza vários objetos de um mesmo modelo (ex.: após bulk_create)"""
+    tipo = TIPO_POR_MODELO.get(model.__name__)
+    if tipo is None or not pks or not disponivel():
+        return
+    with connection.cursor() as cursor:
+        _gravar(cursor, list(_linhas(tipo, pks=pks)))
+
+def indexar_subcategorias(categoria):
+    """Reindexa as subcategorias de uma categoria (o nome dela faz parte do índice)"""
+    if not disponivel():
+        return
+    pks = list(categoria.subcategorias.values_list('pk', flat=True))
+    if pks:
+        with connection.cursor() as cursor:
+            _gravar(cursor, list(_linhas('subcategoria', pks=pks)))
+
+def remover(instance):
+    tipo = TIPO_POR_MODELO.get(type(instance).__name__)
+    if tipo is None or not disponivel():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELA} WHERE rowid = %s", [_rowid(tipo, instance.pk)])
+
+def reindexar(tamanho_lote=2000):
+    """
+    Recria o índice do zero. Retorna o número de objetos indexados por tipo.
+    """
+    if not disponivel():
+        return {}
+    totais = {}
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_CRIAR_TABELA)
+        cursor.execute(f"DELETE FROM {TABELA}")
+        for tipo in TIPOS:
+            totais[tipo] = 0
+            lote = []
+            for linha in _linhas(tipo):
+                lote.append(linha)
+                if len(lote) >= tamanho_lote:
+                    _gravar(cursor, lote)
+                    totais[tipo] += len(lote)
+                    lote = []
+            if lote:
+                _gravar(cursor, lote)
+                totais[tipo] += len(lote)
+        cursor.execute(f"INSERT INTO {TABELA} ({TABELA}) VALUES ('optimize')")
+    return totais
+
+def expressao_fts(termo):
+    """
+    Converte o texto digitado numa consulta FTS5 com prefixo em cada palavra:
+    'viol yam' -> '"viol"* "yam"*'. Retorna None se não houver palavras.
+    """
+    palavras = re.findall(r'\w+', termo or '')
+    if not palavras:
+        return None
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+def buscar(termo, tipos=None, limite=20):
+    """
+    Busca ordenada por relevância (bm25, com peso maior para o nome).
+    Retorna dicts com tipo, id, nome e rank.
+    """
+    expressao = expressao_fts(termo)
+    if expressao is None:
+        return []
+    tipos = [tipo for tipo in (tipos or TIPOS) if tipo in TIPOS]
+    if not disponivel():
+        return _buscar_icontains(termo, tipos, limite)
+
+    codigos = ', '.join(str(TIPOS[tipo][0]) for tipo in tipos)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid, nome, extra, bm25({TABELA}, 10.0, 2.0, 1.0) AS rank
+            FROM {TABELA}
+            WHERE {TABELA} MATCH %s AND (rowid %% 8) IN ({codigos})
+            ORDER BY rank
+            LIMIT %s
+            """,
+            [expressao, limite]
+        )
+        return [
+            {
+                'tipo': TIPO_POR_CODIGO[rowid % 8],
+                'id': rowid // 8,
+                'nome': nome or extra,
+                'rank': rank,
+            }
+            for rowid, nome, extra, rank in cursor.fetchall()
+        ]
+
+def _buscar_icontains(termo, tipos, limite):
+    resultados = []
+    for tipo in tipos:
+        queryset = filtrar(django_apps.get_model('instrumentos', TIPOS[tipo][1]).objects.all(), termo)
+        for pk, nome in queryset.values_list('pk', 'nome')[:limite]:
+            resultados.append({'tipo': tipo, 'id': pk, 'nome': nome, 'rank': 0})
+    return resultados[:limite]
+
+def filtrar(queryset, termo):
+    """
+    Restringe um queryset do catálogo aos objetos que correspondem ao termo,
+    preservando a ordenação do queryset. Usado pelas listagens.
+    """
+    tipo = TIPO_POR_MODELO[queryset.model.__name__]
+    expressao = expressao_fts(termo)
+    if expressao is None:
+        return queryset
+
+    if not disponivel():
+        # Sem FTS a busca textual percorre a tabela de qualquer forma; o nome
+        # normalizado só garante que os acentos não atrapalhem
+        filtro = Q(nome_normalizado__contains=normalizar(termo))
+        for campo in TIPOS[tipo][2]:
+            filtro |= Q(**{f'{campo}__icontains': termo})
+        return queryset.filter(filtro)
+
+    return queryset.filter(pk__in=RawSQL(
+        f"SELECT rowid / 8 FROM {TABELA} WHERE {TABELA} MATCH %s AND rowid %% 8 = %s",
+        [expressao, TIPOS[tipo][0]]
+    ))
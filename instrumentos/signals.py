@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento
+from . import efeitos, imagens, midia, fotos
+
+# Catálogo: os efeitos de cada gravação ficam em `efeitos`, os mesmos
+# aplicados por `bulk` às gravações em lote
+
+def _estado_salvo(instance, *campos):
+    """Lê do banco os valores atuais dos campos, antes da alteração"""
+    if instance._state.adding or instance.pk is None:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values(*campos).first()
+
+@receiver(pre_save, sender=Categoria)
+@receiver(pre_save, sender=SubCategoria)
+@receiver(pre_save, sender=Marca)
+@receiver(pre_save, sender=Modelo)
+@receiver(pre_save, sender=Instrumento)
+def preparar_gravacao(sender, instance, raw=False, **kwargs):
+    efeitos.normalizar([instance])
+    if not raw and sender in efeitos.CAMPOS_ANTERIORES:
+        instance._contadores_anterior = _estado_salvo(instance, *efeitos.CAMPOS_ANTERIORES[sender])
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=SubCategoria)
+@receiver(post_save, sender=Marca)
+@receiver(post_save, sender=Modelo)
+@receiver(post_save, sender=Instrumento)
+def aplicar_efeitos(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        # Fixtures: sem contadores nem índice, mas os caches derivados caem
+        efeitos.invalidar(sender)
+        return
+    anterior = getattr(instance, '_contadores_anterior', None)
+    if created:
+        efeitos.apos_gravar(sender, criados=[instance])
+    else:
+        efeitos.apos_gravar(sender, atualizados=[instance], anteriores={instance.pk: anterior} if anterior else None)
+
+@receiver(post_delete, sender=Categoria)
+@receiver(post_delete, sender=SubCategoria)
+@receiver(post_delete, sender=Marca)
+@receiver(post_delete, sender=Modelo)
+@receiver(post_delete, sender=Instrumento)
+def aplicar_efeitos_da_exclusao(sender, instance, **kwargs):
+    efeitos.apos_remover(sender, instance)
+
+# Imagens: referências no armazenamento por conteúdo e variantes responsivas
+
+@receiver(pre_save, sender=FotoInstrumento)
+@receiver(pre_save, sender=Marca)
+def guardar_imagem_anterior(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    campo_imagem, campo_variantes = imagens.CAMPOS[sender.__name__]
+    anterior = _estado_salvo(instance, campo_imagem)
+    instance._imagem_anterior = (anterior[campo_imagem] or '') if anterior else None
+    if instance._imagem_anterior != (getattr(instance, campo_imagem).name or ''):
+        # As variantes descritas são da imagem anterior
+        setattr(instance, campo_variantes, {})
+
+@receiver(post_save, sender=FotoInstrumento)
+@receiver(post_save, sender=Marca)
+def registrar_imagem(sender, instance, created=False, raw=False, **kwargs):
+    """Conta as referências ao arquivo e agenda as variantes quando a imagem muda"""
+    if raw:
+        return
+    campo_imagem, _ = imagens.CAMPOS[sender.__name__]
+    nome = getattr(instance, campo_imagem).name or ''
+    anterior = getattr(instance, '_imagem_anterior', None)
+    if anterior == nome:
+        return
+    midia.liberar(anterior)
+    if nome:
+        midia.referenciar(nome)
+        transaction.on_commit(lambda: imagens.agendar(sender, instance.pk))
+
+@receiver(post_delete, sender=FotoInstrumento)
+@receiver(post_delete, sender=Marca)
+def liberar_imagem(sender, instance, **kwargs):
+    campo_imagem, _ = imagens.CAMPOS[sender.__name__]
+    midia.liberar(getattr(instance, campo_imagem).name)
+
+@receiver(post_save, sender=FotoInstrumento)
+@receiver(post_delete, sender=FotoInstrumento)
+def invalidar_bloco_de_fotos(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: fotos.invalidar(instance.instrumento_id))
@@ -0,0 +1,203 @@
+"""
+Catálogo sintético para testes de carga e benchmarks, sem a OpenAI.
+
+`gerar` cria um catálogo determinístico (mesma semente, mesmos dados) com
+a distribuição desigual de um catálogo real: poucas categorias, marcas e
+modelos concentram a maior parte dos instrumentos (pesos de Zipf). As
+linhas são gravadas com bulk_create em lotes, sem signals; no fim os
+contadores, o índice de busca e as versões da taxonomia são refeitos de
+uma vez, como fazem os comandos `recalcular_contadores` e
+`reindexar_busca`.
+
+O tamanho da taxonomia acompanha o número de instrumentos: 1k instrumentos
+usam as marcas conhecidas e algumas dezenas de modelos; 1M chega a ~500
+marcas e ~16 mil modelos.
+"""
+import logging
+import math
+import random
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate
+from django.db import connection, transaction
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento, UploadFoto
+from .counters import recalcular_contadores
+from .dashboard import invalidar_estatisticas
+from . import search, midia, versoes, taxonomia
+
+logger = logging.getLogger(__name__)
+
+TAMANHOS = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+# Categorias e subcategorias da mais para a menos comum, com a faixa de preço típica
+CATEGORIAS = [
+    ('Cordas', (300, 8000), ['Violões', 'Guitarras', 'Baixos', 'Violinos', 'Ukuleles', 'Cavaquinhos', 'Violoncelos', 'Bandolins']),
+    ('Teclas', (800, 25000), ['Teclados', 'Pianos digitais', 'Sintetizadores', 'Pianos acústicos', 'Órgãos', 'Acordeões']),
+    ('Percussão', (150, 12000), ['Baterias', 'Pratos', 'Pandeiros', 'Cajóns', 'Congas', 'Xilofones']),
+    ('Sopro', (400, 15000), ['Saxofones', 'Flautas', 'Trompetes', 'Clarinetes', 'Trombones', 'Gaitas']),
+    ('Áudio', (200, 10000), ['Microfones', 'Interfaces de áudio', 'Monitores de referência', 'Mesas de som']),
+    ('Eletrônicos', (250, 9000), ['Pedais de efeito', 'Amplificadores', 'Controladores MIDI', 'Samplers']),
+]
+
+MARCAS = [
+    ('Yamaha', 'Japão'), ('Fender', 'Estados Unidos'), ('Giannini', 'Brasil'), ('Roland', 'Japão'),
+    ('Gibson', 'Estados Unidos'), ('Tagima', 'Brasil'), ('Ibanez', 'Japão'), ('Casio', 'Japão'),
+    ('Korg', 'Japão'), ('Pearl', 'Japão'), ('Shure', 'Estados Unidos'), ('Selmer', 'França'),
+    ('Zildjian', 'Estados Unidos'), ('Behringer', 'Alemanha'), ('Rozini', 'Brasil'), ('Di Giorgio', 'Brasil'),
+]
+PAISES = sorted({pais for _, pais in MARCAS})
+
+SUFIXOS_MODELO = ['Standard', 'Pro', 'Deluxe', 'Custom', 'Studio', 'Classic', 'Special', 'Vintage', 'Elite', 'Junior']
+
+ESTADOS = (['novo', 'usado', 'restaurado'], [55, 38, 7])
+STATUS = (['disponivel', 'vendido', 'reservado', 'manutencao'], [60, 27, 9, 4])
+
+# Datas fixas: o catálogo não depende do dia em que foi gerado
+INICIO = date(2020, 1, 1)
+DIAS = 5 * 365
+CRIADO_EM = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+class CatalogoNaoVazio(Exception):
+    pass
+
+def tamanho(valor):
+    """'1k', '100k', '1m' ou um número de instrumentos"""
+    valor = str(valor).lower()
+    if valor in TAMANHOS:
+        return TAMANHOS[valor]
+    return int(valor.replace('_', ''))
+
+def pesos_zipf(total, expoente):
+    """Pesos acumulados de Zipf para `total` itens em ordem de popularidade"""
+    return list(accumulate(1 / (posicao ** expoente) for posicao in range(1, total + 1)))
+
+def _lotes(iteravel, tamanho_lote):
+    lote = []
+    for item in iteravel:
+        lote.append(item)
+        if len(lote) >= tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def limpar():
+    """
+    Apaga o catálogo inteiro (instrumentos, fotos, uploads e taxonomia) com
+    DELETEs diretos, sem signals nem o collector, que carregaria cada linha
+    na memória. Contadores de mídia, índice e caches são refeitos depois.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (FotoInstrumento, UploadFoto, Instrumento, Modelo, Marca, SubCategoria, Categoria):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+    midia.recalcular()
+    _finalizar(reindexar=True)
+
+def _finalizar(reindexar):
+    recalcular_contadores()
+    if reindexar:
+        search.reindexar()
+    invalidar_estatisticas()
+    versoes.incrementar(*versoes.TABELAS)
+    taxonomia.descartar()
+
+def _taxonomia(rng, instrumentos):
+    """
+    Cria categorias, subcategorias, marcas e modelos. Retorna os modelos em
+    ordem de popularidade, as subcategorias por pk e a faixa de preço de
+    cada categoria.
+    """
+    categorias = Categoria.objects.bulk_create(
+        Categoria(nome=nome, nome_normalizado=search.normalizar(nome), descricao=f'Instrumentos de {nome.lower()}')
+        for nome, _, _ in CATEGORIAS
+    )
+    # Popularidade de cada subcategoria: as primeiras das categorias mais comuns na frente
+    ranking = []
+    for posicao_categoria, (categoria, (_, _, nomes)) in enumerate(zip(categorias, CATEGORIAS), 1):
+        for posicao, nome in enumerate(nomes, 1):
+            subcategoria = SubCategoria(nome=nome, nome_normalizado=search.normalizar(nome), categoria=categoria, descricao='')
+            ranking.append((posicao_categoria * posicao, len(ranking), subcategoria))
+    ranking.sort()
+    subcategorias = SubCategoria.objects.bulk_create(subcategoria for _, _, subcategoria in ranking)
+
+    total_marcas = max(len(MARCAS), round(math.sqrt(instrumentos) / 2))
+    marcas = list(MARCAS) + [
+        (f'Marca {numero:04d}', rng.choice(PAISES)) for numero in range(len(MARCAS) + 1, total_marcas + 1)
+    ]
+    marcas = Marca.objects.bulk_create(
+        Marca(nome=nome, nome_normalizado=search.normalizar(nome), pais_origem=pais, descricao='')
+        for nome, pais in marcas
+    )
+
+    pesos_marcas = pesos_zipf(len(marcas), 1.1)
+    pesos_subcategorias = pesos_zipf(len(subcategorias), 0.9)
+    total_modelos = max(50, round(instrumentos ** 0.75 / 2))
+    modelos = []
+    for numero in range(total_modelos):
+        marca = rng.choices(marcas, cum_weights=pesos_marcas)[0]
+        subcategoria = rng.choices(subcategorias, cum_weights=pesos_subcategorias)[0]
+        # O número torna o nome único mesmo com a mesma marca e sufixo
+        nome = f'{subcategoria.nome[:3].upper()}-{numero + 100} {rng.choice(SUFIXOS_MODELO)}'
+        modelos.append(Modelo(
+            nome=nome, nome_normalizado=search.normalizar(nome), marca=marca, subcategoria=subcategoria,
+            descricao=f'{subcategoria.nome} {marca.nome} {nome}',
+        ))
+    # A ordem de criação já é aleatória: vira a ordem de popularidade dos modelos
+    modelos = Modelo.objects.bulk_create(modelos)
+    faixas = {categoria.pk: faixa for categoria, (_, faixa, _) in zip(categorias, CATEGORIAS)}
+    return modelos, {subcategoria.pk: subcategoria for subcategoria in subcategorias}, faixas
+
+def _instrumento(rng, numero, modelo, subcategoria, faixa):
+    minimo, maximo = faixa
+    # Preços log-normais dentro da faixa da categoria
+    preco = min(maximo, max(minimo, round(math.exp(rng.gauss(math.log(minimo * 3), 0.7)), 2)))
+    status = rng.choices(*STATUS)[0]
+    aquisicao = INICIO + timedelta(days=rng.randrange(DIAS))
+    venda = valor_venda = None
+    if status == 'vendido':
+        venda = aquisicao + timedelta(days=rng.randrange(1, 365))
+        valor_venda = Decimal(str(round(preco * rng.uniform(1.05, 1.6), 2)))
+    nome = f'{modelo.marca.nome} {modelo.nome}'
+    return Instrumento(
+        nome=nome, nome_normalizado=search.normalizar(nome), numero_serie=f'SN{numero:08d}',
+        categoria_id=subcategoria.categoria_id, subcategoria_id=subcategoria.pk, marca_id=modelo.marca_id, modelo=modelo,
+        preco=Decimal(str(preco)), data_aquisicao=aquisicao, estado=rng.choices(*ESTADOS)[0], status=status,
+        valor_venda=valor_venda, data_venda=venda, descricao=f'{subcategoria.nome} - {status}',
+        created_at=CRIADO_EM, updated_at=CRIADO_EM,
+    )
+
+def gerar(instrumentos, semente=42, tamanho_lote=5000, reindexar=True, progresso=None):
+    """
+    Gera um catálogo com `instrumentos` instrumentos num banco sem catálogo
+    (levanta CatalogoNaoVazio se já houver categorias ou instrumentos; veja
+    `limpar`). `progresso(gravados, total)` é chamado a cada lote. Retorna
+    {tabela: linhas criadas}.
+    """
+    if Categoria.objects.exists() or Instrumento.objects.exists():
+        raise CatalogoNaoVazio('O banco já tem um catálogo; limpe-o antes de gerar outro')
+
+    rng = random.Random(semente)
+    with transaction.atomic():
+        modelos, subcategorias, faixas = _taxonomia(rng, instrumentos)
+    pesos_modelos = pesos_zipf(len(modelos), 1.0)
+
+    def linhas():
+        for numero in range(instrumentos):
+            modelo = rng.choices(modelos, cum_weights=pesos_modelos)[0]
+            subcategoria = subcategorias[modelo.subcategoria_id]
+            yield _instrumento(rng, numero + 1, modelo, subcategoria, faixas[subcategoria.categoria_id])
+
+    gravados = 0
+    for lote in _lotes(linhas(), tamanho_lote):
+        with transaction.atomic():
+            Instrumento.objects.bulk_create(lote, batch_size=tamanho_lote)
+        gravados += len(lote)
+        if progresso:
+            progresso(gravados, instrumentos)
+
+    _finalizar(reindexar)
+    logger.info(f"Catálogo sintético gerado: {instrumentos} instrumentos, {len(modelos)} modelos (semente {semente})")
+    return {
+        'categorias': len(faixas), 'subcategorias': len(subcategorias), 'marcas': Marca.objects.count(),
+        'modelos': len(modelos), 'instrumentos': gravados,
+    }
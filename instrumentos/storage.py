@@ -0,0 +1,59 @@
+"""
+Armazenamento endereçado por conteúdo das fotos e logotipos.
+
+Cada arquivo é gravado uma única vez, com o nome derivado do SHA-256 do
+conteúdo (`instrumentos/3f/3f2a...9c.jpg`): a mesma foto enviada para vários
+instrumentos, ou o mesmo logotipo reenviado, aponta para o mesmo arquivo. O
+hash é calculado enquanto os pedaços do upload são copiados para um
+arquivo temporário, sem ler o conteúdo inteiro na memória.
+
+Como um arquivo pode ser usado por vários registros, `delete` nunca é
+chamado pelos formulários: as referências são contadas em `midia` e os
+arquivos sem nenhuma são removidos pelo comando `coletar_midia`.
+"""
+import hashlib
+import os
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ArmazenamentoPorConteudo(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # O nome definitivo só é conhecido depois do hash, em _save
+        return name
+
+    def _save(self, name, content):
+        diretorio, nome_original = os.path.split(name)
+        extensao = os.path.splitext(nome_original)[1].lower()
+        os.makedirs(self.path(diretorio or '.'), exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temporario = tempfile.mkstemp(dir=self.path(diretorio or '.'), suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as destino:
+                for pedaco in content.chunks():
+                    digest.update(pedaco)
+                    destino.write(pedaco)
+            hexdigest = digest.hexdigest()
+            final = os.path.join(diretorio, hexdigest[:2], hexdigest + extensao).replace('\\', '/')
+            caminho = self.path(final)
+            if os.path.exists(caminho):
+                # Já existe: renova o mtime para a coleta não remover um arquivo recém-referenciado
+                os.utime(caminho)
+            else:
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                os.replace(temporario, caminho)
+                if self.file_permissions_mode is not None:
+                    os.chmod(caminho, self.file_permissions_mode)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        return final
+
+def armazenamento_por_conteudo():
+    """Usado como `storage` dos campos de imagem (resolvido em tempo de execução, acompanha MEDIA_ROOT)"""
+    return _armazenamento
+
+_armazenamento = ArmazenamentoPorConteudo()
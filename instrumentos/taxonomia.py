@@ -0,0 +1,104 @@
+"""
+Taxonomia (categorias, subcategorias, marcas e modelos) em memória, no
+próprio processo, para as listas de escolha.
+
+Os filtros das listagens, os selects dos formulários e os filtros do admin
+pegam as opções daqui em vez de consultar as quatro tabelas a cada
+renderização. Cada tabela é carregada numa única consulta e guardada junto
+com a sua versão em `versoes`; a cada uso só as versões são lidas do cache
+(uma leitura para todas), e a tabela é recarregada quando a versão mudou,
+isto é, quando outro processo gravou nela. Os signals também descartam a
+cópia local na hora (`descartar`), para o próprio processo enxergar a
+gravação antes mesmo do commit.
+"""
+import threading
+from dataclasses import dataclass
+from .models import Categoria, SubCategoria, Marca, Modelo
+from . import versoes
+
+VAZIO = '---------'
+
+@dataclass(frozen=True)
+class Item:
+    """Uma linha da taxonomia, com o rótulo já calculado (o mesmo do __str__ do modelo)"""
+    id: int
+    nome: str
+    rotulo: str
+    categoria_id: int = None
+    marca_id: int = None
+    subcategoria_id: int = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.rotulo
+
+def _carregar_categorias():
+    return [Item(c.id, c.nome, str(c)) for c in Categoria.objects.order_by('nome')]
+
+def _carregar_subcategorias():
+    return [
+        Item(s.id, s.nome, str(s), categoria_id=s.categoria_id)
+        for s in SubCategoria.objects.select_related('categoria').order_by('categoria__nome', 'nome')
+    ]
+
+def _carregar_marcas():
+    return [Item(m.id, m.nome, str(m)) for m in Marca.objects.order_by('nome')]
+
+def _carregar_modelos():
+    return [
+        Item(m.id, m.nome, str(m), marca_id=m.marca_id, subcategoria_id=m.subcategoria_id)
+        for m in Modelo.objects.select_related('marca').order_by('marca__nome', 'nome')
+    ]
+
+# Na mesma ordem do Meta.ordering de cada modelo, como nos ModelChoiceField
+CARREGAR = {
+    'categoria': _carregar_categorias,
+    'subcategoria': _carregar_subcategorias,
+    'marca': _carregar_marcas,
+    'modelo': _carregar_modelos,
+}
+
+# tabela -> (versão, itens)
+_tabelas = {}
+_lock = threading.Lock()
+
+def itens(tabela, **filtros):
+    """Itens de `tabela`, opcionalmente filtrados por igualdade (ex.: categoria_id=3)"""
+    versao = versoes.versao(tabela)
+    atual = _tabelas.get(tabela)
+    if atual is None or atual[0] != versao:
+        with _lock:
+            atual = _tabelas.get(tabela)
+            if atual is None or atual[0] != versao:
+                atual = (versao, CARREGAR[tabela]())
+                _tabelas[tabela] = atual
+    resultado = atual[1]
+    if filtros:
+        resultado = [item for item in resultado if all(getattr(item, campo) == valor for campo, valor in filtros.items())]
+    return resultado
+
+def categorias():
+    return itens('categoria')
+
+def subcategorias(**filtros):
+    return itens('subcategoria', **filtros)
+
+def marcas():
+    return itens('marca')
+
+def modelos(**filtros):
+    return itens('modelo', **filtros)
+
+def escolhas(tabela, vazio=VAZIO, **filtros):
+    """Opções no formato de `choices`, com a opção vazia primeiro (omitida com vazio=None)"""
+    opcoes = [('', vazio)] if vazio is not None else []
+    return opcoes + [(item.id, item.rotulo) for item in itens(tabela, **filtros)]
+
+def descartar(*tabelas):
+    """Esquece a cópia local das tabelas (todas, se nenhuma); a próxima leitura recarrega"""
+    with _lock:
+        for tabela in tabelas or versoes.TABELAS:
+            _tabelas.pop(tabela, None)
@@ -1,4 +1,8 @@
 from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from instrumentos import imagens
 
 register = template.Library()
 
@@ -9,3 +13,49 @@ def sub(value, arg):
         return float(value or 0) - float(arg or 0)
     except (ValueError, TypeError):
         return 0
+
+@register.simple_tag
+def srcset(arquivo, variantes, formato=None):
+    """srcset com as variantes geradas (WebP por padrão) e o original na sua largura"""
+    if not arquivo:
+        return ''
+    if not variantes:
+        return arquivo.url
+    formato = formato or imagens.WEBP
+    candidatos = [
+        f"{default_storage.url(imagens.nome_variante(arquivo.name, largura, formato))} {largura}w"
+        for largura in variantes.get('larguras', [])
+    ]
+    if formato != imagens.WEBP:
+        candidatos.append(f"{arquivo.url} {variantes['largura']}w")
+    return ', '.join(candidatos)
+
+@register.simple_tag
+def variante_url(arquivo, variantes, largura):
+    """URL da menor variante com pelo menos `largura` px (no formato de fallback), ou do original"""
+    if not arquivo:
+        return ''
+    for disponivel in (variantes or {}).get('larguras', []):
+        if disponivel >= int(largura):
+            return default_storage.url(imagens.nome_variante(arquivo.name, disponivel, variantes['formato']))
+    return arquivo.url
+
+@register.simple_tag
+def imagem_responsiva(arquivo, variantes, sizes='100vw', **atributos):
+    """
+    <picture> com as variantes WebP num <source> e o fallback no <img>.
+    Atributos extras vão para o <img> (`data_foto_id` vira `data-foto-id`).
+    """
+    if not arquivo:
+        return ''
+    atributos.setdefault('loading', 'lazy')
+    extras = flatatt({nome.replace('_', '-'): valor for nome, valor in atributos.items()})
+    if not variantes or not variantes.get('larguras'):
+        return format_html('<img src="{}"{}>', arquivo.url, extras)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        srcset(arquivo, variantes), sizes,
+        variante_url(arquivo, variantes, max(variantes['larguras'])),
+        srcset(arquivo, variantes, variantes['formato']), sizes, extras,
+    )
@@ -1,3 +1,2165 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decimal import Decimal
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+import re
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento, GeracaoIA, ArquivoMidia, UploadFoto
+from .dashboard import get_estatisticas
+from .counters import recalcular_contadores
+from . import counters
+from .pagination import paginar
+from . import pagination, search, ai_helpers, ai_cache, jobs, bulk, logos, imagens, midia, uploads, fotos, versoes, taxonomia, orcamento
+from . import sintetico, benchmark
+from .urls import ORCAMENTOS, urlpatterns
+from .templatetags.instrumento_tags import imagem_responsiva
+from .forms import FotoInstrumentoForm, InstrumentoCreateForm
+from .views import ModeloListView
+from .ai_pipeline import TokenBucket, PipelineIA, Tarefa, Metricas
+from .ai_populate import popular, popular_uma_chamada, chave_tarefa, validar_instrumento
 
-# Create your tests here.
+
+class CatalogoTestMixin:
+    """Cria um catálogo mínimo para os testes"""
+
+    def criar_catalogo(self):
+        self.cordas = Categoria.objects.create(nome='Cordas')
+        self.sopro = Categoria.objects.create(nome='Sopro')
+        self.violoes = SubCategoria.objects.create(nome='Violões', categoria=self.cordas)
+        self.saxofones = SubCategoria.objects.create(nome='Saxofones', categoria=self.sopro)
+        self.yamaha = Marca.objects.create(nome='Yamaha')
+        self.selmer = Marca.objects.create(nome='Selmer')
+        self.f310 = Modelo.objects.create(nome='F310', marca=self.yamaha, subcategoria=self.violoes)
+        self.yas280 = Modelo.objects.create(nome='YAS-280', marca=self.yamaha, subcategoria=self.saxofones)
+        self.mark6 = Modelo.objects.create(nome='Mark VI', marca=self.selmer, subcategoria=self.saxofones)
+
+    def criar_instrumento(self, modelo, preco='100.00', **kwargs):
+        return Instrumento.objects.create(
+            modelo=modelo,
+            marca=modelo.marca,
+            subcategoria=modelo.subcategoria,
+            categoria=modelo.subcategoria.categoria,
+            preco=Decimal(preco),
+            **kwargs
+        )
+
+
+class DashboardTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.criar_catalogo()
+        self.criar_instrumento(self.f310, '1000.00', valor_venda=Decimal('1200.00'))
+        self.criar_instrumento(self.f310, '900.00')
+        self.criar_instrumento(self.mark6, '30000.00')
+
+    def test_estatisticas_agrupadas(self):
+        estatisticas = get_estatisticas()
+
+        self.assertEqual(estatisticas['total_instrumentos'], 3)
+        self.assertEqual(estatisticas['total_categorias'], 2)
+        self.assertEqual(estatisticas['total_subcategorias'], 2)
+        self.assertEqual(estatisticas['total_marcas'], 2)
+        self.assertEqual(estatisticas['total_aquisicao'], Decimal('31900.00'))
+        self.assertEqual(estatisticas['total_mercado'], Decimal('1200.00'))
+        self.assertEqual(
+            [(m['nome'], m['total_instrumentos']) for m in estatisticas['marcas']],
+            [('Yamaha', 2), ('Selmer', 1)]
+        )
+        self.assertEqual(estatisticas['subcategorias'][0]['categoria']['nome'], 'Cordas')
+        self.assertEqual(
+            estatisticas['cadastros'],
+            {'categorias': 2, 'subcategorias': 2, 'marcas': 2}
+        )
+
+    def test_estatisticas_em_cache(self):
+        get_estatisticas()
+        with self.assertNumQueries(0):
+            get_estatisticas()
+
+    def test_cache_invalidado_ao_salvar_instrumento(self):
+        get_estatisticas()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_instrumento(self.yas280, '5000.00')
+        self.assertEqual(get_estatisticas()['total_instrumentos'], 4)
+
+    def test_cache_invalidado_ao_excluir_modelo(self):
+        modelo = Modelo.objects.create(nome='C40', marca=self.yamaha, subcategoria=self.violoes)
+        get_estatisticas()
+        with self.captureOnCommitCallbacks(execute=True):
+            modelo.delete()
+        with self.assertNumQueries(5):
+            get_estatisticas()
+
+    def test_home_view(self):
+        get_estatisticas()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_instrumentos'], 3)
+
+
+class ContadoresTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+
+    def assertContadores(self, obj, instrumentos, preco, valor_venda='0'):
+        obj.refresh_from_db()
+        self.assertEqual(
+            (obj.total_instrumentos, obj.total_preco, obj.total_valor_venda),
+            (instrumentos, Decimal(preco), Decimal(valor_venda))
+        )
+
+    def test_criar_e_excluir_instrumento(self):
+        instrumento = self.criar_instrumento(self.f310, '1000.00', valor_venda=Decimal('1500.00'))
+        self.criar_instrumento(self.f310, '500.00')
+
+        self.assertContadores(self.f310, 2, '1500.00', '1500.00')
+        self.assertContadores(self.violoes, 2, '1500.00', '1500.00')
+        self.assertContadores(self.cordas, 2, '1500.00', '1500.00')
+        self.assertContadores(self.yamaha, 2, '1500.00', '1500.00')
+
+        instrumento.delete()
+        self.assertContadores(self.f310, 1, '500.00')
+        self.assertContadores(self.cordas, 1, '500.00')
+
+    def test_mover_instrumento_entre_modelos(self):
+        instrumento = self.criar_instrumento(self.f310, '1000.00')
+        instrumento.modelo = self.mark6
+        instrumento.preco = '800.00'
+        instrumento.save()
+
+        self.assertContadores(self.f310, 0, '0')
+        self.assertContadores(self.cordas, 0, '0')
+        self.assertContadores(self.yamaha, 0, '0')
+        self.assertContadores(self.mark6, 1, '800.00')
+        self.assertContadores(self.sopro, 1, '800.00')
+        self.assertContadores(self.selmer, 1, '800.00')
+
+    def test_mover_modelo_entre_subcategorias(self):
+        self.criar_instrumento(self.yas280, '4000.00')
+        self.yas280.subcategoria = self.violoes
+        self.yas280.save()
+
+        self.assertContadores(self.saxofones, 0, '0')
+        self.assertContadores(self.sopro, 0, '0')
+        self.assertContadores(self.violoes, 1, '4000.00')
+        self.assertContadores(self.cordas, 1, '4000.00')
+        self.assertContadores(self.yas280, 1, '4000.00')
+
+    def test_salvar_instancia_desatualizada_preserva_contadores(self):
+        modelo = Modelo.objects.get(pk=self.f310.pk)
+        self.criar_instrumento(self.f310, '1000.00')
+        modelo.descricao = 'Violão folk'
+        modelo.save()
+        self.assertContadores(self.f310, 1, '1000.00')
+
+    def test_total_subcategorias(self):
+        self.cordas.refresh_from_db()
+        self.assertEqual(self.cordas.total_subcategorias, 1)
+        SubCategoria.objects.create(nome='Guitarras', categoria=self.cordas)
+        self.violoes.categoria = self.sopro
+        self.violoes.save()
+
+        self.cordas.refresh_from_db()
+        self.sopro.refresh_from_db()
+        self.assertEqual(self.cordas.total_subcategorias, 1)
+        self.assertEqual(self.sopro.total_subcategorias, 2)
+
+    def test_recalcular_contadores(self):
+        self.criar_instrumento(self.f310, '1000.00')
+        self.criar_instrumento(self.mark6, '2000.00')
+        Instrumento.objects.bulk_create([
+            Instrumento(modelo=self.mark6, preco=Decimal('3000.00'))
+        ])
+        Modelo.objects.update(total_instrumentos=0)
+
+        recalcular_contadores()
+
+        self.assertContadores(self.f310, 1, '1000.00')
+        self.assertContadores(self.mark6, 2, '5000.00')
+        self.assertContadores(self.sopro, 2, '5000.00')
+        self.assertContadores(self.selmer, 2, '5000.00')
+        self.cordas.refresh_from_db()
+        self.assertEqual(self.cordas.total_subcategorias, 1)
+
+    def test_listagens_sem_contagens(self):
+        self.criar_instrumento(self.f310, '1000.00')
+        response = self.client.get(reverse('modelo_list'))
+        self.assertContains(response, '<strong>Instrumentos:</strong> 1', html=False)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('categoria_list'))
+
+
+class InstrumentoListPaginacaoTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+        agora = timezone.now()
+        self.instrumentos = []
+        for i in range(45):
+            # Pares com o mesmo created_at testam o desempate por id
+            self.instrumentos.append(self.criar_instrumento(
+                self.f310 if i % 2 else self.mark6,
+                created_at=agora - timedelta(minutes=i // 2),
+                status='vendido' if i % 3 == 0 else 'disponivel',
+            ))
+        self.ordenados = sorted(self.instrumentos, key=lambda i: (-i.created_at.timestamp(), i.pk))
+
+    def percorrer(self, url, **params):
+        vistos = []
+        cursor = None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page_obj = response.context['page_obj']
+            vistos.extend(page_obj.object_list)
+            if not page_obj.has_next:
+                return vistos
+            cursor = page_obj.next_cursor
+
+    def test_percorre_todas_as_paginas_sem_repetir(self):
+        vistos = self.percorrer(reverse('instrumento_list'))
+        self.assertEqual([i.pk for i in vistos], [i.pk for i in self.ordenados])
+
+    def test_pagina_anterior(self):
+        url = reverse('instrumento_list')
+        segunda = self.client.get(url, {
+            'cursor': self.client.get(url).context['page_obj'].next_cursor
+        }).context['page_obj']
+        primeira = self.client.get(url, {'cursor': segunda.previous_cursor}).context['page_obj']
+        self.assertEqual([i.pk for i in primeira], [i.pk for i in self.ordenados[:20]])
+        self.assertFalse(primeira.has_previous)
+
+    def test_consultas_constantes_em_paginas_profundas(self):
+        url = reverse('instrumento_list')
+        cursor = self.client.get(url, {'cursor': self.client.get(url).context['page_obj'].next_cursor}).context['page_obj'].next_cursor
+        with self.assertNumQueries(1):
+            self.client.get(url, {'cursor': cursor})
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é específico do SQLite')
+    def test_pagina_profunda_busca_no_indice(self):
+        # O cursor tem de virar um intervalo no índice (SEARCH), não uma varredura desde a primeira linha
+        referencia = self.ordenados[30]
+        for direcao, consulta in [
+            ('>', Instrumento.objects.filter(pagination._depois(referencia.created_at, referencia.pk)).order_by(*pagination.ORDENACAO)),
+            ('<', Instrumento.objects.filter(pagination._antes(referencia.created_at, referencia.pk)).order_by(*pagination.ORDENACAO_INVERSA)),
+        ]:
+            sql, params = consulta[:21].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plano = [linha[-1] for linha in cursor.fetchall()]
+            with self.subTest(direcao=direcao):
+                self.assertEqual(len(plano), 1, plano)
+                self.assertRegex(plano[0], r'^SEARCH instrumentos_instrumento USING INDEX instr_created_idx \(created_at[<>]\?\)$')
+
+    def test_filtros(self):
+        vistos = self.percorrer(reverse('instrumento_list'), status='vendido', modelo=self.mark6.pk)
+        esperados = [i.pk for i in self.ordenados if i.status == 'vendido' and i.modelo_id == self.mark6.pk]
+        self.assertEqual([i.pk for i in vistos], esperados)
+
+    def test_parametros_invalidos_respondem_400(self):
+        # Mesmo comportamento na página e no JSON: 400, nunca 404 ou 500
+        for params in [{'cursor': 'invalido'}, {'marca': 'abc'}, {'modelo': '1.5'}, {'categoria': 'x'}]:
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(reverse('instrumento_list'), params).status_code, 400)
+                response = self.client.get(reverse('instrumento_list'), {**params, 'format': 'json'})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('inválido', response.json()['error'])
+        response = self.client.get(reverse('instrumento_list'), {'format': 'json', 'limite': 'muitos'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_formato_json(self):
+        url = reverse('instrumento_list')
+        response = self.client.get(url, {'format': 'json', 'limite': 30})
+        self.assertTrue(response.streaming)
+        dados = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([i['id'] for i in dados['results']], [i.pk for i in self.ordenados[:30]])
+        self.assertEqual(dados['results'][0]['marca'], self.ordenados[0].modelo.marca.nome)
+
+        response = self.client.get(url, {'format': 'json', 'limite': 30, 'cursor': dados['next']})
+        dados = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([i['id'] for i in dados['results']], [i.pk for i in self.ordenados[30:]])
+        self.assertIsNone(dados['next'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é específico do SQLite')
+class PlanoConsultaTests(CatalogoTestMixin, TestCase):
+    """
+    Garante que as consultas das listagens buscam pelos índices: toda tabela
+    do catálogo tem de aparecer no plano como SEARCH (uma busca no índice ou
+    pela chave primária). Um SCAN, mesmo USING INDEX ou COVERING INDEX,
+    percorre o índice inteiro e falha o teste. A listagem de instrumentos
+    também não pode ordenar em memória (USE TEMP B-TREE).
+    """
+
+    BUSCA = re.compile(r'SEARCH \S+ USING (?:(?:COVERING )?INDEX \S+|INTEGER PRIMARY KEY) \(')
+
+    def setUp(self):
+        self.criar_catalogo()
+        for modelo in (self.f310, self.yas280, self.mark6):
+            self.criar_instrumento(modelo, numero_serie=f'SN-{modelo.pk}')
+
+    def plano(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [linha[-1] for linha in cursor.fetchall()]
+
+    def assertUsaIndices(self, url, params=None, tabelas=None, ordenado=False, inicio=False):
+        # SQL e parâmetros como foram executados: com os valores embutidos no
+        # texto o SQLite pode escolher outro plano (ex.: um OR com constantes)
+        consultas = []
+
+        def gravar(execute, sql, params, many, context):
+            consultas.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(gravar):
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return self.assertUsaIndicesSql(consultas, tabelas, ordenado, inicio)
+
+    def assertUsaIndicesSql(self, consultas, tabelas=None, ordenado=False, inicio=False):
+        """
+        Falha se alguma consulta ler uma tabela do catálogo sem buscar por
+        índice. Com `ordenado`, também falha se a ordenação não vier do índice.
+        `inicio` é a primeira página sem filtros: ela lê as primeiras linhas
+        do índice de ordenação e para no LIMIT, então ali o SCAN USING INDEX
+        é aceito. Retorna as linhas dos planos conferidos.
+        """
+        planos = []
+        for sql, params in consultas:
+            if tabelas and not any(f'"{tabela}"' in sql for tabela in tabelas):
+                continue
+            plano = self.plano(sql, params)
+            for linha in plano:
+                sem_indice = 'instrumentos_' in linha and not (
+                    self.BUSCA.match(linha) or (inicio and re.match(r'SCAN \S+ USING INDEX \S+$', linha))
+                )
+                self.assertFalse(
+                    sem_indice or (ordenado and 'TEMP B-TREE' in linha),
+                    f'Plano sem índice para:\n{sql}\n' + '\n'.join(plano)
+                )
+            planos += plano
+        return planos
+
+    def test_listagem_de_instrumentos(self):
+        url = reverse('instrumento_list')
+        cursor = paginar(Instrumento.objects.all(), page_size=1).next_cursor
+        self.assertUsaIndices(url, ordenado=True, inicio=True)
+        self.assertUsaIndices(url, {'cursor': cursor}, ordenado=True)
+        for parametro, valor in [
+            ('status', 'vendido'),
+            ('estado', 'usado'),
+            ('marca', self.yamaha.pk),
+            ('modelo', self.f310.pk),
+            ('categoria', self.cordas.pk),
+        ]:
+            with self.subTest(parametro=parametro):
+                self.assertUsaIndices(url, {parametro: valor}, ordenado=True)
+                self.assertUsaIndices(url, {parametro: valor, 'cursor': cursor}, ordenado=True)
+
+    def test_listagem_de_modelos(self):
+        url = reverse('modelo_list')
+        self.assertUsaIndices(url, {'marca': self.yamaha.pk}, tabelas=['instrumentos_modelo'], ordenado=True)
+        # Ordenadas por marca__nome: a ordenação dos poucos modelos filtrados é feita em memória
+        for parametro, valor in [
+            ('subcategoria', self.violoes.pk),
+            ('categoria', self.cordas.pk),
+        ]:
+            with self.subTest(parametro=parametro):
+                self.assertUsaIndices(url, {parametro: valor}, tabelas=['instrumentos_modelo'])
+
+    def test_listagem_de_subcategorias(self):
+        self.assertUsaIndices(
+            reverse('subcategoria_list'), {'categoria': self.cordas.pk},
+            tabelas=['instrumentos_subcategoria'], ordenado=True
+        )
+
+    def test_busca_por_numero_de_serie(self):
+        consulta = Instrumento.objects.filter(numero_serie='SN-1')
+        self.assertUsaIndicesSql([consulta.query.sql_with_params()])
+
+    def test_busca_por_nome_nas_listagens(self):
+        for rota, tabela in [
+            ('categoria_list', 'instrumentos_categoria'),
+            ('subcategoria_list', 'instrumentos_subcategoria'),
+            ('marca_list', 'instrumentos_marca'),
+            ('modelo_list', 'instrumentos_modelo'),
+        ]:
+            with self.subTest(rota=rota):
+                planos = self.assertUsaIndices(reverse(rota), {'nome': 'Viól'}, tabelas=[tabela])
+                busca = rf'SEARCH {tabela} USING (?:COVERING )?INDEX \S*nome_normalizado\S* \(nome_normalizado>\? AND nome_normalizado<\?\)'
+                self.assertTrue(any(re.match(busca, linha) for linha in planos), planos)
+
+    def test_busca_por_prefixo_normalizado(self):
+        for model in (Categoria, SubCategoria, Marca, Modelo, Instrumento):
+            with self.subTest(model=model.__name__):
+                consulta = model.objects.filter(search.filtro_prefixo('Viol')).order_by('nome_normalizado')
+                self.assertUsaIndicesSql([consulta.query.sql_with_params()], ordenado=True)
+
+
+class NomeNormalizadoTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+
+    def test_normalizar(self):
+        self.assertEqual(search.normalizar('  Violão   CLÁSSICO '), 'violao classico')
+        self.assertEqual(search.normalizar('Straße'), 'strasse')
+        self.assertEqual(search.normalizar(None), '')
+
+    def test_preenchido_ao_salvar(self):
+        self.assertEqual(SubCategoria.objects.get(pk=self.violoes.pk).nome_normalizado, 'violoes')
+        self.violoes.nome = 'Violas Caipiras'
+        self.violoes.save()
+        self.assertEqual(SubCategoria.objects.get(pk=self.violoes.pk).nome_normalizado, 'violas caipiras')
+
+    def test_filtro_prefixo(self):
+        self.assertEqual(list(SubCategoria.objects.filter(search.filtro_prefixo('VIOLÕ'))), [self.violoes])
+        self.assertEqual(list(SubCategoria.objects.filter(search.filtro_prefixo('violoes x'))), [])
+        self.assertEqual(
+            list(Modelo.objects.filter(search.filtro_prefixo('yas')).order_by('nome')),
+            [self.yas280]
+        )
+
+    def test_filtro_por_nome_nas_listagens(self):
+        response = self.client.get(reverse('subcategoria_list'), {'nome': 'VIOLÕ'})
+        self.assertEqual(list(response.context['subcategorias']), [self.violoes])
+        response = self.client.get(reverse('modelo_list'), {'nome': 'mark v'})
+        self.assertEqual(list(response.context['modelos']), [self.mark6])
+
+    def test_normalizar_nomes(self):
+        Marca.objects.update(nome_normalizado='')
+        totais = search.normalizar_nomes(tamanho_lote=1)
+        self.assertEqual(totais['marca'], 2)
+        self.assertEqual(totais['modelo'], 0)
+        self.assertEqual(Marca.objects.get(pk=self.selmer.pk).nome_normalizado, 'selmer')
+
+
+@skipUnless(search.disponivel(), 'Busca textual usa FTS5 do SQLite')
+class BuscaTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+        self.yamaha.pais_origem = 'Japão'
+        self.yamaha.save()
+        self.f310.descricao = 'Violão folk com tampo de abeto'
+        self.f310.save()
+        self.instrumento = self.criar_instrumento(self.mark6, numero_serie='M123456')
+
+    def test_busca_por_prefixo_ordenada_por_relevancia(self):
+        resultados = search.buscar('viol')
+        self.assertEqual(
+            [(r['tipo'], r['id']) for r in resultados],
+            [('subcategoria', self.violoes.pk), ('modelo', self.f310.pk)]
+        )
+
+    def test_busca_ignora_acentos(self):
+        self.assertEqual(search.buscar('japao', tipos=['marca'])[0]['id'], self.yamaha.pk)
+
+    def test_indice_acompanha_alteracoes(self):
+        self.violoes.nome = 'Ukuleles'
+        self.violoes.save()
+        self.assertEqual(search.buscar('violões', tipos=['subcategoria']), [])
+        self.cordas.nome = 'Cordofones'
+        self.cordas.save()
+        self.assertEqual(search.buscar('cordofones', tipos=['subcategoria'])[0]['id'], self.violoes.pk)
+
+        self.instrumento.delete()
+        self.assertEqual(search.buscar('M123456'), [])
+
+    def test_reindexar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABELA}')
+        totais = search.reindexar()
+        self.assertEqual(totais['modelo'], 3)
+        self.assertEqual(search.buscar('M1234')[0]['tipo'], 'instrumento')
+
+    def test_api(self):
+        response = self.client.get(reverse('busca_api'), {'q': 'sax', 'tipo': 'subcategoria'})
+        self.assertEqual(response.json()['results'][0]['url'], reverse('subcategoria_detail', args=[self.saxofones.pk]))
+
+    def test_listagens_usam_o_indice(self):
+        response = self.client.get(reverse('marca_list'), {'q': 'jap'})
+        self.assertEqual(list(response.context['marcas']), [self.yamaha])
+        response = self.client.get(reverse('modelo_list'), {'q': 'abeto'})
+        self.assertEqual(list(response.context['modelos']), [self.f310])
+        response = self.client.get(reverse('subcategoria_list'), {'q': 'sopro'})
+        self.assertEqual(list(response.context['subcategorias']), [self.saxofones])
+
+
+class BulkUpsertTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+
+    def test_contagens_iguais_ao_get_or_create(self):
+        linhas = [
+            {'nome': 'Cordas', 'descricao': 'Atualizada'},
+            {'nome': 'Teclas', 'descricao': 'Nova'},
+            {'nome': 'Teclas', 'descricao': 'Repetida'},
+        ]
+        resultado = bulk.upsert(Categoria, linhas, chave=['nome'], campos=['descricao'])
+        self.assertEqual((len(resultado.criados), len(resultado.atualizados)), (1, 2))
+        self.assertEqual(Categoria.objects.get(nome='Cordas').descricao, 'Atualizada')
+        teclas = Categoria.objects.get(nome='Teclas')
+        self.assertEqual((teclas.descricao, teclas.nome_normalizado), ('Repetida', 'teclas'))
+
+        resultado = bulk.upsert(Categoria, linhas, chave=['nome'], campos=['descricao'], atualizar=False)
+        self.assertEqual((len(resultado.criados), resultado.ignorados), (0, 3))
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        def consultas(n, prefixo):
+            linhas = [
+                {'nome': f'{prefixo} {i}', 'categoria_id': self.cordas.pk, 'descricao': ''}
+                for i in range(n)
+            ] + [{'nome': 'Violões', 'categoria_id': self.cordas.pk, 'descricao': 'x'}]
+            with CaptureQueriesContext(connection) as capturadas:
+                bulk.upsert(SubCategoria, linhas, chave=['nome', 'categoria_id'], campos=['descricao'])
+            return len(capturadas)
+
+        self.assertEqual(consultas(2, 'A'), consultas(50, 'B'))
+
+    def test_efeitos_dos_signals(self):
+        self.criar_instrumento(self.f310, preco='300.00')
+        bulk.upsert(
+            SubCategoria,
+            [{'nome': 'Ukuleles', 'categoria_id': self.cordas.pk, 'descricao': 'Havaianos'}],
+            chave=['nome', 'categoria_id'], campos=['descricao']
+        )
+        # F310 muda de subcategoria e leva seus totais
+        bulk.upsert(
+            Modelo,
+            [{'nome': 'F310', 'marca_id': self.yamaha.pk, 'descricao': '', 'subcategoria_id': self.saxofones.pk}],
+            chave=['nome', 'marca_id'], campos=['descricao', 'subcategoria_id']
+        )
+        bulk.criar(Instrumento, [
+            Instrumento(modelo=self.mark6, marca=self.selmer, preco=Decimal('50.00'), valor_venda=Decimal('70.00'))
+            for _ in range(3)
+        ])
+
+        self.cordas.refresh_from_db()
+        self.saxofones.refresh_from_db()
+        self.assertEqual(self.cordas.total_subcategorias, 2)
+        self.assertEqual((self.cordas.total_instrumentos, self.cordas.total_preco), (0, Decimal('0')))
+        self.assertEqual((self.saxofones.total_instrumentos, self.saxofones.total_preco), (4, Decimal('450.00')))
+        antes = {
+            model: list(model.objects.order_by('pk').values_list('pk', *counters.CONTADORES))
+            for model in (SubCategoria, Marca, Modelo)
+        }
+        recalcular_contadores()
+        for model, valores in antes.items():
+            self.assertEqual(list(model.objects.order_by('pk').values_list('pk', *counters.CONTADORES)), valores)
+
+        if search.disponivel():
+            self.assertEqual(search.buscar('havaianos')[0]['tipo'], 'subcategoria')
+
+    def test_lote_e_signals_aplicam_os_mesmos_efeitos(self):
+        self.criar_instrumento(self.f310, preco='300.00')
+        self.criar_instrumento(self.mark6, preco='500.00')
+        # Mudanças que antes só os signals tratavam: subcategoria trocando de categoria e modelo de marca
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.upsert(SubCategoria, [{'nome': 'Violões', 'categoria_id': self.sopro.pk}], chave=['nome'], campos=['categoria_id'])
+            bulk.upsert(Modelo, [{'nome': 'Mark VI', 'marca_id': self.yamaha.pk}], chave=['nome'], campos=['marca_id'])
+
+        def contadores():
+            campos = {Categoria: ['total_subcategorias', *counters.CONTADORES]}
+            return {
+                model: list(model.objects.order_by('pk').values_list('pk', *campos.get(model, counters.CONTADORES)))
+                for model in (Categoria, SubCategoria, Marca, Modelo)
+            }
+
+        antes = contadores()
+        self.assertEqual(Categoria.objects.get(pk=self.sopro.pk).total_instrumentos, 2)
+        self.assertEqual(Marca.objects.get(pk=self.yamaha.pk).total_preco, Decimal('800.00'))
+        recalcular_contadores()
+        self.assertEqual(contadores(), antes)
+
+
+class FakeOpenAIServer:
+    """
+    Servidor HTTP local que imita /v1/chat/completions. `responder(prompt)`
+    retorna (status, conteúdo da mensagem ou corpo de erro, cabeçalhos).
+    Pedidos com stream recebem o conteúdo em pedaços de `tamanho_pedaco`
+    caracteres; `antes_do_fim()` é chamada antes do último pedaço.
+    """
+
+    def __init__(self, responder, atraso=0, tamanho_pedaco=8, antes_do_fim=None):
+        self.responder = responder
+        self.atraso = atraso
+        self.tamanho_pedaco = tamanho_pedaco
+        self.antes_do_fim = antes_do_fim
+        self.chamadas = []
+        self.simultaneas = self.max_simultaneas = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = corpo['messages'][-1]['content']
+                with servidor._lock:
+                    servidor.chamadas.append(prompt)
+                    servidor.simultaneas += 1
+                    servidor.max_simultaneas = max(servidor.max_simultaneas, servidor.simultaneas)
+                try:
+                    time.sleep(servidor.atraso)
+                    status, conteudo, cabecalhos = servidor.responder(prompt)
+                finally:
+                    with servidor._lock:
+                        servidor.simultaneas -= 1
+                if status == 200 and corpo.get('stream'):
+                    return self.enviar_stream(conteudo)
+                if status == 200:
+                    conteudo = {
+                        'id': 'chatcmpl-teste', 'object': 'chat.completion', 'created': 0,
+                        'model': 'gpt-3.5-turbo',
+                        'choices': [{
+                            'index': 0, 'finish_reason': 'stop',
+                            'message': {'role': 'assistant', 'content': conteudo},
+                        }],
+                    }
+                dados = json.dumps(conteudo).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                for nome, valor in cabecalhos.items():
+                    self.send_header(nome, valor)
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def enviar_stream(self, conteudo):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                pedacos = [
+                    conteudo[i:i + servidor.tamanho_pedaco]
+                    for i in range(0, len(conteudo), servidor.tamanho_pedaco)
+                ]
+                for i, pedaco in enumerate(pedacos):
+                    if i == len(pedacos) - 1 and servidor.antes_do_fim:
+                        servidor.antes_do_fim()
+                    evento = {
+                        'id': 'chatcmpl-teste', 'object': 'chat.completion.chunk', 'created': 0,
+                        'model': 'gpt-3.5-turbo',
+                        'choices': [{'index': 0, 'finish_reason': None, 'delta': {'content': pedaco}}],
+                    }
+                    self.wfile.write(f'data: {json.dumps(evento)}\n\n'.encode())
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/v1'
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            OPENAI_BASE_URL=self.url, AI_RETRY_BASE_DELAY=0.01, AI_REQUESTS_PER_MINUTE=60000,
+            AI_CACHE_DIR=self.cache_dir.name,
+        )
+        self.settings.enable()
+        ai_helpers.client = None
+        return self
+
+    def __exit__(self, *exc):
+        self.settings.disable()
+        self.cache_dir.cleanup()
+        ai_helpers.client = None
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def resposta_json(itens):
+    return lambda prompt: (200, json.dumps(itens), {})
+
+
+class AIPipelineTests(CatalogoTestMixin, TestCase):
+    def test_token_bucket(self):
+        relogio = [0.0]
+        bucket = TokenBucket(
+            taxa=2, capacidade=1,
+            relogio=lambda: relogio[0],
+            dormir=lambda segundos: relogio.__setitem__(0, relogio[0] + segundos)
+        )
+        for _ in range(5):
+            bucket.adquirir()
+        # O primeiro token já está disponível; os outros 4 chegam a cada 0,5s
+        self.assertAlmostEqual(relogio[0], 2.0)
+
+    def test_repete_apos_rate_limit(self):
+        falhou = set()
+
+        def responder(prompt):
+            if prompt not in falhou:
+                falhou.add(prompt)
+                return 429, {'error': {'message': 'Rate limit', 'type': 'rate_limit'}}, {'Retry-After': '0'}
+            return 200, '[{"nome": "Cordas", "descricao": "x"}]', {}
+
+        with FakeOpenAIServer(responder) as servidor:
+            dados = ai_helpers.generate_data('categorias', quantidade=1)
+        self.assertEqual(json.loads(dados)[0]['nome'], 'Cordas')
+        self.assertEqual(len(servidor.chamadas), 2)
+
+    def test_erro_nao_retentavel_falha_sem_repetir(self):
+        erro = {'error': {'message': 'Invalid API key', 'type': 'invalid_request_error'}}
+        with FakeOpenAIServer(lambda prompt: (401, erro, {})) as servidor:
+            resultados = list(PipelineIA().executar('categorias', [Tarefa(None, 'categorias', 1)]))
+        self.assertIsNotNone(resultados[0].erro)
+        self.assertEqual(len(servidor.chamadas), 1)
+
+    def test_concorrencia_limitada_e_progresso(self):
+        progresso = []
+        with FakeOpenAIServer(resposta_json([{'nome': 'x'}]), atraso=0.05) as servidor:
+            pipeline = PipelineIA(concorrencia=3, ao_progredir=lambda tabela, p: progresso.append(p))
+            tarefas = [Tarefa(i, f'prompt {i}', 1) for i in range(9)]
+            resultados = list(pipeline.executar('modelos', tarefas))
+        self.assertEqual(sorted(r.tarefa.chave for r in resultados), list(range(9)))
+        self.assertTrue(all(r.erro is None for r in resultados))
+        self.assertGreater(servidor.max_simultaneas, 1)
+        self.assertLessEqual(servidor.max_simultaneas, 3)
+        self.assertEqual([p['concluidas'] for p in progresso], list(range(10)))
+        self.assertEqual((progresso[-1]['chamadas'], progresso[-1]['chamadas_por_item']), (9, 1.0))
+        self.assertEqual(progresso[-1]['percentual'], 100)
+
+    def test_popular_subcategorias_e_modelos(self):
+        self.criar_catalogo()
+
+        # Um nome por categoria: com nomes repetidos os prompts de modelos seriam
+        # idênticos e o cache atenderia um deles conforme a ordem das threads
+        def responder(prompt):
+            if 'subcategorias' in prompt:
+                nome = 'Violinos' if "'Cordas'" in prompt else 'Flautas'
+                return 200, json.dumps([{'nome': nome, 'descricao': 'Gerada'}]), {}
+            return 200, '[{"nome": "Modelo Teste", "descricao": "Gerado"}]', {}
+
+        with FakeOpenAIServer(responder) as servidor:
+            results = popular(['subcategorias', 'modelos'], 1)
+        # Uma chamada por categoria e uma por par marca/subcategoria
+        self.assertEqual(len(servidor.chamadas), 2 + 2 * 4)
+        self.assertEqual(results['subcategorias'], {'created': 2, 'updated': 0, 'failed': 0})
+        self.assertEqual(SubCategoria.objects.get(nome='Violinos').categoria, self.cordas)
+        self.assertEqual(SubCategoria.objects.get(nome='Flautas').categoria, self.sopro)
+        self.assertEqual(results['modelos']['created'], 2)
+        self.assertEqual(results['modelos']['updated'], 6)
+
+
+class PopularUmaChamadaTests(CatalogoTestMixin, TestCase):
+    """A geração em uma chamada de backup/views.ai_populate"""
+
+    def test_cria_o_que_falta_e_ignora_o_resto(self):
+        self.criar_catalogo()
+        resposta = {
+            'categorias': [
+                {'nome': 'Cordas', 'descricao': 'Já existe'},
+                {'nome': 'Teclas', 'descricao': 'Pianos e teclados'},
+                {'nome': 'Sem descrição'},
+            ],
+            'marcas': [
+                {'nome': 'Fender', 'pais_origem': 'Estados Unidos', 'site': 'https://www.fender.com'},
+                {'nome': 'Fender', 'pais_origem': 'Estados Unidos', 'site': 'https://www.fender.com'},
+                {'nome': 'Yamaha', 'pais_origem': 'Japão', 'site': 'https://www.yamaha.com'},
+            ],
+            # Sem marca nem subcategoria o modelo não pode ser gravado
+            'modelos': [{'nome': 'Stratocaster', 'descricao': 'Guitarra'}],
+        }
+        with FakeOpenAIServer(resposta_json(resposta)) as servidor:
+            contagens = popular_uma_chamada(['categorias', 'marcas', 'modelos'])
+        self.assertEqual(len(servidor.chamadas), 1)
+        self.assertIn('"site": ""', servidor.chamadas[0])
+        # (criados, ignorados), como contava o get_or_create por linha
+        self.assertEqual(contagens, {'categorias': (1, 2), 'marcas': (1, 2), 'modelos': (0, 1)})
+        self.assertEqual(Marca.objects.get(nome='Fender').site, 'https://www.fender.com')
+        self.assertFalse(Modelo.objects.filter(nome='Stratocaster').exists())
+
+    def test_somente_tabelas_escolhidas(self):
+        resposta = {'categorias': [{'nome': 'Cordas', 'descricao': 'x'}], 'marcas': [{'nome': 'Fender', 'pais_origem': '', 'site': ''}]}
+        with FakeOpenAIServer(resposta_json(resposta)) as servidor:
+            self.assertEqual(popular_uma_chamada(['marcas']), {'marcas': (1, 0)})
+        self.assertNotIn('categorias', servidor.chamadas[0])
+        self.assertFalse(Categoria.objects.exists())
+
+
+class AICacheTests(TestCase):
+    def test_repeticao_vem_do_cache(self):
+        antes = ai_cache.contadores()
+        with FakeOpenAIServer(resposta_json([{'nome': 'Cordas'}, {'nome': 'Sopro'}])) as servidor:
+            primeira = ai_helpers.generate_data('categorias', quantidade=1)
+            segunda = ai_helpers.generate_data('categorias', quantidade=1)
+            self.assertEqual(len(servidor.chamadas), 1)
+            self.assertEqual(json.loads(segunda), json.loads(primeira))
+
+            # Outra quantidade é outro pedido; o bypass ignora a resposta guardada
+            ai_helpers.generate_data('categorias', quantidade=2)
+            ai_helpers.generate_data('categorias', quantidade=1, usar_cache=False)
+            self.assertEqual(len(servidor.chamadas), 3)
+        depois = ai_cache.contadores()
+        self.assertEqual(depois['hits'] - antes['hits'], 1)
+
+    def test_chunks_do_mesmo_prompt_tem_entradas_proprias(self):
+        def responder(prompt):
+            return 200, json.dumps([{'nome': f'Item {len(servidor.chamadas)}-{i}'} for i in range(10)]), {}
+
+        with FakeOpenAIServer(responder) as servidor:
+            primeira = json.loads(ai_helpers.generate_data('modelos', quantidade=20))
+            segunda = json.loads(ai_helpers.generate_data('modelos', quantidade=20))
+            self.assertEqual(len(servidor.chamadas), 2)
+        self.assertEqual(len(primeira), 20)
+        self.assertEqual(segunda, primeira)
+
+    def test_resposta_incompleta_nao_e_guardada(self):
+        with FakeOpenAIServer(resposta_json([{'nome': 'Cordas'}])) as servidor:
+            ai_helpers.generate_data('categorias', quantidade=2, max_retries=1)
+            ai_helpers.generate_data('categorias', quantidade=2, max_retries=1)
+            self.assertEqual(len(servidor.chamadas), 2)
+
+    def test_ttl_e_despejo_lru(self):
+        with tempfile.TemporaryDirectory() as diretorio, override_settings(AI_CACHE_DIR=diretorio):
+            for i, nome in enumerate(['a', 'b', 'c']):
+                ai_cache.guardar(nome, [nome])
+                os.utime(os.path.join(diretorio, f'{nome}.json'), (1000 + i, 1000 + i))
+            self.assertEqual(ai_cache.obter('a'), ['a'])  # 'a' passa a ser a mais recente
+
+            self.assertEqual(ai_cache.despejar(max_bytes=ai_cache.estatisticas()['bytes'] - 1), 1)
+            self.assertIsNone(ai_cache.obter('b'))
+            self.assertEqual(ai_cache.estatisticas()['entradas'], 2)
+
+            with override_settings(AI_CACHE_TTL=-1):
+                self.assertIsNone(ai_cache.obter('c'))
+            self.assertFalse(os.path.exists(os.path.join(diretorio, 'c.json')))
+
+
+    def test_gravacao_so_lista_o_diretorio_ao_passar_do_limite(self):
+        with tempfile.TemporaryDirectory() as diretorio, override_settings(AI_CACHE_DIR=diretorio, AI_CACHE_MAX_BYTES=10 ** 6):
+            with mock.patch.object(ai_cache, '_entradas', wraps=ai_cache._entradas) as entradas:
+                for i in range(20):
+                    ai_cache.guardar(f'k{i}', ['x' * 100])
+                ai_cache.guardar('k0', ['x' * 100])
+                # Só a primeira gravação mede o diretório
+                self.assertEqual(entradas.call_count, 1)
+
+                tamanho = ai_cache.estatisticas()['bytes']
+                entradas.reset_mock()
+                with override_settings(AI_CACHE_MAX_BYTES=tamanho):
+                    ai_cache.guardar('novo', ['x' * 100])
+                self.assertEqual(entradas.call_count, 1)
+            self.assertLessEqual(ai_cache.estatisticas()['bytes'], tamanho)
+            self.assertEqual(ai_cache.obter('novo'), ['x' * 100])
+
+
+@override_settings(AI_CHUNK_MIN=2, AI_CHUNK_MAX=40)
+class ChunksAdaptativosTests(TestCase):
+    def pedidos(self, prompt):
+        return int(re.search(r'EXATAMENTE (\d+) itens DIFERENTES', prompt).group(1))
+
+    def test_chunk_cresce_com_respostas_completas(self):
+        contador = iter(range(1000))
+
+        def responder(prompt):
+            return 200, json.dumps([{'nome': f'Item {next(contador)}'} for _ in range(self.pedidos(prompt))]), {}
+
+        metricas = Metricas()
+        with FakeOpenAIServer(responder) as servidor:
+            dados = json.loads(ai_helpers.generate_data('modelos', quantidade=35, chunk_size=5, metricas=metricas))
+        self.assertEqual([self.pedidos(prompt) for prompt in servidor.chamadas], [5, 10, 20])
+        self.assertEqual(len(dados), 35)
+        self.assertEqual((metricas.chamadas, metricas.itens), (3, 35))
+        self.assertIn('"Item 0"', servidor.chamadas[1])
+
+    def test_chunk_diminui_apos_resposta_truncada(self):
+        contador = iter(range(1000))
+
+        def responder(prompt):
+            itens = json.dumps([{'nome': f'Item {next(contador)}'} for _ in range(self.pedidos(prompt))])
+            return 200, itens if self.pedidos(prompt) <= 4 else itens[:-20], {}
+
+        metricas = Metricas()
+        with FakeOpenAIServer(responder) as servidor:
+            dados = json.loads(ai_helpers.generate_data('modelos', quantidade=12, chunk_size=8, metricas=metricas))
+        self.assertEqual([self.pedidos(prompt) for prompt in servidor.chamadas], [8, 4, 4, 4])
+        self.assertEqual(len(dados), 12)
+        self.assertEqual(metricas.invalidas, 1)
+
+    def test_repetidos_nao_contam_e_orcamento_encerra(self):
+        with FakeOpenAIServer(resposta_json([{'nome': f'Item {i}'} for i in range(5)])) as servidor:
+            metricas = Metricas()
+            dados = json.loads(ai_helpers.generate_data(
+                'modelos', quantidade=20, chunk_size=5, metricas=metricas, max_chamadas=3,
+            ))
+        self.assertEqual(len(servidor.chamadas), 3)
+        self.assertEqual(len(dados), 5)
+        self.assertEqual(metricas.repetidos, 10)
+        self.assertEqual(metricas.chamadas_por_item, 0.6)
+
+
+class StreamingTests(CatalogoTestMixin, TestCase):
+    def test_parser_incremental(self):
+        parser = ai_helpers.ElementosJSON()
+        texto = '```json\n[{"nome": "A [1]", "x": {"y": "}"}}, "te\\"xto", 3, [1, 2] ,{"nome": "B"}]\n```'
+        elementos = []
+        for caractere in texto:
+            elementos.extend(parser.alimentar(caractere))
+        parser.terminar()
+        self.assertEqual(elementos, [{'nome': 'A [1]', 'x': {'y': '}'}}, 'te"xto', 3, [1, 2], {'nome': 'B'}])
+
+        truncado = ai_helpers.ElementosJSON()
+        self.assertEqual(truncado.alimentar('[{"nome": "A"}, {"nome": "B'), [{'nome': 'A'}])
+        with self.assertRaises(ValueError):
+            truncado.terminar()
+
+    def test_itens_entregues_antes_do_fim_da_resposta(self):
+        recebido = threading.Event()
+        antes_do_fim = []
+        itens = [{'nome': 'Cordas'}, {'nome': 'Sopro'}]
+
+        with FakeOpenAIServer(resposta_json(itens), antes_do_fim=lambda: antes_do_fim.append(recebido.wait(5))):
+            dados = ai_helpers.generate_data('categorias', quantidade=2, ao_item=lambda item: recebido.set())
+        self.assertEqual(antes_do_fim, [True])
+        self.assertEqual(json.loads(dados), itens)
+
+    def test_truncada_pede_apenas_o_que_falta(self):
+        def responder(prompt):
+            if 'EXATAMENTE 3 itens' in prompt:
+                return 200, '[{"nome": "Cordas"}, {"nome": "Sopro"}, {"nome": "Perc', {}
+            return 200, '[{"nome": "Percussão"}]', {}
+
+        entregues = []
+        with FakeOpenAIServer(responder) as servidor:
+            dados = ai_helpers.generate_data('categorias', quantidade=3, ao_item=entregues.append)
+        self.assertEqual(len(servidor.chamadas), 2)
+        self.assertIn('EXATAMENTE 1 itens', servidor.chamadas[1])
+        self.assertEqual([item['nome'] for item in entregues], ['Cordas', 'Sopro', 'Percussão'])
+        self.assertEqual(json.loads(dados), entregues)
+
+    def test_popular_grava_cada_item_em_stream(self):
+        self.criar_catalogo()
+        # O item sem descrição é descartado sozinho; os outros continuam gravados
+        itens = [{'nome': 'Teclas', 'descricao': 'x'}, {'nome': 'Ruim'}, {'nome': 'Cordas', 'descricao': 'y'}]
+        with FakeOpenAIServer(resposta_json(itens), tamanho_pedaco=4):
+            results = popular(['categorias'], 3, pipeline=PipelineIA(max_tentativas=1))
+        self.assertEqual(results['categorias'], {'created': 1, 'updated': 1, 'failed': 0})
+        self.assertEqual(Categoria.objects.get(nome='Cordas').descricao, 'y')
+
+
+class InstrumentosEmLoteTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.criar_catalogo()
+
+    def instrumento(self, ref, **kwargs):
+        return {'ref': ref, 'numero_serie': f'SN{ref}', 'preco': 1500, 'estado': 'usado', 'status': 'disponivel', **kwargs}
+
+    def test_validar_instrumento(self):
+        valido = validar_instrumento({'numero_serie': ' AB1 ', 'preco': '1999.999', 'valor_venda': None})
+        self.assertEqual(valido['numero_serie'], 'AB1')
+        self.assertEqual(valido['preco'], Decimal('2000.00'))
+        self.assertEqual((valido['estado'], valido['status']), ('novo', 'disponivel'))
+        for invalido in [
+            {'preco': 100},
+            {'numero_serie': 'X', 'preco': -1},
+            {'numero_serie': 'X', 'preco': 'caro'},
+            {'numero_serie': 'X', 'preco': 100, 'estado': 'excelente'},
+            'texto',
+        ]:
+            with self.subTest(invalido=invalido):
+                with self.assertRaises(ValueError):
+                    validar_instrumento(invalido)
+
+    def test_lote_com_aceitacao_parcial_e_repescagem(self):
+        def responder(prompt):
+            refs = re.findall(r'^(\d+)\. Modelo', prompt, re.M)
+            if len(refs) == 5:
+                # 3 vem inválido, 4 não vem
+                itens = [self.instrumento(1), self.instrumento(2), self.instrumento(3, estado='excelente'), self.instrumento(5)]
+            else:
+                itens = [self.instrumento(int(ref), numero_serie=f'R{ref}') for ref in refs]
+            return 200, json.dumps(itens), {}
+
+        with FakeOpenAIServer(responder) as servidor:
+            results = popular(['instrumentos'], 5)
+
+        self.assertEqual(len(servidor.chamadas), 2)
+        self.assertEqual(len(re.findall(r'^\d+\. Modelo', servidor.chamadas[1], re.M)), 2)
+        self.assertEqual(results['instrumentos'], {'created': 5, 'updated': 0, 'failed': 0, 'missing': 0})
+        self.assertEqual(
+            sorted(Instrumento.objects.values_list('numero_serie', flat=True)),
+            ['R1', 'R2', 'SN1', 'SN2', 'SN5']
+        )
+        self.assertEqual(sum(m.total_instrumentos for m in Modelo.objects.all()), 5)
+
+    @override_settings(AI_INSTRUMENTOS_POR_LOTE=2)
+    def test_lotes_e_itens_que_nunca_vem(self):
+        def responder(prompt):
+            return 200, json.dumps([self.instrumento(1, numero_serie=f'X{time.monotonic_ns()}')]), {}
+
+        with FakeOpenAIServer(responder) as servidor:
+            results = popular(['instrumentos'], 3)
+        # Lotes [2, 1]: o primeiro aceita 1 item por rodada (2 rodadas), o segundo resolve na primeira
+        self.assertEqual(len(servidor.chamadas), 3)
+        self.assertEqual(results['instrumentos']['created'], 3)
+        self.assertEqual(results['instrumentos']['missing'], 0)
+
+
+class GeracaoIAFilaTests(CatalogoTestMixin, TestCase):
+    def test_view_enfileira_e_retorna_imediatamente(self):
+        response = self.client.post(reverse('ai_populate'), {'tables': ['categorias', 'x'], 'quantidade': 3})
+        geracao = GeracaoIA.objects.get()
+        self.assertRedirects(response, f"{reverse('ai_populate')}?geracao={geracao.pk}")
+        self.assertEqual((geracao.status, geracao.tabelas, geracao.quantidade), (GeracaoIA.PENDENTE, ['categorias'], 3))
+
+        response = self.client.post(
+            reverse('ai_populate'), {'tables': ['marcas']}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], GeracaoIA.PENDENTE)
+
+    def test_view_rejeita_quantidade_invalida(self):
+        for quantidade in ['-1', '0', '51', '100000', 'abc', '']:
+            with self.subTest(quantidade=quantidade):
+                response = self.client.post(reverse('ai_populate'), {'tables': ['marcas'], 'quantidade': quantidade})
+                self.assertEqual(response.status_code, 400)
+                self.assertTemplateUsed(response, 'instrumentos/ai_populate.html')
+                self.assertEqual(response.context['tabelas_selecionadas'], ['marcas'])
+                self.assertContains(response, 'entre 1 e 50', status_code=400)
+
+                response = self.client.post(
+                    reverse('ai_populate'), {'tables': ['marcas'], 'quantidade': quantidade},
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        self.assertFalse(GeracaoIA.objects.exists())
+
+        response = self.client.post(reverse('ai_populate'), {'tables': ['marcas'], 'quantidade': '50'})
+        self.assertEqual(GeracaoIA.objects.get().quantidade, 50)
+
+    def test_worker_executa_geracao(self):
+        geracao = jobs.enfileirar(['categorias'], 1)
+        itens = [{'nome': 'Teclas', 'descricao': 'Instrumentos de teclado'}]
+        with FakeOpenAIServer(resposta_json(itens)):
+            self.assertEqual(jobs.processar_fila(uma_vez=True), 1)
+
+        status = self.client.get(reverse('ai_populate_status', args=[geracao.pk])).json()
+        self.assertEqual(status['status'], GeracaoIA.CONCLUIDA)
+        self.assertEqual(status['resultados']['categorias'], {'created': 1, 'updated': 0, 'failed': 0})
+        self.assertEqual(status['progresso']['categorias']['percentual'], 100)
+        self.assertTrue(Categoria.objects.filter(nome='Teclas').exists())
+
+        response = self.client.get(reverse('ai_populate'), {'geracao': geracao.pk})
+        self.assertEqual(response.context['results'], status['resultados'])
+
+    def test_retoma_geracao_interrompida(self):
+        self.criar_catalogo()
+        geracao = jobs.enfileirar(['categorias', 'subcategorias'], 1)
+        # O worker anterior concluiu as categorias e a primeira categoria antes de cair
+        geracao.concluir_tabela('categorias', {'created': 2, 'updated': 0, 'failed': 0})
+        geracao.registrar_tarefa('subcategorias', chave_tarefa(self.cordas.pk), criados=1)
+        GeracaoIA.objects.filter(pk=geracao.pk).update(
+            status=GeracaoIA.EXECUTANDO, tentativas=1,
+            atualizado_em=timezone.now() - timedelta(hours=1)
+        )
+
+        itens = [{'nome': 'Clarinetes', 'descricao': 'Palheta simples'}]
+        with FakeOpenAIServer(resposta_json(itens)) as servidor:
+            jobs.processar_fila(uma_vez=True)
+
+        self.assertEqual(len(servidor.chamadas), 1)
+        self.assertIn("'Sopro'", servidor.chamadas[0])
+        geracao.refresh_from_db()
+        self.assertEqual((geracao.status, geracao.tentativas), (GeracaoIA.CONCLUIDA, 2))
+        self.assertEqual(geracao.resultados['subcategorias'], {'created': 2, 'updated': 0, 'failed': 0})
+
+    def test_geracao_ativa_nao_e_reservada_de_novo(self):
+        geracao = jobs.enfileirar(['categorias'], 1)
+        self.assertEqual(jobs.reservar_proxima('w1').pk, geracao.pk)
+        self.assertIsNone(jobs.reservar_proxima('w2'))
+
+    def test_geracao_abandonada_esgota_tentativas(self):
+        geracao = jobs.enfileirar(['categorias'], 1)
+        GeracaoIA.objects.filter(pk=geracao.pk).update(
+            status=GeracaoIA.EXECUTANDO, tentativas=3,
+            atualizado_em=timezone.now() - timedelta(hours=1)
+        )
+        self.assertIsNone(jobs.reservar_proxima())
+        geracao.refresh_from_db()
+        self.assertEqual(geracao.status, GeracaoIA.FALHOU)
+
+
+def imagem_png(largura, altura=None):
+    buffer = BytesIO()
+    Image.new('RGB', (largura, altura or largura), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class SiteFalso:
+    """
+    Servidor HTTP local com rotas fixas: caminho -> (status, content-type,
+    corpo, atraso em segundos). Registra (método, caminho) de cada requisição.
+    Os caminhos de `sem_head` respondem 405 a HEAD.
+    """
+
+    def __init__(self, rotas, sem_head=()):
+        self.rotas = rotas
+        self.sem_head = set(sem_head)
+        self.requisicoes = []
+
+    def __enter__(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def responder(self, com_corpo):
+                site.requisicoes.append((self.command, self.path))
+                status, content_type, corpo, atraso = site.rotas.get(self.path, (404, 'text/plain', b'', 0))
+                if not com_corpo and self.path in site.sem_head:
+                    status, content_type = 405, 'text/plain'
+                time.sleep(atraso)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                if com_corpo:
+                    try:
+                        self.wfile.write(corpo)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # o cliente já leu o que precisava e fechou a conexão
+
+            def do_GET(self):
+                self.responder(True)
+
+            def do_HEAD(self):
+                self.responder(False)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(LOGO_CLEARBIT_URL='', LOGO_PRAZO=5, LOGO_TIMEOUT=3)
+class LogosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def pagina(self, *imagens):
+        html = ''.join(f'<img src="{src}" alt="Logo">' for src in imagens)
+        return 200, 'text/html', f'<html><body>{html}</body></html>'.encode(), 0
+
+    def test_primeiro_candidato_aceito_sem_esperar_os_lentos(self):
+        rotas = {
+            '/': self.pagina('/lento-logo.png', '/pequeno-logo.png', '/logo.png'),
+            '/lento-logo.png': (200, 'image/png', imagem_png(300), 2),
+            '/pequeno-logo.png': (200, 'image/png', imagem_png(50), 0),
+            '/logo.png': (200, 'image/png', imagem_png(200), 0.1),
+        }
+        with SiteFalso(rotas) as site:
+            inicio = time.monotonic()
+            logo = logos.buscar_logo_no_site(site.url + '/')
+            self.assertLess(time.monotonic() - inicio, 1.5)
+        self.assertEqual(logo, site.url + '/logo.png')
+
+    @override_settings(LOGO_PRAZO=0.5)
+    def test_prazo_total(self):
+        rotas = {
+            '/': self.pagina('/logo-a.png', '/logo-b.png'),
+            '/logo-a.png': (200, 'image/png', imagem_png(200), 2),
+            '/logo-b.png': (200, 'image/png', imagem_png(200), 2),
+        }
+        with SiteFalso(rotas) as site:
+            inicio = time.monotonic()
+            self.assertIsNone(logos.buscar_logo_no_site(site.url + '/'))
+            self.assertLess(time.monotonic() - inicio, 1.5)
+        # Os favicons nem chegam a ser verificados depois do prazo
+        favicons = set(logos.FAVICONS)
+        self.assertFalse(any(caminho in favicons for _, caminho in site.requisicoes))
+
+    def test_favicon_e_cache_por_dominio(self):
+        rotas = {
+            '/': self.pagina('/logo-quebrado.png'),
+            '/apple-touch-icon.png': (200, 'image/png', imagem_png(180), 0),
+        }
+        with SiteFalso(rotas) as site:
+            self.assertEqual(logos.descobrir_logo(site.url + '/'), site.url + '/apple-touch-icon.png')
+            total = len(site.requisicoes)
+            self.assertEqual(logos.descobrir_logo(site.url + '/outra-pagina'), site.url + '/apple-touch-icon.png')
+            self.assertEqual(len(site.requisicoes), total)
+
+    @override_settings(LOGO_PRAZO=0)
+    def test_prazo_esgotado_nao_grava_cache_negativo(self):
+        with SiteFalso({'/': self.pagina('/logo.png')}) as site:
+            dominio = f'127.0.0.1:{site.httpd.server_port}'
+            with override_settings(LOGO_CLEARBIT_URL=site.url + '/clearbit/{dominio}'):
+                self.assertIsNone(logos.descobrir_logo(site.url + '/'))
+        self.assertEqual(site.requisicoes, [])
+        self.assertIsNone(cache.get(f'logo:{dominio}'))
+        self.assertEqual(logos.Prazo(0).timeout(), logos.TIMEOUT_MINIMO)
+
+    def test_cache_negativo_so_quando_a_busca_termina(self):
+        rotas = {'/': (503, 'text/html', b'<img src="/logo.png">', 0)}
+        with SiteFalso(rotas) as site:
+            dominio = f'127.0.0.1:{site.httpd.server_port}'
+            self.assertIsNone(logos.descobrir_logo(site.url + '/'))
+            self.assertIsNone(cache.get(f'logo:{dominio}'))
+
+            # O site voltou, mas sem logo: agora "nenhum logo" é definitivo
+            site.rotas['/'] = self.pagina()
+            self.assertIsNone(logos.descobrir_logo(site.url + '/'))
+            self.assertEqual(cache.get(f'logo:{dominio}'), '')
+            total = len(site.requisicoes)
+            self.assertIsNone(logos.descobrir_logo(site.url + '/'))
+            self.assertEqual(len(site.requisicoes), total)
+
+    def test_candidatos_verificados_com_head(self):
+        rotas = {
+            '/': self.pagina('/nao-existe-logo.png', '/pagina-logo.png', '/logo.png', '/svg-logo.svg'),
+            '/pagina-logo.png': (200, 'text/html', b'<html></html>', 0),
+            '/logo.png': (200, 'image/png', imagem_png(200), 0.2),
+            '/svg-logo.svg': (200, 'image/svg+xml', b'<svg></svg>', 1),
+        }
+        with SiteFalso(rotas) as site:
+            self.assertEqual(logos.buscar_logo_no_site(site.url + '/'), site.url + '/logo.png')
+        gets = {caminho for metodo, caminho in site.requisicoes if metodo == 'GET'}
+        # Só a página e a imagem rasterizada (para as dimensões) recebem GET
+        self.assertEqual(gets, {'/', '/logo.png'})
+        self.assertIn(('HEAD', '/nao-existe-logo.png'), site.requisicoes)
+        self.assertIn(('HEAD', '/pagina-logo.png'), site.requisicoes)
+
+    def test_get_quando_o_servidor_recusa_head(self):
+        rotas = {
+            '/': self.pagina('/logo.png'),
+            '/logo.png': (200, 'image/png', imagem_png(200), 0),
+        }
+        with SiteFalso(rotas, sem_head={'/logo.png'}) as site:
+            self.assertEqual(logos.buscar_logo_no_site(site.url + '/'), site.url + '/logo.png')
+        self.assertEqual(
+            [requisicao for requisicao in site.requisicoes if requisicao[1] == '/logo.png'][:2],
+            [('HEAD', '/logo.png'), ('GET', '/logo.png')],
+        )
+
+    @override_settings(LOGO_HTML_MAX_BYTES=2048)
+    def test_pagina_inicial_lida_ate_o_limite(self):
+        enchimento = '<p>' + 'x' * 4096 + '</p>'
+        rotas = {
+            '/': (200, 'text/html', f'<html><body>{enchimento}<img src="/logo.png" alt="Logo"></body></html>'.encode(), 0),
+            '/logo.png': (200, 'image/png', imagem_png(200), 0),
+        }
+        with SiteFalso(rotas) as site:
+            self.assertIsNone(logos.buscar_logo_no_site(site.url + '/'))
+        self.assertNotIn(('HEAD', '/logo.png'), site.requisicoes)
+
+    def test_clearbit_antes_do_site(self):
+        with SiteFalso({}) as site:
+            dominio = f'127.0.0.1:{site.httpd.server_port}'
+            site.rotas[f'/clearbit/{dominio}'] = (200, 'image/png', imagem_png(128), 0)
+            with override_settings(LOGO_CLEARBIT_URL=site.url + '/clearbit/{dominio}'):
+                url = logos.descobrir_logo(site.url + '/')
+        self.assertEqual(url, f'{site.url}/clearbit/{dominio}')
+        self.assertEqual(site.requisicoes, [('HEAD', f'/clearbit/{dominio}')])
+
+
+@override_settings(LOGO_CLEARBIT_URL='', LOGO_PRAZO=5, LOGO_TAMANHO_MAXIMO=512, IMAGEM_WORKERS=0)
+class PreencherLogosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.checkpoint = os.path.join(self.media.name, 'checkpoint.json')
+
+    def test_preenche_normaliza_e_retoma(self):
+        rotas = {
+            '/a/': (200, 'text/html', b'<meta property="og:image" content="/a/marca.png">', 0),
+            '/a/marca.png': (200, 'image/png', imagem_png(1200, 600), 0),
+            '/b/': (200, 'text/html', b'<html></html>', 0),
+        }
+        with SiteFalso(rotas) as site:
+            porta = site.httpd.server_port
+            # Hosts diferentes: o cache de logos é por domínio
+            com_logo = Marca.objects.create(nome='Alfa Guitars', site=f'http://127.0.0.1:{porta}/a/')
+            Marca.objects.create(nome='Beta Sopros', site=f'http://localhost:{porta}/b/')
+            Marca.objects.create(nome='Desconhecida')
+            Marca.objects.create(nome='Já Tem', logotipo='logos/ja-tem.png')
+
+            resumo = logos.preencher_logos(logos.CheckpointArquivo(self.checkpoint), concorrencia=2)
+            self.assertEqual(
+                {chave: resumo[chave] for chave in ('total', 'salvos', 'sem_logo', 'erros')},
+                {'total': 3, 'salvos': 1, 'sem_logo': 2, 'erros': 0}
+            )
+            com_logo.refresh_from_db()
+            self.assertRegex(com_logo.logotipo.name, r'^logos/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+            self.assertEqual(ArquivoMidia.objects.get(nome=com_logo.logotipo.name).referencias, 1)
+            with Image.open(com_logo.logotipo.path) as imagem:
+                self.assertEqual(imagem.size, (512, 256))
+            self.assertEqual(com_logo.logotipo_variantes['larguras'], [160, 320])
+
+            # Retomada: nada a fazer, nenhuma requisição nova
+            requisicoes = len(site.requisicoes)
+            saida = StringIO()
+            call_command('preencher_logos', checkpoint=self.checkpoint, stdout=saida)
+            self.assertEqual(len(site.requisicoes), requisicoes)
+            self.assertIn('0/0 marcas', saida.getvalue())
+
+            resumo = logos.preencher_logos(logos.CheckpointArquivo(self.checkpoint), repetir_falhas=True)
+            self.assertEqual((resumo['total'], resumo['sem_logo']), (2, 2))
+
+    def test_svg_nao_agenda_variantes(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+        rotas = {
+            '/': (200, 'text/html', b'<meta property="og:image" content="/marca.svg">', 0),
+            '/marca.svg': (200, 'image/svg+xml', svg, 0),
+        }
+        with SiteFalso(rotas) as site, mock.patch.object(logos.imagens, 'agendar') as agendar:
+            marca = Marca.objects.create(nome='Gama', site=site.url + '/')
+            resumo = logos.preencher_logos(logos.CheckpointArquivo(self.checkpoint))
+        self.assertEqual(resumo['salvos'], 1)
+        agendar.assert_not_called()
+        marca.refresh_from_db()
+        self.assertTrue(marca.logotipo.name.endswith('.svg'))
+        self.assertEqual(marca.logotipo_variantes, {})
+
+
+@override_settings(IMAGEM_LARGURAS=[160, 320, 640, 1280], IMAGEM_WORKERS=0)
+class VariantesImagemTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        self.instrumento = self.criar_instrumento(self.f310)
+
+    def arquivo(self, largura, altura, modo='RGB', formato='JPEG', nome='foto.jpg'):
+        buffer = BytesIO()
+        Image.new(modo, (largura, altura), (200, 0, 0, 128) if modo == 'RGBA' else 'red').save(buffer, formato)
+        return ContentFile(buffer.getvalue(), name=nome)
+
+    def criar_foto(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoInstrumento.objects.create(instrumento=self.instrumento, imagem=self.arquivo(**kwargs))
+        foto.refresh_from_db()
+        return foto
+
+    def existe(self, nome):
+        return os.path.exists(os.path.join(self.media.name, nome))
+
+    def test_upload_gera_variantes_menores_que_o_original(self):
+        foto = self.criar_foto(largura=1000, altura=500)
+        self.assertEqual(foto.variantes, {'largura': 1000, 'larguras': [160, 320, 640], 'formato': 'jpeg'})
+        for nome in imagens.nomes_variantes(foto.imagem.name, foto.variantes):
+            self.assertTrue(self.existe(nome), nome)
+        with Image.open(os.path.join(self.media.name, imagens.nome_variante(foto.imagem.name, 320, 'webp'))) as variante:
+            self.assertEqual(variante.size, (320, 160))
+
+        html = imagem_responsiva(foto.imagem, foto.variantes, '50vw', data_foto_id=foto.pk)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('.w320.webp 320w', html)
+        self.assertIn(f'{foto.imagem.url} 1000w', html)
+        self.assertIn(f'data-foto-id="{foto.pk}"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_transparencia_usa_png_como_fallback(self):
+        foto = self.criar_foto(largura=400, altura=400, modo='RGBA', formato='PNG', nome='logo.png')
+        self.assertEqual(foto.variantes['formato'], 'png')
+        self.assertTrue(self.existe(imagens.nome_variante(foto.imagem.name, 320, 'png')))
+
+    def test_troca_gera_novas_variantes_e_coleta_remove_as_antigas(self):
+        foto = self.criar_foto(largura=700, altura=700)
+        anterior = foto.imagem.name
+        antigas = imagens.nomes_variantes(anterior, foto.variantes)
+
+        foto.imagem = self.arquivo(400, 400, nome='nova.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.save()
+        foto.refresh_from_db()
+        self.assertEqual(foto.variantes['larguras'], [160, 320])
+        self.assertTrue(all(self.existe(nome) for nome in antigas))
+
+        midia.coletar(carencia=0)
+        self.assertFalse(self.existe(anterior))
+        self.assertFalse(any(self.existe(nome) for nome in antigas))
+        self.assertTrue(all(self.existe(nome) for nome in imagens.nomes_variantes(foto.imagem.name, foto.variantes)))
+
+    def test_comando_gera_as_variantes_que_faltam(self):
+        foto = self.criar_foto(largura=500, altura=250)
+        FotoInstrumento.objects.filter(pk=foto.pk).update(variantes={})
+        sem_imagem = FotoInstrumento.objects.create(instrumento=self.instrumento)
+
+        saida = StringIO()
+        call_command('gerar_variantes', workers=2, stdout=saida)
+        foto.refresh_from_db()
+        sem_imagem.refresh_from_db()
+        self.assertEqual(foto.variantes['larguras'], [160, 320])
+        self.assertEqual(sem_imagem.variantes, {})
+        self.assertIn('1 com variantes geradas', saida.getvalue())
+
+
+def foto_de_celular(largura, altura, orientacao=6):
+    """JPEG com EXIF de câmera e a orientação pedida"""
+    exif = Image.Exif()
+    exif[0x0112] = orientacao
+    exif[0x010f] = 'Fabricante do Celular'
+    buffer = BytesIO()
+    Image.new('RGB', (largura, altura), 'blue').save(buffer, 'JPEG', quality=98, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(IMAGEM_DIMENSAO_MAXIMA=1000, IMAGEM_QUALIDADE=85, IMAGEM_WORKERS=0)
+class NormalizacaoUploadTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        self.instrumento = self.criar_instrumento(self.f310)
+
+    def test_orienta_reduz_e_remove_metadados(self):
+        original = foto_de_celular(3000, 2000)
+        normalizada = imagens.normalizar_upload(SimpleUploadedFile('IMG_0001.JPEG', original, 'image/jpeg'))
+        self.assertEqual(normalizada.name, 'IMG_0001.jpg')
+        self.assertLess(normalizada.size, len(original))
+        with Image.open(normalizada) as imagem:
+            # Orientação 6: a foto deitada vira retrato e cabe em 1000 px
+            self.assertEqual(imagem.size, (667, 1000))
+            self.assertEqual(imagem.format, 'JPEG')
+            self.assertEqual(dict(imagem.getexif()), {})
+
+    def test_transparencia_vira_png_e_imagem_pequena_nao_cresce(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (300, 200), (0, 0, 0, 0)).save(buffer, 'PNG')
+        normalizada = imagens.normalizar_upload(SimpleUploadedFile('logo.png', buffer.getvalue(), 'image/png'))
+        with Image.open(normalizada) as imagem:
+            self.assertEqual((imagem.format, imagem.mode, imagem.size), ('PNG', 'RGBA', (300, 200)))
+
+    def test_form_normaliza_so_arquivos_novos(self):
+        form = FotoInstrumentoForm(
+            data={'descricao': 'Frente'},
+            files={'imagem': SimpleUploadedFile('foto.jpg', foto_de_celular(2000, 1500, 1), 'image/jpeg')},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.instance.instrumento = self.instrumento
+        foto = form.save()
+        with Image.open(foto.imagem.path) as imagem:
+            self.assertEqual(imagem.size, (1000, 750))
+            self.assertNotIn('exif', imagem.info)
+
+        # Sem novo upload, a imagem gravada não é reprocessada
+        form = FotoInstrumentoForm(data={'descricao': 'Outra'}, instance=foto)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['imagem'], foto.imagem)
+
+    def test_view_de_nova_foto_grava_a_imagem_normalizada(self):
+        resposta = self.client.post(
+            reverse('foto_create', args=[self.instrumento.pk]),
+            {'imagem': SimpleUploadedFile('foto.jpg', foto_de_celular(1600, 1200), 'image/jpeg'), 'descricao': ''},
+        )
+        self.assertEqual(resposta.status_code, 302)
+        foto = FotoInstrumento.objects.get(instrumento=self.instrumento)
+        with Image.open(foto.imagem.path) as imagem:
+            self.assertEqual(imagem.size, (750, 1000))
+
+
+@override_settings(IMAGEM_LARGURAS=[160], IMAGEM_WORKERS=0)
+class ArmazenamentoPorConteudoTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        self.violao = self.criar_instrumento(self.f310)
+        self.sax = self.criar_instrumento(self.yas280)
+        self.conteudo = imagem_png(400)
+
+    def criar_foto(self, instrumento, nome='foto.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return FotoInstrumento.objects.create(instrumento=instrumento, imagem=ContentFile(self.conteudo, name=nome))
+
+    def existe(self, nome):
+        return os.path.exists(os.path.join(self.media.name, nome))
+
+    def referencias(self, nome):
+        return ArquivoMidia.objects.get(nome=nome).referencias
+
+    def test_mesmo_conteudo_e_gravado_uma_vez(self):
+        primeira = self.criar_foto(self.violao, 'frente.png')
+        segunda = self.criar_foto(self.sax, 'IMG_1234.PNG')
+        self.assertEqual(primeira.imagem.name, segunda.imagem.name)
+        self.assertEqual(self.referencias(primeira.imagem.name), 2)
+        diretorio = os.path.dirname(os.path.join(self.media.name, primeira.imagem.name))
+        originais = [nome for nome in os.listdir(diretorio) if not imagens.eh_variante(nome)]
+        self.assertEqual(len(originais), 1)
+        # A segunda reaproveita as variantes da primeira em vez de gerá-las de novo
+        segunda.refresh_from_db()
+        self.assertEqual(segunda.variantes['larguras'], [160])
+
+    def test_coleta_so_remove_arquivos_sem_referencias(self):
+        primeira = self.criar_foto(self.violao)
+        segunda = self.criar_foto(self.sax)
+        nome = primeira.imagem.name
+        variante = imagens.nome_variante(nome, 160, 'webp')
+
+        primeira.delete()
+        self.assertEqual(self.referencias(nome), 1)
+        self.assertEqual(midia.coletar(carencia=0)['removidos'], 0)
+        self.assertTrue(self.existe(nome))
+
+        segunda.delete()
+        self.assertEqual(self.referencias(nome), 0)
+        # Dentro da carência o arquivo fica
+        self.assertEqual(midia.coletar(carencia=3600), {'removidos': 0, 'bytes': 0, 'mantidos': 1})
+        saida = StringIO()
+        call_command('coletar_midia', carencia=0, stdout=saida)
+        self.assertIn('1 arquivos removidos', saida.getvalue())
+        self.assertFalse(self.existe(nome))
+        self.assertFalse(self.existe(variante))
+        self.assertFalse(ArquivoMidia.objects.filter(nome=nome).exists())
+
+    def test_excluir_marca_mantem_o_logotipo_compartilhado(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            fender = Marca.objects.create(nome='Fender', logotipo=ContentFile(self.conteudo, name='fender.png'))
+            gibson = Marca.objects.create(nome='Gibson', logotipo=ContentFile(self.conteudo, name='gibson.png'))
+        nome = fender.logotipo.name
+        self.assertEqual(gibson.logotipo.name, nome)
+        self.assertEqual(self.referencias(nome), 2)
+
+        self.client.force_login(User.objects.create_user('editor', password='senha'))
+        resposta = self.client.post(reverse('marca_delete', args=[fender.pk]), follow=True)
+        self.assertContains(resposta, 'Marca excluída com sucesso!')
+        self.assertFalse(Marca.objects.filter(pk=fender.pk).exists())
+        self.assertTrue(self.existe(nome))
+        self.assertEqual(self.referencias(nome), 1)
+        self.assertEqual(midia.coletar(carencia=0)['removidos'], 0)
+
+    def test_varredura_e_recalculo(self):
+        foto = self.criar_foto(self.violao)
+        os.makedirs(os.path.join(self.media.name, 'logos'))
+        with open(os.path.join(self.media.name, 'logos', 'antigo.png'), 'wb') as f:
+            f.write(self.conteudo)
+        ArquivoMidia.objects.all().delete()
+
+        self.assertEqual(midia.coletar(carencia=0)['removidos'], 0)
+        resultado = midia.coletar(carencia=0, varrer=True, simular=True)
+        self.assertEqual(resultado['removidos'], 1)
+        self.assertTrue(self.existe('logos/antigo.png'))
+
+        call_command('coletar_midia', carencia=0, varrer=True, recalcular=True, stdout=StringIO())
+        self.assertFalse(self.existe('logos/antigo.png'))
+        self.assertTrue(self.existe(foto.imagem.name))
+        self.assertEqual(self.referencias(foto.imagem.name), 1)
+
+
+@override_settings(IMAGEM_LARGURAS=[160], IMAGEM_WORKERS=0, UPLOAD_PEDACO_MAXIMO=4096, UPLOAD_WORKERS=3)
+class UploadEmPedacosTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(
+            MEDIA_ROOT=self.media.name, UPLOAD_PARCIAL_DIR=os.path.join(self.media.name, 'parciais')
+        )
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        self.instrumento = self.criar_instrumento(self.f310)
+        FotoInstrumento.objects.create(instrumento=self.instrumento, ordem=5)
+        self.usuario = User.objects.create_user('fotografo', password='senha')
+        self.client.force_login(self.usuario)
+
+    def iniciar(self, arquivos):
+        resposta = self.client.post(
+            reverse('foto_upload_iniciar', args=[self.instrumento.pk]),
+            json.dumps({'arquivos': arquivos}), content_type='application/json',
+        )
+        return resposta
+
+    def enviar(self, upload, conteudo, inicio, fim):
+        return self.client.put(
+            upload['url'], conteudo[inicio:fim], content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {inicio}-{fim - 1}/{len(conteudo)}'},
+        )
+
+    def concluir(self, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                reverse('foto_upload_concluir', args=[self.instrumento.pk]),
+                json.dumps({'ids': ids}), content_type='application/json',
+            )
+        return resposta.json()['arquivos']
+
+    def test_upload_retomavel_e_conclusao_em_lote(self):
+        frente, verso = foto_de_celular(900, 600), foto_de_celular(700, 500, 1)
+        invalido = b'isto nao e uma imagem'
+        resposta = self.iniciar([
+            {'nome': 'frente.jpg', 'tamanho': len(frente), 'descricao': 'Frente'},
+            {'nome': 'verso.jpg', 'tamanho': len(verso)},
+            {'nome': 'texto.jpg', 'tamanho': len(invalido)},
+            {'nome': 'incompleto.jpg', 'tamanho': 10},
+        ])
+        self.assertEqual(resposta.status_code, 201)
+        frente_up, verso_up, invalido_up, incompleto_up = resposta.json()['uploads']
+
+        # Pedaço fora de posição: 409 com o ponto de retomada
+        self.assertEqual(self.enviar(frente_up, frente, 0, 4096).json()['recebido'], 4096)
+        resposta = self.enviar(frente_up, frente, 0, 4096)
+        self.assertEqual((resposta.status_code, resposta.json()['recebido']), (409, 4096))
+        self.assertEqual(self.client.get(frente_up['url']).json()['recebido'], 4096)
+        for inicio in range(4096, len(frente), 4096):
+            self.assertEqual(self.enviar(frente_up, frente, inicio, min(inicio + 4096, len(frente))).status_code, 200)
+        for inicio in range(0, len(verso), 4096):
+            self.enviar(verso_up, verso, inicio, min(inicio + 4096, len(verso)))
+        self.enviar(invalido_up, invalido, 0, len(invalido))
+        self.enviar(incompleto_up, b'0123456789', 0, 5)
+
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = self.concluir([u['id'] for u in (frente_up, verso_up, invalido_up, incompleto_up)])
+        insercoes = [q for q in consultas.captured_queries if q['sql'].startswith('INSERT INTO "instrumentos_fotoinstrumento"')]
+        self.assertEqual(len(insercoes), 1)
+        self.assertEqual([r['status'] for r in resultado], ['concluido', 'concluido', 'falhou', 'recebendo'])
+        self.assertEqual(resultado[2]['erro'], 'Arquivo não é uma imagem válida')
+        self.assertEqual(resultado[3]['recebido'], 5)
+
+        foto = FotoInstrumento.objects.get(pk=resultado[0]['foto_id'])
+        self.assertEqual((foto.descricao, foto.ordem), ('Frente', 6))
+        self.assertEqual(FotoInstrumento.objects.get(pk=resultado[1]['foto_id']).ordem, 7)
+        with Image.open(foto.imagem.path) as imagem:
+            self.assertEqual(imagem.size, (600, 900))
+        self.assertEqual(ArquivoMidia.objects.get(nome=foto.imagem.name).referencias, 1)
+        self.assertEqual(foto.variantes, {'largura': 600, 'larguras': [160], 'formato': 'jpeg'})
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'parciais')), [f"{incompleto_up['id']}.part"])
+
+        # Concluir de novo não duplica as fotos
+        self.assertEqual([r['status'] for r in self.concluir([frente_up['id']])], ['concluido'])
+        self.assertEqual(self.instrumento.fotos.count(), 3)
+
+    def test_validacoes(self):
+        self.assertEqual(self.iniciar([{'nome': 'grande.jpg', 'tamanho': 10 ** 12}]).status_code, 400)
+        self.assertEqual(self.iniciar([{'nome': 'sem-tamanho.jpg'}]).status_code, 400)
+        upload = self.iniciar([{'nome': 'a.jpg', 'tamanho': 10000}]).json()['uploads'][0]
+        self.assertEqual(self.client.put(upload['url'], b'x', content_type='application/octet-stream').status_code, 400)
+        # Pedaço maior que UPLOAD_PEDACO_MAXIMO
+        self.assertEqual(self.enviar(upload, b'x' * 10000, 0, 5000).status_code, 400)
+
+    def test_limpa_uploads_abandonados(self):
+        upload = self.iniciar([{'nome': 'a.jpg', 'tamanho': 10}]).json()['uploads'][0]
+        self.enviar(upload, b'0123456789', 0, 5)
+        UploadFoto.objects.update(atualizado_em=timezone.now() - timedelta(days=2))
+        parcial = os.path.join(self.media.name, 'parciais', f"{upload['id']}.part")
+        os.utime(parcial, (time.time() - 2 * 86400,) * 2)
+
+        saida = StringIO()
+        call_command('limpar_uploads', horas=24, stdout=saida)
+        self.assertIn('1 uploads abandonados removidos', saida.getvalue())
+        self.assertFalse(os.path.exists(parcial))
+
+    def test_exige_login_e_o_dono_do_upload(self):
+        upload = self.iniciar([{'nome': 'a.jpg', 'tamanho': 10}]).json()['uploads'][0]
+
+        anonimo = Client()
+        for resposta in [
+            anonimo.post(reverse('foto_upload_iniciar', args=[self.instrumento.pk]), '{}', content_type='application/json'),
+            anonimo.get(upload['url']),
+            anonimo.post(reverse('foto_upload_concluir', args=[self.instrumento.pk]), '{}', content_type='application/json'),
+        ]:
+            self.assertEqual(resposta.status_code, 302)
+            self.assertTrue(resposta['Location'].startswith(reverse('login')))
+
+        self.client.force_login(User.objects.create_user('outro', password='senha'))
+        self.assertEqual(self.client.get(upload['url']).status_code, 404)
+        self.assertEqual(self.enviar(upload, b'0123456789', 0, 10).status_code, 404)
+        self.assertEqual(self.concluir([upload['id']]), [])
+        self.assertEqual(UploadFoto.objects.get().recebido, 0)
+
+    @override_settings(UPLOAD_SESSOES_POR_USUARIO=3, UPLOAD_ABANDONO_HORAS=24)
+    def test_limite_de_uploads_abertos_por_usuario(self):
+        arquivos = [{'nome': f'{n}.jpg', 'tamanho': 10} for n in range(2)]
+        primeiro = self.iniciar(arquivos).json()['uploads'][0]
+        self.enviar(primeiro, b'0123456789', 0, 5)
+        resposta = self.iniciar(arquivos)
+        self.assertEqual(resposta.status_code, 429)
+        self.assertEqual(UploadFoto.objects.count(), 2)
+
+        # Outro usuário tem o seu próprio limite
+        self.client.force_login(User.objects.create_user('outro', password='senha'))
+        self.assertEqual(self.iniciar(arquivos).status_code, 201)
+
+        # Os uploads abandonados do usuário são removidos ao abrir novos
+        self.client.force_login(self.usuario)
+        UploadFoto.objects.filter(usuario=self.usuario).update(atualizado_em=timezone.now() - timedelta(days=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.iniciar(arquivos).status_code, 201)
+        self.assertFalse(UploadFoto.objects.filter(pk=primeiro['id']).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, 'parciais', f"{primeiro['id']}.part")))
+        self.assertEqual(UploadFoto.objects.filter(usuario=self.usuario).count(), 2)
+
+
+@override_settings(IMAGEM_LARGURAS=[160], IMAGEM_WORKERS=0)
+class InstrumentoDetalheTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        self.instrumento = self.criar_instrumento(self.f310, numero_serie='SN-1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fotos = [
+                FotoInstrumento.objects.create(
+                    instrumento=self.instrumento, ordem=ordem, descricao=f'Foto {ordem}',
+                    imagem=ContentFile(imagem_png(200 + ordem), name=f'{ordem}.png'),
+                )
+                for ordem in (2, 1, 3)
+            ]
+        self.url = reverse('instrumento_detail', args=[self.instrumento.pk])
+
+    def test_consultas_fixas_e_bloco_de_fotos_em_cache(self):
+        # Instrumento com a classificação + fotos; com o bloco em cache, só o instrumento
+        with self.assertNumQueries(2):
+            resposta = self.client.get(self.url)
+        self.assertContains(resposta, 'Violões')
+        self.assertContains(resposta, 'Yamaha')
+        html = resposta.content.decode()
+        self.assertEqual(html.count('class="carousel-item'), 3)
+        self.assertLess(html.index('alt="Foto 1"'), html.index('alt="Foto 2"'))
+        # O bloco guardado não leva o token CSRF desta requisição
+        bloco = cache.get(fotos.chave(self.instrumento.pk))
+        self.assertIn('<input type="hidden" name="csrfmiddlewaretoken" class="csrf-foto">', bloco)
+
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_mudancas_nas_fotos_invalidam_o_bloco(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('foto_update_descricao', args=[self.instrumento.pk, self.fotos[0].pk]),
+                {'descricao': 'Detalhe do tampo'},
+            )
+        self.assertContains(self.client.get(self.url), 'alt="Detalhe do tampo"')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fotos[1].delete()
+        self.assertEqual(self.client.get(self.url).content.decode().count('class="carousel-item'), 2)
+
+        # Variantes gravadas sem signals também invalidam
+        self.client.get(self.url)
+        FotoInstrumento.objects.update(variantes={})
+        imagens.atualizar_variantes(FotoInstrumento.objects.get(pk=self.fotos[0].pk))
+        self.assertIsNone(cache.get(fotos.chave(self.instrumento.pk)))
+
+
+class LookupAPITests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.criar_catalogo()
+
+    def get(self, url, etag=None):
+        return self.client.get(url, headers={'If-None-Match': etag} if etag else {})
+
+    def test_etag_responde_304_sem_consultar_o_banco(self):
+        url = reverse('modelos_por_marca', args=[self.yamaha.pk])
+        resposta = self.get(url)
+        self.assertEqual([item['nome'] for item in resposta.json()], ['F310', 'YAS-280'])
+        etag = resposta['ETag']
+        self.assertTrue(etag.startswith('"modelo.'))
+        self.assertIn('must-revalidate', resposta['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(url, etag).status_code, 304)
+        # O corpo da versão atual também vem do cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(url).status_code, 200)
+        # Outra marca, outra ETag
+        self.assertNotEqual(self.get(reverse('modelos_por_marca', args=[self.selmer.pk]))['ETag'], etag)
+
+    def test_gravacoes_mudam_a_versao(self):
+        url = reverse('subcategorias_por_categoria', args=[self.cordas.pk])
+        etag = self.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            SubCategoria.objects.create(nome='Guitarras', categoria=self.cordas)
+        resposta = self.get(url, etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([item['nome'] for item in resposta.json()], ['Guitarras', 'Violões'])
+
+        # Gravação em lote não dispara signals, mas também muda a versão
+        etag = self.get(reverse('modelos_por_marca', args=[self.selmer.pk]))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.upsert(
+                Modelo, [{'nome': 'Serie III', 'marca_id': self.selmer.pk, 'subcategoria_id': self.saxofones.pk}],
+                chave=('nome', 'marca_id'), campos=('subcategoria_id',),
+            )
+        self.assertEqual(self.get(reverse('modelos_por_marca', args=[self.selmer.pk]), etag).status_code, 200)
+
+        # Cache esvaziado: as versões recomeçam sem repetir uma ETag antiga
+        cache.clear()
+        self.assertNotEqual(self.get(url)['ETag'], etag)
+
+    def test_taxonomia_completa(self):
+        resposta = self.get(reverse('taxonomia_api'))
+        dados = resposta.json()
+        self.assertEqual([item['nome'] for item in dados['categorias']], ['Cordas', 'Sopro'])
+        self.assertIn({'id': self.violoes.pk, 'nome': 'Violões', 'categoria_id': self.cordas.pk}, dados['subcategorias'])
+        self.assertIn(
+            {'id': self.mark6.pk, 'nome': 'Mark VI', 'marca_id': self.selmer.pk, 'subcategoria_id': self.saxofones.pk},
+            dados['modelos']
+        )
+        self.assertEqual(resposta['ETag'], f'"{versoes.etag()}"')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(reverse('taxonomia_api'), resposta['ETag']).status_code, 304)
+
+
+class TaxonomiaEmMemoriaTests(CatalogoTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        taxonomia.descartar()
+        self.criar_catalogo()
+
+    def test_listagem_de_modelos_consulta_so_a_pagina(self):
+        url = reverse('modelo_list')
+        self.client.get(url)
+        # Com a taxonomia carregada: só o COUNT da paginação e a página
+        with self.assertNumQueries(2):
+            resposta = self.client.get(url)
+        self.assertEqual([marca.nome for marca in resposta.context['marcas']], ['Selmer', 'Yamaha'])
+        self.assertEqual([sub.rotulo for sub in resposta.context['subcategorias']], ['Cordas - Violões', 'Sopro - Saxofones'])
+
+    def test_formulario_renderiza_sem_consultar_a_taxonomia(self):
+        instrumento = self.criar_instrumento(self.yas280)
+        str(InstrumentoCreateForm(instance=instrumento))
+        with self.assertNumQueries(0):
+            form = InstrumentoCreateForm(instance=instrumento)
+            html = str(form['subcategoria']) + str(form['modelo']) + str(form['marca'])
+        self.assertIn('Sopro - Saxofones', html)
+        self.assertNotIn('Violões', html)
+        self.assertIn('Yamaha - YAS-280', html)
+        self.assertNotIn('Mark VI', html)
+
+        # No envio, as opções seguem o que foi escolhido e a validação usa os querysets
+        form = InstrumentoCreateForm(data={'categoria': self.cordas.pk, 'marca': self.selmer.pk})
+        self.assertEqual([rotulo for _, rotulo in form.fields['subcategoria'].choices][1:], ['Cordas - Violões'])
+        self.assertEqual(list(form.fields['modelo'].queryset), [self.mark6])
+        self.assertIn('modelo', form.errors)
+
+    def test_gravacao_descarta_a_copia_local(self):
+        self.assertEqual(len(taxonomia.marcas()), 2)
+        Marca.objects.create(nome='Fender')
+        self.assertEqual([marca.nome for marca in taxonomia.marcas()], ['Fender', 'Selmer', 'Yamaha'])
+        self.f310.delete()
+        self.assertNotIn(self.f310.pk, [modelo.id for modelo in taxonomia.modelos()])
+
+    def test_outro_processo_invalida_pela_versao(self):
+        taxonomia.categorias()
+        # Gravação sem signals, como a de outro processo: a cópia local só muda com a versão
+        Categoria.objects.filter(pk=self.cordas.pk).update(nome='Cordas dedilhadas')
+        with self.assertNumQueries(0):
+            self.assertEqual(taxonomia.categorias()[0].nome, 'Cordas')
+        versoes.incrementar('categoria')
+        self.assertEqual(taxonomia.categorias()[0].nome, 'Cordas dedilhadas')
+
+    def test_filtros_do_admin(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha'))
+        resposta = self.client.get(reverse('admin:instrumentos_modelo_changelist'))
+        filtros = {spec.title: [rotulo for _, rotulo in spec.lookup_choices] for spec in resposta.context['cl'].filter_specs}
+        self.assertEqual(filtros['marca'], ['Selmer', 'Yamaha'])
+        self.assertEqual(filtros['subcategoria'], ['Cordas - Violões', 'Sopro - Saxofones'])
+
+
+class ConsultasConstantesMixin:
+    """
+    Confere que uma página custa o mesmo número de consultas com poucas ou
+    muitas linhas: `crescer(inicio, fim)` cria as linhas de `inicio` a `fim`
+    e a página é medida em cada um dos TAMANHOS, já com a taxonomia em
+    memória carregada.
+    """
+    TAMANHOS = (10, 10_000)
+
+    def contar_consultas(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, url, crescer):
+        contagens, total = {}, 0
+        for tamanho in self.TAMANHOS:
+            crescer(total, tamanho)
+            total = tamanho
+            contagens[tamanho] = self.contar_consultas(url)
+        self.assertEqual(len(set(contagens.values())), 1, f'Consultas por tamanho do catálogo em {url}: {contagens}')
+        return contagens[total]
+
+
+class ListagensConsultasConstantesTests(ConsultasConstantesMixin, CatalogoTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        taxonomia.descartar()
+        self.criar_catalogo()
+        self.marcas = [self.yamaha, self.selmer] + Marca.objects.bulk_create(Marca(nome=f'Marca {i}') for i in range(8))
+
+    def criar_modelos(self, inicio, fim):
+        Modelo.objects.bulk_create(
+            Modelo(nome=f'Modelo {i:05d}', marca=self.marcas[i % len(self.marcas)], subcategoria=self.violoes)
+            for i in range(inicio, fim)
+        )
+
+    def criar_categorias(self, inicio, fim):
+        Categoria.objects.bulk_create(Categoria(nome=f'Categoria {i:05d}') for i in range(inicio, fim))
+
+    def criar_subcategorias(self, inicio, fim):
+        SubCategoria.objects.bulk_create(
+            SubCategoria(nome=f'Sub {i:05d}', categoria=(self.cordas, self.sopro)[i % 2]) for i in range(inicio, fim)
+        )
+
+    def test_modelos(self):
+        # COUNT da paginação e a página, com marca, subcategoria e categoria no JOIN
+        self.assertEqual(self.assertConsultasConstantes(reverse('modelo_list'), self.criar_modelos), 2)
+
+    def test_categorias(self):
+        self.assertEqual(self.assertConsultasConstantes(reverse('categoria_list'), self.criar_categorias), 2)
+
+    def test_subcategorias(self):
+        self.assertEqual(self.assertConsultasConstantes(reverse('subcategoria_list'), self.criar_subcategorias), 2)
+
+
+class OrcamentoConsultasMixin:
+    """
+    `requisitar` faz o request pelo client e falha o teste quando a rota não
+    declarou orçamento em ORCAMENTOS ou fez mais consultas do que ele
+    permite, listando os suspeitos de N+1.
+    """
+    def requisitar(self, url, metodo='get', **kwargs):
+        with orcamento.Registro() as registro:
+            resposta = getattr(self.client, metodo)(url, **kwargs)
+        rota = resposta.resolver_match.view_name
+        limite = orcamento.orcamento(rota)
+        if limite is None:
+            self.fail(f'A rota {rota} não declarou orçamento em ORCAMENTOS')
+        if len(registro) > limite:
+            self.fail(registro.relatorio(rota, limite))
+        resposta.consultas = registro
+        return resposta
+
+
+@override_settings(IMAGEM_LARGURAS=[160], IMAGEM_WORKERS=0)
+class OrcamentoConsultasTests(OrcamentoConsultasMixin, CatalogoTestMixin, TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.settings_media = override_settings(
+            MEDIA_ROOT=self.media.name, UPLOAD_PARCIAL_DIR=os.path.join(self.media.name, 'parciais')
+        )
+        self.settings_media.enable()
+        self.addCleanup(self.settings_media.disable)
+        self.criar_catalogo()
+        # Vários registros em cada tabela, para um N+1 aparecer como consultas a mais
+        self.instrumentos = [
+            self.criar_instrumento(modelo, numero_serie=f'SN-{i}')
+            for i, modelo in enumerate([self.f310, self.yas280, self.mark6] * 2)
+        ]
+        self.instrumento = self.instrumentos[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fotos = [
+                FotoInstrumento.objects.create(
+                    instrumento=instrumento, ordem=ordem, imagem=ContentFile(imagem_png(200 + ordem + i), name='foto.png')
+                )
+                for i, instrumento in enumerate(self.instrumentos[:3])
+                for ordem in (1, 2)
+            ]
+        # Algumas views exigem login; a sessão e o usuário entram na conta de todas
+        usuario = User.objects.create_user('orcamento', password='senha')
+        self.client.force_login(usuario)
+        self.upload = uploads.iniciar(self.instrumento, [{'nome': 'foto.jpg', 'tamanho': 10}], usuario)[0]
+        self.geracao = jobs.enfileirar(['categorias'], 1)
+
+    def requisicoes(self):
+        """(rota, args, método, kwargs do client) cobrindo todas as rotas de urls.py"""
+        i, foto = self.instrumento.pk, self.fotos[0].pk
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        return [
+            ('home', [], 'get', {}),
+            ('inicial', [], 'get', {}),
+            ('categoria_list', [], 'get', {}),
+            ('categoria_detail', [self.cordas.pk], 'get', {}),
+            ('categoria_create', [], 'get', {}),
+            ('categoria_update', [self.cordas.pk], 'get', {}),
+            ('categoria_delete', [self.cordas.pk], 'get', {}),
+            ('subcategoria_list', [], 'get', {}),
+            ('subcategoria_detail', [self.saxofones.pk], 'get', {}),
+            ('subcategoria_create', [], 'get', {}),
+            ('subcategoria_update', [self.saxofones.pk], 'get', {}),
+            ('subcategoria_delete', [self.saxofones.pk], 'get', {}),
+            ('marca_list', [], 'get', {}),
+            ('marca_create', [], 'get', {}),
+            ('marca_update', [self.yamaha.pk], 'get', {}),
+            ('marca_delete', [self.yamaha.pk], 'get', {}),
+            ('modelo_list', [], 'get', {}),
+            ('modelo_detail', [self.f310.pk], 'get', {}),
+            ('modelo_create', [], 'get', {}),
+            ('modelo_update', [self.f310.pk], 'get', {}),
+            ('modelo_delete', [self.f310.pk], 'get', {}),
+            ('instrumento_list', [], 'get', {}),
+            ('instrumento_create', [], 'get', {}),
+            ('instrumento_detail', [i], 'get', {}),
+            ('instrumento_update', [i], 'get', {}),
+            ('instrumento_delete', [i], 'get', {}),
+            ('foto_create', [i], 'post', {'data': {
+                'imagem': SimpleUploadedFile('nova.png', imagem_png(320), content_type='image/png'), 'descricao': 'Verso',
+            }}),
+            ('foto_update_descricao', [i, foto], 'post', {'data': {'descricao': 'Frente'}}),
+            ('foto_delete', [i, foto], 'post', {}),
+            ('foto_upload_iniciar', [i], 'post', {
+                'data': json.dumps({'arquivos': [{'nome': f'{n}.jpg', 'tamanho': 10} for n in range(3)]}),
+                'content_type': 'application/json',
+            }),
+            ('foto_upload_concluir', [i], 'post', {
+                'data': json.dumps({'ids': [str(self.upload.pk)]}), 'content_type': 'application/json',
+            }),
+            ('modelos_por_marca', [self.yamaha.pk], 'get', {}),
+            ('subcategorias_por_categoria', [self.sopro.pk], 'get', {}),
+            ('taxonomia_api', [], 'get', {}),
+            ('modelo_create_ajax', [], 'post', {
+                'data': {'nome': 'C40', 'marca': self.yamaha.pk, 'subcategoria': self.violoes.pk}, **ajax,
+            }),
+            ('busca_api', [], 'get', {'data': {'q': 'yamaha'}}),
+            ('foto_upload', [self.upload.pk], 'get', {}),
+            ('ai_populate', [], 'get', {}),
+            ('ai_populate_status', [self.geracao.pk], 'get', {}),
+        ]
+
+    def test_todas_as_rotas_tem_orcamento(self):
+        rotas = {padrao.name for padrao in urlpatterns}
+        self.assertEqual(rotas, set(ORCAMENTOS))
+        self.assertEqual(rotas, {rota for rota, *_ in self.requisicoes()})
+
+    def test_rotas_dentro_do_orcamento(self):
+        for rota, args, metodo, kwargs in self.requisicoes():
+            with self.subTest(rota=rota):
+                # Caches frios: o pior caso de cada rota
+                cache.clear()
+                taxonomia.descartar()
+                resposta = self.requisitar(reverse(rota, args=args), metodo, **kwargs)
+                self.assertLess(resposta.status_code, 400, rota)
+
+    def test_n_mais_1_estoura_o_orcamento(self):
+        cache.clear()
+        taxonomia.descartar()
+        # Sem o select_related, cada card da listagem consulta a sua marca
+        sem_join = lambda view: Modelo.objects.order_by('marca__nome', 'nome')
+        with mock.patch.object(ModeloListView, 'get_queryset', sem_join):
+            with self.assertRaises(self.failureException) as erro:
+                self.requisitar(reverse('modelo_list'))
+        self.assertIn('modelo_list: 8 consultas SQL, orçamento de 5', str(erro.exception))
+        self.assertIn('Possíveis N+1:\n  3x SELECT "instrumentos_marca"', str(erro.exception))
+
+    def test_middleware(self):
+        url = reverse('categoria_list')
+        with override_settings(ORCAMENTO_CONSULTAS=True, ORCAMENTO_CONSULTAS_ESTOURO='erro'):
+            client = Client()
+            self.assertEqual(client.get(url)['X-Consultas-SQL'], '2')
+            with mock.patch.dict(ORCAMENTOS, {'categoria_list': 1}):
+                with self.assertRaises(orcamento.OrcamentoEstourado), self.assertLogs('django.request', 'ERROR'):
+                    client.get(url)
+                with override_settings(ORCAMENTO_CONSULTAS_ESTOURO='aviso'), self.assertLogs('instrumentos.orcamento', 'WARNING') as logs:
+                    self.assertEqual(client.get(url).status_code, 200)
+        self.assertIn('categoria_list: 2 consultas SQL, orçamento de 1', logs.output[0])
+        # Desligado (padrão sem DEBUG), o middleware nem entra na cadeia
+        self.assertNotIn('X-Consultas-SQL', Client().get(url))
+
+
+class CatalogoSinteticoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        taxonomia.descartar()
+
+    def instrumentos(self):
+        return list(Instrumento.objects.order_by('pk').values_list(
+            'nome', 'modelo__nome', 'categoria__nome', 'preco', 'status', 'valor_venda', 'data_aquisicao'
+        ))
+
+    def test_mesma_semente_mesmo_catalogo(self):
+        criados = sintetico.gerar(400, semente=7, tamanho_lote=150)
+        self.assertEqual((criados['categorias'], criados['marcas'], criados['instrumentos']), (6, 16, 400))
+        primeiro = self.instrumentos()
+        with self.assertRaises(sintetico.CatalogoNaoVazio):
+            sintetico.gerar(10)
+
+        sintetico.limpar()
+        self.assertFalse(Categoria.objects.exists() or Instrumento.objects.exists())
+        sintetico.gerar(400, semente=7)
+        self.assertEqual(self.instrumentos(), primeiro)
+        sintetico.limpar()
+        sintetico.gerar(400, semente=8)
+        self.assertNotEqual(self.instrumentos(), primeiro)
+
+    def test_distribuicao_desigual_e_contadores(self):
+        sintetico.gerar(1000, semente=7)
+        # Contadores e índice refeitos no fim, como se cada linha tivesse passado pelos signals
+        self.assertEqual(sum(Categoria.objects.values_list('total_instrumentos', flat=True)), 1000)
+        self.assertEqual(Categoria.objects.get(nome='Cordas').total_subcategorias, 8)
+        self.assertTrue(search.buscar('yamaha', tipos=['marca']))
+        marcas = list(Marca.objects.order_by('-total_instrumentos').values_list('total_instrumentos', flat=True))
+        modelos = list(Modelo.objects.order_by('-total_instrumentos').values_list('total_instrumentos', flat=True))
+        # A marca e o modelo mais comuns concentram bem mais que a média
+        self.assertGreater(marcas[0], 3 * 1000 / len(marcas))
+        self.assertGreater(modelos[0], 5 * 1000 / len(modelos))
+        self.assertEqual(Instrumento.objects.filter(status='vendido', valor_venda__isnull=True).count(), 0)
+
+    def test_tamanho(self):
+        self.assertEqual([sintetico.tamanho(valor) for valor in ('1k', '100K', '1m', '2_500')], [1_000, 100_000, 1_000_000, 2_500])
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        taxonomia.descartar()
+        sintetico.gerar(300, semente=3)
+
+    def test_mede_todas_as_rotas_e_compara_com_a_base(self):
+        rotas = benchmark.medir(repeticoes=2)
+        self.assertEqual(set(rotas), set(benchmark.ROTAS))
+        for rota, medicao in rotas.items():
+            self.assertEqual(medicao['status'], 200, rota)
+            self.assertLessEqual(medicao['consultas_frio'], medicao['orcamento'], rota)
+        # Com os caches quentes, as APIs de lookup não consultam o banco
+        self.assertEqual(rotas['taxonomia_api']['consultas'], 0)
+
+        base = {'ambiente': benchmark.ambiente(), 'tamanhos': {'1k': {'rotas': rotas}}}
+        self.assertEqual(benchmark.comparar(base, base, latencia=True), [])
+        pior = json.loads(json.dumps(base))
+        pior['tamanhos']['1k']['rotas']['modelo_list'].update(consultas=9, mediana_ms=rotas['modelo_list']['mediana_ms'] * 2 + 10)
+        # Por padrão só as consultas; a latência quando pedida e no mesmo ambiente
+        self.assertEqual([regressao.split(':')[0] for regressao in benchmark.comparar(pior, base)], ['1k modelo_list'])
+        self.assertEqual(
+            [regressao.split(':')[0] for regressao in benchmark.comparar(pior, base, latencia=True)], ['1k modelo_list'] * 2
+        )
+        pior['ambiente'] = {**pior['ambiente'], 'maquina': 'outra'}
+        self.assertEqual(len(benchmark.comparar(pior, base, latencia=True)), 1)
@@ -0,0 +1,196 @@
+"""
+Upload de várias fotos em pedaços, retomável, para um instrumento.
+
+O cliente, autenticado, abre um upload por arquivo (`iniciar`), envia os bytes em
+pedaços com `Content-Range` (`receber_pedaco`), cada um gravado na sua
+posição de um arquivo parcial em UPLOAD_PARCIAL_DIR, e por fim pede a
+conclusão de vários uploads de uma vez (`concluir`). Se a conexão cair, o
+cliente consulta o upload e continua do byte `recebido`. Cada usuário
+mantém no máximo UPLOAD_SESSOES_POR_USUARIO uploads abertos; os seus
+uploads sem atividade há UPLOAD_ABANDONO_HORAS são removidos quando ele abre
+outros, e o comando `limpar_uploads` remove os de todos os usuários.
+
+Na conclusão, os arquivos completos são normalizados e gravados no
+armazenamento por conteúdo em paralelo, num pool de UPLOAD_WORKERS threads
+que não acessa o banco. As fotos são então criadas com um único
+bulk_create, e o resultado de cada arquivo é retornado.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import FotoInstrumento, UploadFoto
+from . import imagens, midia
+from . import fotos as bloco_fotos
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LEITURA = 64 * 1024
+
+class UploadInvalido(ValueError):
+    pass
+
+class LimiteDeUploads(UploadInvalido):
+    """O usuário já tem uploads abertos demais"""
+
+class PosicaoIncorreta(UploadInvalido):
+    """O pedaço não começa no byte esperado; `recebido` diz de onde continuar"""
+    def __init__(self, recebido):
+        super().__init__(f'O próximo pedaço deve começar no byte {recebido}')
+        self.recebido = recebido
+
+def _arquivo_parcial(upload_id):
+    return Path(settings.UPLOAD_PARCIAL_DIR) / f'{upload_id}.part'
+
+def iniciar(instrumento, arquivos, usuario):
+    """
+    Abre um upload de `usuario` para cada {'nome', 'tamanho', 'descricao'}
+    de `arquivos`, desde que ele não passe de UPLOAD_SESSOES_POR_USUARIO
+    uploads abertos
+    """
+    uploads = []
+    for arquivo in arquivos:
+        try:
+            nome = os.path.basename(str(arquivo['nome']))[:255]
+            tamanho = int(arquivo['tamanho'])
+        except (KeyError, TypeError, ValueError):
+            raise UploadInvalido('Cada arquivo precisa de nome e tamanho')
+        if not nome or not 0 < tamanho <= settings.UPLOAD_TAMANHO_MAXIMO:
+            raise UploadInvalido(f'{nome or "Arquivo"}: tamanho deve estar entre 1 e {settings.UPLOAD_TAMANHO_MAXIMO} bytes')
+        uploads.append(UploadFoto(
+            instrumento=instrumento, nome=nome, tamanho=tamanho,
+            descricao=str(arquivo.get('descricao') or '')[:200], usuario=usuario,
+        ))
+
+    _remover(UploadFoto.objects.filter(usuario=usuario, atualizado_em__lt=_limite_abandono()))
+    abertos = UploadFoto.objects.filter(usuario=usuario, status=UploadFoto.RECEBENDO).count()
+    if abertos + len(uploads) > settings.UPLOAD_SESSOES_POR_USUARIO:
+        raise LimiteDeUploads(
+            f'Limite de {settings.UPLOAD_SESSOES_POR_USUARIO} uploads abertos por usuário; '
+            f'conclua os atuais antes de abrir outros'
+        )
+    Path(settings.UPLOAD_PARCIAL_DIR).mkdir(parents=True, exist_ok=True)
+    return UploadFoto.objects.bulk_create(uploads)
+
+def receber_pedaco(upload, inicio, corpo, tamanho_pedaco):
+    """
+    Grava `tamanho_pedaco` bytes lidos aos poucos de `corpo` (o request) a
+    partir de `inicio`. Retorna o upload com o novo `recebido`; se a leitura
+    terminar antes, avança só o que chegou.
+    """
+    if upload.status != UploadFoto.RECEBENDO:
+        raise UploadInvalido('O upload já foi concluído')
+    if inicio != upload.recebido:
+        raise PosicaoIncorreta(upload.recebido)
+    if tamanho_pedaco > settings.UPLOAD_PEDACO_MAXIMO or inicio + tamanho_pedaco > upload.tamanho:
+        raise UploadInvalido('Pedaço maior que o permitido ou além do fim do arquivo')
+
+    gravados = 0
+    fd = os.open(_arquivo_parcial(upload.pk), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        os.lseek(fd, inicio, os.SEEK_SET)
+        while gravados < tamanho_pedaco:
+            dados = corpo.read(min(TAMANHO_LEITURA, tamanho_pedaco - gravados))
+            if not dados:
+                break
+            os.write(fd, dados)
+            gravados += len(dados)
+    finally:
+        os.close(fd)
+
+    # Condicional: com dois envios do mesmo pedaço ao mesmo tempo, só um avança
+    avancou = UploadFoto.objects.filter(pk=upload.pk, recebido=inicio, status=UploadFoto.RECEBENDO).update(
+        recebido=inicio + gravados, atualizado_em=timezone.now()
+    )
+    upload.refresh_from_db(fields=['recebido', 'status', 'atualizado_em'])
+    if not avancou and upload.recebido != inicio + gravados:
+        raise PosicaoIncorreta(upload.recebido)
+    return upload
+
+def _processar(upload):
+    """Normaliza e grava a foto de um upload completo (roda no pool, sem banco)"""
+    campo = FotoInstrumento._meta.get_field('imagem')
+    with open(_arquivo_parcial(upload.pk), 'rb') as parcial:
+        normalizada = imagens.normalizar_upload(File(parcial, name=upload.nome))
+    return campo.storage.save(campo.generate_filename(None, normalizada.name), normalizada)
+
+def concluir(instrumento, ids, usuario):
+    """
+    Conclui os uploads `ids` do instrumento abertos por `usuario`. Retorna, na ordem pedida, o
+    as_dict de cada upload: 'concluido' com `foto_id`, 'falhou' com `erro`
+    ou 'recebendo' quando ainda faltam bytes.
+    """
+    uploads = {str(upload.pk): upload for upload in instrumento.uploads_fotos.filter(pk__in=ids, usuario=usuario)}
+    ordenados = [uploads[str(id_)] for id_ in ids if str(id_) in uploads]
+    prontos = [upload for upload in ordenados if upload.status == UploadFoto.RECEBENDO and upload.completo]
+
+    gravados, falhas = {}, {}
+    if prontos:
+        with ThreadPoolExecutor(max_workers=min(settings.UPLOAD_WORKERS, len(prontos)), thread_name_prefix='uploads') as pool:
+            futuros = {upload.pk: pool.submit(_processar, upload) for upload in prontos}
+            for pk, futuro in futuros.items():
+                try:
+                    gravados[pk] = futuro.result()
+                except Exception as e:
+                    logger.warning(f"Upload {pk} não pôde ser processado: {e}")
+                    falhas[pk] = 'Arquivo não é uma imagem válida' if isinstance(e, OSError) else str(e)
+
+    agora = timezone.now()
+    with transaction.atomic():
+        ordem = (instrumento.fotos.aggregate(ordem=Max('ordem'))['ordem'] or 0) + 1
+        concluidos = [upload for upload in prontos if upload.pk in gravados]
+        fotos = FotoInstrumento.objects.bulk_create([
+            FotoInstrumento(instrumento=instrumento, imagem=gravados[upload.pk], descricao=upload.descricao, ordem=ordem + i)
+            for i, upload in enumerate(concluidos)
+        ])
+        # bulk_create não dispara signals: referências e variantes são tratadas aqui
+        for foto in fotos:
+            midia.referenciar(foto.imagem.name)
+            transaction.on_commit(lambda pk=foto.pk: imagens.agendar(FotoInstrumento, pk))
+
+        for upload, foto in zip(concluidos, fotos):
+            upload.status, upload.foto, upload.atualizado_em = UploadFoto.CONCLUIDO, foto, agora
+        for upload in prontos:
+            if upload.pk in falhas:
+                upload.status, upload.erro, upload.atualizado_em = UploadFoto.FALHOU, falhas[upload.pk], agora
+        UploadFoto.objects.bulk_update(prontos, ['status', 'erro', 'foto', 'atualizado_em'])
+        transaction.on_commit(lambda: _remover_parciais(upload.pk for upload in prontos))
+        if fotos:
+            transaction.on_commit(lambda: bloco_fotos.invalidar(instrumento.pk))
+
+    return [upload.as_dict() for upload in ordenados]
+
+def _remover_parciais(pks):
+    for pk in pks:
+        _arquivo_parcial(pk).unlink(missing_ok=True)
+
+def _limite_abandono(horas=None):
+    return timezone.now() - timedelta(hours=settings.UPLOAD_ABANDONO_HORAS if horas is None else horas)
+
+def _remover(abandonados):
+    """Remove os uploads de `abandonados` e, após o commit, os seus arquivos parciais"""
+    pks = list(abandonados.values_list('pk', flat=True))
+    if pks:
+        UploadFoto.objects.filter(pk__in=pks).delete()
+        transaction.on_commit(lambda: _remover_parciais(pks))
+    return len(pks)
+
+def limpar_abandonados(horas=None):
+    """
+    Remove os uploads sem atividade há mais de `horas` (por padrão
+    UPLOAD_ABANDONO_HORAS) e os arquivos parciais igualmente antigos
+    (inclusive de instrumentos já excluídos). Retorna quantos uploads foram
+    removidos.
+    """
+    limite = _limite_abandono(horas)
+    removidos, _ = UploadFoto.objects.filter(atualizado_em__lt=limite).delete()
+    for parcial in Path(settings.UPLOAD_PARCIAL_DIR).glob('*.part'):
+        if parcial.stat().st_mtime < limite.timestamp():
+            parcial.unlink(missing_ok=True)
+    return removidos
@@ -53,11 +53,81 @@ urlpatterns = [
     path('instrumentos/<int:instrumento_pk>/fotos/nova/', FotoCreateView.as_view(), name='foto_create'),
     path('instrumentos/<int:instrumento_pk>/fotos/<int:pk>/excluir/', views.foto_delete, name='foto_delete'),
     path('instrumentos/<int:instrumento_pk>/fotos/<int:pk>/descricao/', views.foto_update_descricao, name='foto_update_descricao'),
+    path('instrumentos/<int:instrumento_pk>/fotos/uploads/', views.foto_upload_iniciar, name='foto_upload_iniciar'),
+    path('instrumentos/<int:instrumento_pk>/fotos/uploads/concluir/', views.foto_upload_concluir, name='foto_upload_concluir'),
 
     # API
     path('api/modelos-por-marca/<int:marca_id>/', views.modelos_por_marca, name='modelos_por_marca'),
+    path('api/subcategorias-por-categoria/<int:categoria_id>/', views.subcategorias_por_categoria, name='subcategorias_por_categoria'),
+    path('api/taxonomia/', views.taxonomia_api, name='taxonomia_api'),
     path('api/modelo/create/', views.modelo_create_ajax, name='modelo_create_ajax'),
+    path('api/search/', views.busca_api, name='busca_api'),
+    path('api/uploads/<uuid:pk>/', views.foto_upload, name='foto_upload'),
 
     # AI Populate
     path('ai-populate/', views.ai_populate_view, name='ai_populate'),
-]
\ No newline at end of file
+    path('ai-populate/<int:pk>/status/', views.ai_populate_status, name='ai_populate_status'),
+]
+
+# Consultas SQL permitidas por request em cada rota (orcamento.py), medidas
+# com os caches frios (dashboard, taxonomia, lookups) e usuário logado. Um
+# N+1 numa listagem passa disso e faz os testes falharem.
+ORCAMENTOS = {
+    # Home: estatísticas do dashboard
+    'home': 5,
+    'inicial': 6,
+
+    # Categorias
+    'categoria_list': 2,
+    'categoria_detail': 2,
+    'categoria_create': 0,
+    'categoria_update': 1,
+    'categoria_delete': 3,
+
+    # SubCategorias
+    'subcategoria_list': 3,
+    'subcategoria_detail': 2,
+    'subcategoria_create': 1,
+    'subcategoria_update': 2,
+    'subcategoria_delete': 4,
+
+    # Marcas (login: sessão e usuário)
+    'marca_list': 2,
+    'marca_create': 2,
+    'marca_update': 3,
+    'marca_delete': 3,
+
+    # Modelos: página e as três listas de filtro da taxonomia
+    'modelo_list': 5,
+    'modelo_detail': 2,
+    'modelo_create': 2,
+    'modelo_update': 3,
+    'modelo_delete': 4,
+
+    # Instrumentos: nos formulários, as quatro tabelas da taxonomia
+    'instrumento_list': 1,
+    'instrumento_create': 4,
+    'instrumento_detail': 2,
+    'instrumento_update': 8,
+    'instrumento_delete': 2,
+
+    # Fotos; uploads em pedaços com login (sessão e usuário), e a abertura
+    # confere os abandonados e os abertos do usuário
+    'foto_create': 7,
+    'foto_delete': 4,
+    'foto_update_descricao': 3,
+    'foto_upload_iniciar': 6,
+    'foto_upload_concluir': 7,
+
+    # API
+    'modelos_por_marca': 1,
+    'subcategorias_por_categoria': 1,
+    'taxonomia_api': 4,
+    'modelo_create_ajax': 5,
+    'busca_api': 1,
+    'foto_upload': 3,
+
+    # AI Populate
+    'ai_populate': 0,
+    'ai_populate_status': 1,
+}
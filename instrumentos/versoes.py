@@ -0,0 +1,51 @@
+"""
+Versão de cada tabela da taxonomia (categoria, subcategoria, marca e
+modelo), guardada no cache do Django.
+
+Toda gravação nessas tabelas, pelos signals ou por `bulk.upsert`,
+incrementa a versão da tabela depois do commit. Quem deriva dados delas
+(as ETags das APIs de lookup, o cache da taxonomia) compara versões em vez
+de consultar o banco. Se o cache for esvaziado, as versões recomeçam de um
+valor baseado no relógio, nunca de um valor já usado. Com vários processos,
+o cache precisa ser compartilhado (Redis, Memcached), como já é exigido
+pelo dashboard.
+"""
+import time
+from django.core.cache import cache
+
+TABELAS = ('categoria', 'subcategoria', 'marca', 'modelo')
+
+def _chave(tabela):
+    return f'instrumentos:versao:{tabela}'
+
+def _inicial():
+    return time.time_ns() // 1000
+
+def versoes(*tabelas):
+    """{tabela: versão} das tabelas pedidas (todas, se nenhuma), numa única leitura do cache"""
+    tabelas = tabelas or TABELAS
+    atuais = cache.get_many([_chave(tabela) for tabela in tabelas])
+    resultado = {}
+    for tabela in tabelas:
+        valor = atuais.get(_chave(tabela))
+        if valor is None:
+            cache.add(_chave(tabela), _inicial(), None)
+            valor = cache.get(_chave(tabela))
+        resultado[tabela] = valor
+    return resultado
+
+def versao(tabela):
+    return versoes(tabela)[tabela]
+
+def incrementar(*tabelas):
+    for tabela in tabelas:
+        try:
+            cache.incr(_chave(tabela))
+        except ValueError:
+            # Chave ausente (cache esvaziado): qualquer versão nova serve
+            cache.set(_chave(tabela), _inicial(), None)
+
+def etag(*tabelas, sufixo=''):
+    """Identificador do estado das tabelas, usado como ETag"""
+    partes = [f'{tabela}.{valor}' for tabela, valor in versoes(*tabelas).items()]
+    return '-'.join(partes + ([sufixo] if sufixo else []))
@@ -1,21 +1,31 @@
 import os
 from dotenv import load_dotenv
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import BadRequest, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import Count, Q, Sum, F, ExpressionWrapper, DecimalField
 from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from decimal import Decimal
-from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento
+from .models import Categoria, SubCategoria, Marca, Modelo, Instrumento, FotoInstrumento, GeracaoIA, UploadFoto
 from .forms import (
     CategoriaForm, SubCategoriaForm, MarcaForm, ModeloForm, 
-    InstrumentoCreateForm, FotoInstrumentoFormSet
+    InstrumentoCreateForm, FotoInstrumentoForm, FotoInstrumentoFormSet
 )
-from .ai_helpers import setup_openai, generate_data
+from .ai_populate import TABELAS, QUANTIDADE_MINIMA, QUANTIDADE_MAXIMA
+from .dashboard import get_estatisticas
+from .pagination import paginar, iterar_paginas, decodificar_cursor, CursorInvalido
+from . import search, jobs, uploads, fotos, versoes, taxonomia
 import json
 import random
 import logging
@@ -38,103 +48,41 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # Total de instrumentos
-        context['total_instrumentos'] = Instrumento.objects.count()
-
-        # Total de categorias com instrumentos
-        context['total_categorias'] = Categoria.objects.annotate(
-            total_instrumentos=Count('subcategorias__modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).count()
-
-        # Total de subcategorias com instrumentos
-        context['total_subcategorias'] = SubCategoria.objects.annotate(
-            total_instrumentos=Count('modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).count()
-
-        # Total de marcas com instrumentos
-        context['total_marcas'] = Marca.objects.annotate(
-            total_instrumentos=Count('modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).count()
-
-        # Estatísticas detalhadas
-        context['categorias'] = Categoria.objects.annotate(
-            total_instrumentos=Count('subcategorias__modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).order_by('-total_instrumentos')
-
-        context['subcategorias'] = SubCategoria.objects.annotate(
-            total_instrumentos=Count('modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).order_by('-total_instrumentos')
-
-        context['marcas'] = Marca.objects.annotate(
-            total_instrumentos=Count('modelos__instrumento', distinct=True)
-        ).filter(total_instrumentos__gt=0).order_by('-total_instrumentos')
-
-        # Totais de valores
-        total_aquisicao = Instrumento.objects.aggregate(
-            total=Coalesce(
-                Sum(
-                    ExpressionWrapper(
-                        F('preco'),
-                        output_field=DecimalField(max_digits=10, decimal_places=2)
-                    )
-                ),
-                Decimal('0')
-            )
-        )['total']
-        
-        total_mercado = Instrumento.objects.aggregate(
-            total=Coalesce(
-                Sum(
-                    ExpressionWrapper(
-                        F('valor_mercado'),
-                        output_field=DecimalField(max_digits=10, decimal_places=2)
-                    )
-                ),
-                Decimal('0')
-            )
-        )['total']
-        
-        diferenca_total = total_mercado - total_aquisicao
-        
-        if total_aquisicao > 0:
-            percentual_valorizacao = (diferenca_total / total_aquisicao) * Decimal('100')
-        else:
-            percentual_valorizacao = Decimal('0')
+        estatisticas = get_estatisticas()
 
         context.update({
-            'total_aquisicao': total_aquisicao,
-            'total_mercado': total_mercado,
-            'diferenca_total': diferenca_total,
-            'percentual_valorizacao': percentual_valorizacao,
+            'total_instrumentos': estatisticas['total_instrumentos'],
+            'total_categorias': estatisticas['total_categorias'],
+            'total_subcategorias': estatisticas['total_subcategorias'],
+            'total_marcas': estatisticas['total_marcas'],
+            'categorias': estatisticas['categorias'],
+            'subcategorias': estatisticas['subcategorias'],
+            'marcas': estatisticas['marcas'],
+            'marcas_populares': estatisticas['marcas'][:5],
+            'total_aquisicao': estatisticas['total_aquisicao'],
+            'total_mercado': estatisticas['total_mercado'],
+            'diferenca_total': estatisticas['diferenca_total'],
+            'percentual_valorizacao': estatisticas['percentual_valorizacao'],
         })
         return context
 
 def index(request):
     """View para a página inicial"""
-    # Calcular valores financeiros
-    instrumentos = Instrumento.objects.all()
-    preco = instrumentos.aggregate(
-        total=Coalesce(Sum('preco'), Decimal('0'))
-    )['total']
-    
-    valor_mercado = instrumentos.aggregate(
-        total=Coalesce(Sum('valor_mercado'), Decimal('0'))
-    )['total']
-    
-    diferenca = valor_mercado - preco
-    valorizacao = (diferenca / preco * 100) if preco > 0 else 0
+    estatisticas = get_estatisticas()
+    cadastros = estatisticas['cadastros']
 
     return render(request, 'instrumentos/index.html', {
-        'total_instrumentos': instrumentos.count(),
-        'total_marcas': Marca.objects.count(),
-        'total_categorias': Categoria.objects.count(),
-        'total_subcategorias': SubCategoria.objects.count(),
-        'preco': preco,
-        'valor_mercado': valor_mercado,
-        'diferenca': diferenca,
-        'valorizacao': valorizacao,
-        'instrumentos_recentes': instrumentos.order_by('-data_cadastro')[:5]
+        'total_instrumentos': estatisticas['total_instrumentos'],
+        'total_marcas': cadastros['marcas'],
+        'total_categorias': cadastros['categorias'],
+        'total_subcategorias': cadastros['subcategorias'],
+        'preco': estatisticas['total_aquisicao'],
+        'valor_mercado': estatisticas['total_mercado'],
+        'diferenca': estatisticas['diferenca_total'],
+        'valorizacao': estatisticas['percentual_valorizacao'],
+        'instrumentos_recentes': Instrumento.objects.select_related(
+            'modelo__marca'
+        ).order_by('-created_at')[:5]
     })
 
 class CategoriaListView(ListView):
@@ -150,7 +98,12 @@ class CategoriaListView(ListView):
         # Filtro por texto (nome ou descrição)
         q = self.request.GET.get('q')
         if q:
-            queryset = queryset.filter(nome__icontains=q) | queryset.filter(descricao__icontains=q)
+            queryset = search.filtrar(queryset, q)
+        
+        # Filtro pelo começo do nome, sem acentos (busca no índice de nome_normalizado)
+        nome = self.request.GET.get('nome')
+        if nome:
+            queryset = search.filtrar_nome(queryset, nome)
         
         return queryset.order_by('nome')
 
@@ -190,8 +143,8 @@ class CategoriaDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Ordenar subcategorias por nome
-        context['subcategorias'] = self.object.subcategorias.order_by('nome')
+        # Ordenar subcategorias por nome, com o total de modelos de cada uma
+        context['subcategorias'] = self.object.subcategorias.annotate(total_modelos=Count('modelos')).order_by('nome')
         return context
 
 class SubCategoriaListView(ListView):
@@ -207,11 +160,12 @@ class SubCategoriaListView(ListView):
         # Filtro por texto (nome ou descrição)
         q = self.request.GET.get('q')
         if q:
-            queryset = queryset.filter(
-                Q(nome__icontains=q) | 
-                Q(descricao__icontains=q) |
-                Q(categoria__nome__icontains=q)
-            )
+            queryset = search.filtrar(queryset, q)
+        
+        # Filtro pelo começo do nome, sem acentos (busca no índice de nome_normalizado)
+        nome = self.request.GET.get('nome')
+        if nome:
+            queryset = search.filtrar_nome(queryset, nome)
         
         # Filtro por categoria
         categoria_id = self.request.GET.get('categoria')
@@ -222,7 +176,7 @@ class SubCategoriaListView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categorias'] = Categoria.objects.order_by('nome')
+        context['categorias'] = taxonomia.categorias()
         return context
 
 class SubCategoriaCreateView(CreateView):
@@ -259,6 +213,9 @@ class SubCategoriaDetailView(DetailView):
     template_name = 'instrumentos/subcategoria_detail.html'
     context_object_name = 'subcategoria'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('categoria')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Ordenar modelos por nome
@@ -276,11 +233,11 @@ class MarcaListView(ListView):
         queryset = super().get_queryset()
         q = self.request.GET.get('q')
         if q:
-            return queryset.filter(
-                Q(nome__icontains=q) |
-                Q(descricao__icontains=q) |
-                Q(pais_origem__icontains=q)
-            )
+            queryset = search.filtrar(queryset, q)
+        # Filtro pelo começo do nome, sem acentos (busca no índice de nome_normalizado)
+        nome = self.request.GET.get('nome')
+        if nome:
+            queryset = search.filtrar_nome(queryset, nome)
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -299,48 +256,23 @@ class MarcaCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 class MarcaUpdateView(LoginRequiredMixin, UpdateView):
+    # O logotipo substituído não é apagado aqui: o arquivo pode estar em uso por
+    # outra marca e é removido pelo comando `coletar_midia` quando ficar sem referências
     model = Marca
     form_class = MarcaForm
     template_name = 'instrumentos/marca_form.html'
     success_url = reverse_lazy('marca_list')
-    
-    def form_valid(self, form):
-        # Se temos um novo logotipo e já existe um antigo
-        if form.cleaned_data.get('logotipo') and self.object.logotipo:
-            try:
-                # Guardar o caminho do arquivo antigo
-                old_logo_path = self.object.logotipo.path
-                
-                # Salvar o novo logotipo
-                response = super().form_valid(form)
-                
-                try:
-                    # Tentar deletar o arquivo antigo
-                    if os.path.exists(old_logo_path):
-                        os.remove(old_logo_path)
-                except (OSError, PermissionError) as e:
-                    # Se não conseguir deletar agora, logar o erro mas não falhar
-                    logger.warning(f"Não foi possível deletar o logotipo antigo: {str(e)}")
-                
-                return response
-            except Exception as e:
-                messages.error(self.request, f"Erro ao atualizar logotipo: {str(e)}")
-                return super().form_invalid(form)
-        
-        return super().form_valid(form)
 
 class MarcaDeleteView(LoginRequiredMixin, DeleteView):
     model = Marca
     template_name = 'instrumentos/marca_confirm_delete.html'
     success_url = reverse_lazy('marca_list')
     
-    def delete(self, request, *args, **kwargs):
-        marca = self.get_object()
-        # Deletar logotipo se existir
-        if marca.logotipo:
-            marca.logotipo.delete(save=False)
-        messages.success(request, 'Marca excluída com sucesso!')
-        return super().delete(request, *args, **kwargs)
+    def form_valid(self, form):
+        # O logotipo pode ser compartilhado (armazenamento por conteúdo): a
+        # referência é liberada pelo post_delete e o arquivo fica para `coletar_midia`
+        messages.success(self.request, 'Marca excluída com sucesso!')
+        return super().form_valid(form)
 
 class ModeloListView(ListView):
     model = Modelo
@@ -350,12 +282,18 @@ class ModeloListView(ListView):
     ordering = ['marca__nome', 'nome']
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Os cards e o __str__ usam a marca; a subcategoria e a categoria vêm no mesmo JOIN
+        queryset = super().get_queryset().select_related('marca', 'subcategoria__categoria')
         
-        # Filtro por texto (nome do modelo)
+        # Filtro por texto (nome ou descrição do modelo)
         q = self.request.GET.get('q')
         if q:
-            queryset = queryset.filter(nome__icontains=q)
+            queryset = search.filtrar(queryset, q)
+        
+        # Filtro pelo começo do nome, sem acentos (busca no índice de nome_normalizado)
+        nome = self.request.GET.get('nome')
+        if nome:
+            queryset = search.filtrar_nome(queryset, nome)
         
         # Filtro por marca
         marca = self.request.GET.get('marca')
@@ -377,10 +315,10 @@ class ModeloListView(ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Adicionar listas para os filtros
-        context['marcas'] = Marca.objects.all().order_by('nome')
-        context['categorias'] = Categoria.objects.all().order_by('nome')
-        context['subcategorias'] = SubCategoria.objects.all().order_by('categoria__nome', 'nome')
+        # Listas para os filtros, da taxonomia em memória (sem consultas por request)
+        context['marcas'] = taxonomia.marcas()
+        context['categorias'] = taxonomia.categorias()
+        context['subcategorias'] = taxonomia.subcategorias()
         
         # Manter filtros selecionados
         context['selected_marca'] = self.request.GET.get('marca')
@@ -424,11 +362,14 @@ class ModeloDetailView(DetailView):
     template_name = 'instrumentos/modelo_detail.html'
     context_object_name = 'modelo'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('marca', 'subcategoria__categoria')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Ordenar instrumentos por número de série e incluir fotos
-        context['instrumentos'] = self.object.instrumento_set.prefetch_related(
-            'fotoinstrumento_set'
+        # Ordenar instrumentos por número de série, com o total de fotos de cada um
+        context['instrumentos'] = self.object.instrumento_set.annotate(
+            total_fotos=Count('fotos')
         ).order_by('numero_serie')
         return context
 
@@ -437,28 +378,135 @@ class InstrumentoDetailView(DetailView):
     template_name = 'instrumentos/instrumento_detail.html'
     context_object_name = 'instrumento'
 
+    def get_queryset(self):
+        # Toda a classificação usada pelo template vem na mesma consulta
+        return super().get_queryset().select_related('modelo__marca', 'modelo__subcategoria__categoria')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        instrumento = self.get_object()
+        modelo = self.object.modelo
         context['modelo_info'] = {
-            'marca': instrumento.modelo.marca.nome,
-            'subcategoria': instrumento.modelo.subcategoria.nome,
-            'categoria': instrumento.modelo.subcategoria.categoria.nome
-        }
+            'marca': modelo.marca.nome,
+            'subcategoria': modelo.subcategoria.nome,
+            'categoria': modelo.subcategoria.categoria.nome
+        } if modelo else {}
+        context['fotos_html'] = fotos.bloco_de_fotos(self.object)
         return context
 
 class InstrumentoListView(ListView):
     model = Instrumento
     template_name = 'instrumentos/instrumento_list.html'
     context_object_name = 'instrumentos'
+    paginate_by = 20
+    json_chunk_size = 500
+    json_max_itens = 5000
+
+    # Parâmetro GET -> (campo filtrado, conversão do valor). Um valor que não
+    # converte é um pedido inválido (400), assim como um cursor inválido.
+    filtros = {
+        'status': ('status', str),
+        'estado': ('estado', str),
+        'marca': ('marca_id', int),
+        'modelo': ('modelo_id', int),
+        'categoria': ('categoria_id', int),
+    }
+
+    # Campos do formato JSON -> campo consultado
+    campos_json = {
+        'id': 'id',
+        'nome': 'nome',
+        'numero_serie': 'numero_serie',
+        'marca': 'modelo__marca__nome',
+        'modelo': 'modelo__nome',
+        'categoria': 'modelo__subcategoria__categoria__nome',
+        'subcategoria': 'modelo__subcategoria__nome',
+        'preco': 'preco',
+        'valor_venda': 'valor_venda',
+        'estado': 'estado',
+        'status': 'status',
+        'created_at': 'created_at',
+    }
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'json':
+            try:
+                return self.render_to_json_response()
+            except BadRequest as e:
+                return JsonResponse({'error': str(e)}, status=400)
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
         queryset = super().get_queryset()
+
+        q = self.request.GET.get('q')
+        if q:
+            queryset = search.filtrar(queryset, q)
+
+        for parametro, (campo, converter) in self.filtros.items():
+            valor = self.request.GET.get(parametro)
+            if valor:
+                try:
+                    valor = converter(valor)
+                except ValueError:
+                    raise BadRequest(f'Filtro "{parametro}" inválido')
+                queryset = queryset.filter(**{campo: valor})
+
         return queryset.select_related(
             'modelo__marca',
             'modelo__subcategoria__categoria'
         )
 
+    def paginate_queryset(self, queryset, page_size):
+        """Paginação por cursor em vez de OFFSET (ver instrumentos.pagination)"""
+        try:
+            pagina = paginar(queryset, self.request.GET.get('cursor'), page_size)
+        except CursorInvalido:
+            raise BadRequest('Cursor inválido')
+        return (None, pagina, pagina.object_list, pagina.has_other_pages)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Querystring dos filtros, para os links de paginação
+        filtros = self.request.GET.copy()
+        filtros.pop('cursor', None)
+        context['filtros_querystring'] = filtros.urlencode()
+        return context
+
+    def render_to_json_response(self):
+        """
+        Transmite os instrumentos em JSON, página a página, a partir do cursor.
+        A resposta termina com o cursor da próxima página em "next".
+        """
+        cursor = self.request.GET.get('cursor')
+        if cursor:
+            try:
+                decodificar_cursor(cursor)
+            except CursorInvalido:
+                raise BadRequest('Cursor inválido')
+        try:
+            limite = int(self.request.GET.get('limite', self.paginate_by))
+        except ValueError:
+            raise BadRequest('Limite inválido')
+        limite = max(1, min(limite, self.json_max_itens))
+
+        queryset = self.get_queryset().values(*self.campos_json.values())
+        return StreamingHttpResponse(
+            self._gerar_json(queryset, cursor, limite),
+            content_type='application/json'
+        )
+
+    def _gerar_json(self, queryset, cursor, limite):
+        yield '{"results": ['
+        primeiro = True
+        proximo = None
+        for pagina in iterar_paginas(queryset, cursor, self.json_chunk_size, limite):
+            for item in pagina:
+                dados = {chave: item[campo] for chave, campo in self.campos_json.items()}
+                yield ('' if primeiro else ', ') + json.dumps(dados, cls=DjangoJSONEncoder)
+                primeiro = False
+            proximo = pagina.next_cursor
+        yield '], "next": ' + json.dumps(proximo) + '}'
+
 class InstrumentoCreateView(LoginRequiredMixin, CreateView):
     model = Instrumento
     form_class = InstrumentoCreateForm
@@ -547,7 +595,7 @@ def foto_update_descricao(request, instrumento_pk, pk):
 
 class FotoCreateView(CreateView):
     model = FotoInstrumento
-    fields = ['imagem', 'descricao']
+    form_class = FotoInstrumentoForm
     template_name = 'instrumentos/foto_form.html'
 
     def form_valid(self, form):
@@ -564,22 +612,167 @@ class FotoCreateView(CreateView):
     def get_success_url(self):
         return reverse_lazy('instrumento_detail', kwargs={'pk': self.kwargs['instrumento_pk']})
 
+def _json_do_corpo(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+@login_required
+def foto_upload_iniciar(request, instrumento_pk):
+    """
+    Abre um upload em pedaços para cada arquivo de {"arquivos": [{"nome",
+    "tamanho", "descricao"}]} e retorna os ids e as URLs de envio
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    instrumento = get_object_or_404(Instrumento, pk=instrumento_pk)
+    dados = _json_do_corpo(request)
+    if not isinstance(dados, dict) or not isinstance(dados.get('arquivos'), list) or not dados['arquivos']:
+        return JsonResponse({'error': 'Informe a lista de arquivos'}, status=400)
+    try:
+        criados = uploads.iniciar(instrumento, dados['arquivos'], request.user)
+    except uploads.LimiteDeUploads as e:
+        return JsonResponse({'error': str(e)}, status=429)
+    except uploads.UploadInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'uploads': [
+            {**upload.as_dict(), 'url': reverse('foto_upload', args=[upload.pk])} for upload in criados
+        ],
+        'concluir_url': reverse('foto_upload_concluir', args=[instrumento.pk]),
+        'pedaco_maximo': settings.UPLOAD_PEDACO_MAXIMO,
+    }, status=201)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+@login_required
+def foto_upload(request, pk):
+    """
+    GET: situação do upload (de onde retomar). PUT: um pedaço do arquivo, com
+    o cabeçalho `Content-Range: bytes início-fim/total`. Um pedaço fora de
+    posição retorna 409 com o `recebido` atual. Uploads de outros usuários
+    não são encontrados.
+    """
+    upload = get_object_or_404(UploadFoto, pk=pk, usuario=request.user)
+    if request.method == 'GET':
+        return JsonResponse(upload.as_dict())
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+
+    intervalo = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+    if not intervalo:
+        return JsonResponse({'error': 'Cabeçalho Content-Range ausente ou inválido'}, status=400)
+    inicio, fim, total = (int(valor) for valor in intervalo.groups())
+    if total != upload.tamanho or fim < inicio:
+        return JsonResponse({'error': 'Content-Range não corresponde ao upload'}, status=400)
+    try:
+        upload = uploads.receber_pedaco(upload, inicio, request, fim - inicio + 1)
+    except uploads.PosicaoIncorreta as e:
+        return JsonResponse({**upload.as_dict(), 'recebido': e.recebido, 'error': str(e)}, status=409)
+    except uploads.UploadInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(upload.as_dict())
+
+@login_required
+def foto_upload_concluir(request, instrumento_pk):
+    """Cria as fotos dos uploads {"ids": [...]} completos e retorna a situação de cada um"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    instrumento = get_object_or_404(Instrumento, pk=instrumento_pk)
+    dados = _json_do_corpo(request)
+    if not isinstance(dados, dict) or not isinstance(dados.get('ids'), list):
+        return JsonResponse({'error': 'Informe a lista de ids'}, status=400)
+    try:
+        arquivos = uploads.concluir(instrumento, [str(id_) for id_ in dados['ids']], request.user)
+    except ValidationError:
+        return JsonResponse({'error': 'Id de upload inválido'}, status=400)
+    return JsonResponse({'arquivos': arquivos})
+
+# APIs de lookup dos selects em cascata. A ETag vem das versões das tabelas
+# (instrumentos.versoes): um If-None-Match atual recebe 304 sem consultar o
+# banco, e o corpo de cada versão fica no cache até a tabela mudar.
+
+def _lookup(etag, gerar):
+    chave = f'instrumentos:lookup:{etag}'
+    dados = cache.get(chave)
+    if dados is None:
+        dados = gerar()
+        cache.set(chave, dados, settings.LOOKUP_CACHE_TIMEOUT)
+    resposta = JsonResponse(dados, safe=False)
+    patch_cache_control(resposta, private=True, max_age=settings.LOOKUP_MAX_AGE, must_revalidate=True)
+    return resposta
+
+def _etag_subcategorias(request, categoria_id):
+    return versoes.etag('subcategoria', sufixo=f'c{categoria_id}')
+
+def _etag_modelos(request, marca_id):
+    return versoes.etag('modelo', sufixo=f'm{marca_id}')
+
+def _etag_taxonomia(request):
+    return versoes.etag()
+
+@condition(etag_func=_etag_subcategorias)
+def subcategorias_por_categoria(request, categoria_id):
+    """API para retornar as subcategorias de uma categoria"""
+    return _lookup(_etag_subcategorias(request, categoria_id), lambda: list(
+        SubCategoria.objects.filter(categoria_id=categoria_id).order_by('nome').values('id', 'nome')
+    ))
+
+@condition(etag_func=_etag_modelos)
 def modelos_por_marca(request, marca_id):
     """API para retornar modelos de uma marca específica"""
-    modelos = Modelo.objects.filter(marca_id=marca_id).values('id', 'nome')
-    return JsonResponse(list(modelos), safe=False)
+    return _lookup(_etag_modelos(request, marca_id), lambda: list(
+        Modelo.objects.filter(marca_id=marca_id).order_by('nome').values('id', 'nome')
+    ))
+
+@condition(etag_func=_etag_taxonomia)
+def taxonomia_api(request):
+    """Toda a taxonomia de uma vez, para o formulário filtrar os selects sem novas requisições"""
+    return _lookup(_etag_taxonomia(request), lambda: {
+        'categorias': list(Categoria.objects.order_by('nome').values('id', 'nome')),
+        'subcategorias': list(SubCategoria.objects.order_by('nome').values('id', 'nome', 'categoria_id')),
+        'marcas': list(Marca.objects.order_by('nome').values('id', 'nome')),
+        'modelos': list(Modelo.objects.order_by('nome').values('id', 'nome', 'marca_id', 'subcategoria_id')),
+    })
+
+def busca_api(request):
+    """
+    API de busca textual em todo o catálogo, ordenada por relevância.
+    Parâmetros: q (texto, com prefixo em cada palavra), tipo (pode repetir) e limite.
+    """
+    q = request.GET.get('q', '')
+    tipos = request.GET.getlist('tipo') or None
+    try:
+        limite = max(1, min(int(request.GET.get('limite', 20)), 100))
+    except ValueError:
+        return JsonResponse({'error': 'Limite inválido'}, status=400)
+
+    urls = {
+        'categoria': lambda item: reverse('categoria_detail', args=[item['id']]),
+        'subcategoria': lambda item: reverse('subcategoria_detail', args=[item['id']]),
+        'marca': lambda item: reverse('marca_update', args=[item['id']]),
+        'modelo': lambda item: reverse('modelo_detail', args=[item['id']]),
+        'instrumento': lambda item: reverse('instrumento_detail', args=[item['id']]),
+    }
+    resultados = search.buscar(q, tipos=tipos, limite=limite)
+    for item in resultados:
+        item['url'] = urls[item['tipo']](item)
+    return JsonResponse({'q': q, 'results': resultados})
 
 def modelo_create_ajax(request):
     if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         try:
             nome = request.POST.get('nome')
             marca_id = request.POST.get('marca')
-            descricao = request.POST.get('descricao')
+            descricao = request.POST.get('descricao') or ''
 
             marca = get_object_or_404(Marca, pk=marca_id)
+            subcategoria = get_object_or_404(SubCategoria, pk=request.POST.get('subcategoria'))
             modelo = Modelo.objects.create(
                 nome=nome,
                 marca=marca,
+                subcategoria=subcategoria,
                 descricao=descricao
             )
 
@@ -598,384 +791,54 @@ def modelo_create_ajax(request):
         'error': 'Método não permitido'
     })
 
-def generate_data(prompt, quantidade=10):
+def ai_populate_view(request):
     """
-    Gera dados usando a OpenAI API
+    Enfileira uma geração com IA e volta imediatamente; o comando
+    `processar_geracoes` executa a geração e a página acompanha o progresso
+    pelo endpoint de status.
     """
-    try:
-        # Configurar cliente OpenAI
-        from openai import OpenAI
-        client = OpenAI()
-        
-        # Fazer a chamada para a API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Você é um assistente especializado em gerar dados para um sistema de cadastro de instrumentos musicais. Gere apenas o JSON solicitado, sem explicações adicionais."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
+    if request.method == 'POST':
+        tables = [tabela for tabela in request.POST.getlist('tables') if tabela in TABELAS]
+        try:
+            quantidade = int(request.POST.get('quantidade', 10))
+        except (TypeError, ValueError):
+            quantidade = None
         
-        # Extrair o JSON da resposta
-        json_response = response.choices[0].message.content.strip()
+        if not tables:
+            messages.error(request, 'Selecione pelo menos um tipo de dado para gerar.')
+            return redirect('ai_populate')
         
-        # Se a resposta não começa com [, tentar encontrar o JSON
-        if not json_response.startswith('['):
-            # Procurar por [ e ]
-            start = json_response.find('[')
-            end = json_response.rfind(']')
-            
-            if start != -1 and end != -1:
-                json_response = json_response[start:end+1]
-            else:
-                raise ValueError("Resposta não contém JSON válido")
+        if quantidade is None or not QUANTIDADE_MINIMA <= quantidade <= QUANTIDADE_MAXIMA:
+            erro = f'A quantidade por tipo deve ser um número entre {QUANTIDADE_MINIMA} e {QUANTIDADE_MAXIMA}.'
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'error': erro}, status=400)
+            messages.error(request, erro)
+            return render(request, 'instrumentos/ai_populate.html', {
+                'geracao': None,
+                'results': {},
+                'tabelas_selecionadas': tables,
+                'quantidade': request.POST.get('quantidade', ''),
+                'quantidade_invalida': True,
+            }, status=400)
         
-        return json_response
+        geracao = jobs.enfileirar(tables, quantidade, ignorar_cache=bool(request.POST.get('ignorar_cache')))
+        status_url = reverse('ai_populate_status', args=[geracao.pk])
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'id': geracao.pk, 'status_url': status_url}, status=202)
         
-    except Exception as e:
-        logger.error(f"Erro ao gerar dados via OpenAI: {str(e)}")
-        raise
-
-def ai_populate_view(request):
-    results = {}
+        messages.info(request, f'Geração {geracao.pk} enfileirada. O progresso é atualizado automaticamente.')
+        return redirect(f"{reverse('ai_populate')}?geracao={geracao.pk}")
     
-    if request.method == 'POST':
-        try:
-            # Configurar OpenAI
-            setup_openai()
-            
-            # Obter parâmetros
-            tables = request.POST.getlist('tables')
-            quantidade = int(request.POST.get('quantidade', 10))
-            
-            # Gerar Categorias
-            if 'categorias' in tables:
-                prompt = """
-                Gere dados para categorias de instrumentos musicais no formato JSON.
-                Use APENAS categorias reais e comuns em lojas de música.
-                Cada categoria deve ter:
-                - nome: Nome único da categoria (ex: Cordas, Sopro, Percussão)
-                - descricao: Descrição técnica e precisa da categoria
-                
-                Exemplo:
-                [
-                    {
-                        "nome": "Cordas",
-                        "descricao": "Instrumentos que produzem som através da vibração de cordas, incluindo cordas dedilhadas, friccionadas ou percutidas"
-                    }
-                ]
-                """
-                
-                categorias_json = generate_data(prompt, quantidade=quantidade)
-                try:
-                    categorias_data = json.loads(categorias_json)
-                    
-                    created = 0
-                    updated = 0
-                    for cat_data in categorias_data:
-                        cat, is_new = Categoria.objects.get_or_create(
-                            nome=cat_data['nome']
-                        )
-                        cat.descricao = cat_data['descricao']
-                        cat.save()
-                        
-                        if is_new:
-                            created += 1
-                        else:
-                            updated += 1
-                    
-                    results['categorias'] = {
-                        'created': created, 
-                        'updated': updated,
-                        'total_received': len(categorias_data)
-                    }
-                except json.JSONDecodeError as e:
-                    results['categorias'] = {'error': str(e)}
-            
-            # Gerar Subcategorias
-            if 'subcategorias' in tables:
-                created = 0
-                updated = 0
-                for categoria in Categoria.objects.all():
-                    prompt = f"""
-                    Gere dados para subcategorias da categoria '{categoria.nome}' no formato JSON.
-                    Use APENAS subcategorias que realmente pertencem a esta categoria principal.
-                    Cada subcategoria deve ter:
-                    - nome: Nome específico da subcategoria
-                    - descricao: Descrição técnica e detalhada
-                    
-                    Para a categoria '{categoria.nome}', gere subcategorias específicas e coerentes.
-                    Por exemplo, para "Cordas":
-                    [
-                        {{
-                            "nome": "Violões",
-                            "descricao": "Instrumentos de cordas dedilhadas com caixa acústica, incluindo violões clássicos e folk"
-                        }}
-                    ]
-                    """
-                    
-                    subcategorias_json = generate_data(prompt, quantidade=quantidade)
-                    try:
-                        subcategorias_data = json.loads(subcategorias_json)
-                        
-                        for subcat_data in subcategorias_data:
-                            subcat, is_new = SubCategoria.objects.get_or_create(
-                                nome=subcat_data['nome'],
-                                categoria=categoria
-                            )
-                            subcat.descricao = subcat_data['descricao']
-                            subcat.save()
-                            
-                            if is_new:
-                                created += 1
-                            else:
-                                updated += 1
-                    except json.JSONDecodeError as e:
-                        results['subcategorias'] = {'error': str(e)}
-                        break
-                
-                if 'subcategorias' not in results:
-                    results['subcategorias'] = {
-                        'created': created, 
-                        'updated': updated
-                    }
-            
-            # Gerar Marcas
-            if 'marcas' in tables:
-                prompt = """
-                Gere dados para marcas de instrumentos musicais no formato JSON.
-                Inclua tanto marcas mundialmente famosas quanto marcas de médio porte.
-                NÃO REPITA marcas já mencionadas.
-                
-                Cada marca deve ter:
-                - nome: Nome oficial da marca
-                - site: Site oficial da marca (URL completa e válida)
-                - descricao: História detalhada da marca, incluindo ano de fundação e principais produtos
-                - pais_origem: País onde a marca foi fundada
-                
-                Exemplos de marcas possíveis: Fender, Gibson, Yamaha, Ibanez, Roland, Korg, Pearl, Zildjian, Selmer, Buffet Crampon, etc.
-                """
-                
-                marcas_json = generate_data(prompt, quantidade=quantidade)
-                try:
-                    marcas_data = json.loads(marcas_json)
-                    
-                    created = 0
-                    updated = 0
-                    marcas_processadas = set()
-                    
-                    for marca_data in marcas_data:
-                        # Pular se já processamos esta marca
-                        if marca_data['nome'] in marcas_processadas:
-                            continue
-                            
-                        marca, is_new = Marca.objects.get_or_create(
-                            nome=marca_data['nome']
-                        )
-                        marca.site = marca_data['site']
-                        marca.descricao = marca_data['descricao']
-                        marca.pais_origem = marca_data['pais_origem']
-                        marca.save()
-                        
-                        marcas_processadas.add(marca_data['nome'])
-                        
-                        if is_new:
-                            created += 1
-                        else:
-                            updated += 1
-                    
-                    results['marcas'] = {
-                        'created': created, 
-                        'updated': updated,
-                        'total_received': len(marcas_data),
-                        'unique_processed': len(marcas_processadas)
-                    }
-                except json.JSONDecodeError as e:
-                    results['marcas'] = {'error': str(e)}
-            
-            # Gerar Modelos
-            if 'modelos' in tables:
-                if not SubCategoria.objects.exists():
-                    messages.error(request, 'Não existem subcategorias. Por favor, gere subcategorias primeiro.')
-                    results['modelos'] = {'error': 'Não existem subcategorias'}
-                else:
-                    created = 0
-                    updated = 0
-                    
-                    for marca in Marca.objects.all():
-                        # Para cada marca, vamos gerar modelos apenas para subcategorias apropriadas
-                        for subcategoria in SubCategoria.objects.all():
-                            prompt = f"""
-                            Gere dados para modelos da marca '{marca.nome}' na subcategoria '{subcategoria.nome}' no formato JSON.
-                            IMPORTANTE: Gere APENAS se a marca realmente produz instrumentos desta subcategoria.
-                            Se a marca não produz instrumentos desta subcategoria, retorne array vazio [].
-                            
-                            Cada modelo deve ter:
-                            - nome: Nome oficial e completo do modelo
-                            - descricao: Descrição detalhada incluindo características técnicas
-                            
-                            Exemplo para Fender na subcategoria Guitarras Elétricas:
-                            [
-                                {{
-                                    "nome": "Stratocaster American Professional II",
-                                    "descricao": "Guitarra elétrica de corpo sólido com 3 captadores single-coil V-Mod II, ponte tremolo, braço em maple e corpo em alder."
-                                }}
-                            ]
-                            """
-                            
-                            modelos_json = generate_data(prompt, quantidade=quantidade)
-                            try:
-                                modelos_data = json.loads(modelos_json)
-                                
-                                if modelos_data:  # Se a lista não estiver vazia
-                                    for modelo_data in modelos_data:
-                                        modelo, is_new = Modelo.objects.get_or_create(
-                                            nome=modelo_data['nome'],
-                                            marca=marca,
-                                            defaults={
-                                                'descricao': modelo_data['descricao'],
-                                                'subcategoria': subcategoria
-                                            }
-                                        )
-                                        
-                                        if not is_new:
-                                            modelo.descricao = modelo_data['descricao']
-                                            modelo.subcategoria = subcategoria
-                                            modelo.save()
-                                        
-                                        if is_new:
-                                            created += 1
-                                        else:
-                                            updated += 1
-                            except json.JSONDecodeError as e:
-                                results['modelos'] = {'error': str(e)}
-                                break
-                    
-                    if 'modelos' not in results:
-                        results['modelos'] = {
-                            'created': created, 
-                            'updated': updated
-                        }
-            
-            # Gerar Instrumentos
-            if 'instrumentos' in tables:
-                # Verificar se existem modelos
-                if not Modelo.objects.exists():
-                    messages.error(request, 'Não existem modelos. Por favor, gere modelos primeiro.')
-                    results['instrumentos'] = {'error': 'Não existem modelos'}
-                else:
-                    created = 0
-                    updated = 0
-                    
-                    # Pegar todos os modelos disponíveis
-                    modelos = list(Modelo.objects.all())
-                    
-                    # Gerar código sequencial
-                    ultimo_codigo = Instrumento.objects.order_by('-codigo').first()
-                    if ultimo_codigo:
-                        ultimo_numero = int(ultimo_codigo.codigo.replace('INST', ''))
-                    else:
-                        ultimo_numero = 0
-                    
-                    for _ in range(quantidade):
-                        # Escolher um modelo aleatório
-                        modelo = random.choice(modelos)
-                        
-                        prompt = f"""
-                        Gere um único instrumento musical do modelo '{modelo.nome}' da marca '{modelo.marca.nome}' no formato JSON.
-                        Use este formato exato:
-                        {{
-                            "numero_serie": "ABC123456",
-                            "ano_fabricacao": 2020,
-                            "preco": 1999.99,
-                            "valor_mercado": 2100.00,
-                            "estado_conservacao": "excelente",
-                            "status": "disponivel"
-                        }}
-                        
-                        Regras:
-                        1. numero_serie: alfanumérico, único
-                        2. ano_fabricacao: entre 1950 e 2024
-                        3. preco: entre 500 e 50000
-                        4. valor_mercado: próximo ao preço
-                        5. estado_conservacao: novo, excelente, muito_bom, bom, regular ou ruim
-                        6. status: disponivel, vendido, reservado ou manutencao
-                        """
-                        
-                        instrumentos_json = generate_data(prompt, quantidade=1)
-                        try:
-                            # Limpar a resposta
-                            json_str = instrumentos_json.strip()
-                            if json_str.startswith('```json'):
-                                json_str = json_str[7:]
-                            if json_str.endswith('```'):
-                                json_str = json_str[:-3]
-                            json_str = json_str.strip()
-                            
-                            # Se for uma lista, pegar o primeiro item
-                            instrumento_data = json.loads(json_str)
-                            if isinstance(instrumento_data, list):
-                                instrumento_data = instrumento_data[0]
-                            
-                            # Gerar código sequencial
-                            ultimo_numero += 1
-                            codigo = f"INST{ultimo_numero:04d}"
-                            
-                            instrumento, is_new = Instrumento.objects.get_or_create(
-                                codigo=codigo,
-                                defaults={
-                                    'modelo': modelo,
-                                    'numero_serie': instrumento_data['numero_serie'],
-                                    'ano_fabricacao': instrumento_data['ano_fabricacao'],
-                                    'preco': instrumento_data['preco'],
-                                    'valor_mercado': instrumento_data.get('valor_mercado'),
-                                    'estado_conservacao': instrumento_data['estado_conservacao'],
-                                    'status': instrumento_data['status']
-                                }
-                            )
-                            
-                            if not is_new:
-                                # Atualizar dados existentes
-                                instrumento.modelo = modelo
-                                instrumento.numero_serie = instrumento_data['numero_serie']
-                                instrumento.ano_fabricacao = instrumento_data['ano_fabricacao']
-                                instrumento.preco = instrumento_data['preco']
-                                instrumento.valor_mercado = instrumento_data.get('valor_mercado')
-                                instrumento.estado_conservacao = instrumento_data['estado_conservacao']
-                                instrumento.status = instrumento_data['status']
-                                instrumento.save()
-                            
-                            if is_new:
-                                created += 1
-                            else:
-                                updated += 1
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Erro ao decodificar JSON: {str(e)}")
-                            logger.error(f"JSON recebido: {instrumentos_json}")
-                            results['instrumentos'] = {'error': f"Erro ao decodificar JSON: {str(e)}"}
-                            break
-                        except Exception as e:
-                            logger.error(f"Erro ao gerar instrumento: {str(e)}")
-                            logger.error(f"JSON recebido: {instrumentos_json}")
-                            results['instrumentos'] = {'error': f"Erro ao gerar instrumento: {str(e)}"}
-                            break
-                    
-                    if 'instrumentos' not in results:
-                        results['instrumentos'] = {'created': created, 'updated': updated}
-            
-            # Mensagens de sucesso
-            total_created = sum(r.get('created', 0) for r in results.values() if isinstance(r, dict) and 'error' not in r)
-            total_updated = sum(r.get('updated', 0) for r in results.values() if isinstance(r, dict) and 'error' not in r)
-            
-            if total_created:
-                messages.success(request, f'{total_created} registros criados com sucesso!')
-            if total_updated:
-                messages.info(request, f'{total_updated} registros atualizados!')
-            
-        except Exception as e:
-            logger.error(f"Erro ao gerar dados: {str(e)}")
-            messages.error(request, f'Erro ao gerar dados: {str(e)}')
+    geracao = None
+    if request.GET.get('geracao', '').isdigit():
+        geracao = GeracaoIA.objects.filter(pk=request.GET['geracao']).first()
     
-    return render(request, 'instrumentos/ai_populate.html', {'results': results})
+    return render(request, 'instrumentos/ai_populate.html', {
+        'geracao': geracao,
+        'results': geracao.resultados if geracao and geracao.finalizada else {},
+    })
+
+def ai_populate_status(request, pk):
+    """Status e progresso de uma geração, consultado periodicamente pela página de IA"""
+    geracao = get_object_or_404(GeracaoIA, pk=pk)
+    return JsonResponse(geracao.as_dict())
@@ -56,12 +56,78 @@ LOGGING = {
             'handlers': ['console', 'file'],
             'level': 'DEBUG',
         },
+        # O Pillow registra cada tag lida das imagens em DEBUG
+        'PIL': {
+            'level': 'INFO',
+        },
     },
 }
 
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 print(f"Loaded OPENAI_API_KEY from .env: {OPENAI_API_KEY[:6]}...{OPENAI_API_KEY[-4:] if OPENAI_API_KEY else 'None'}")
+# Endpoint alternativo compatível com a API da OpenAI (proxy, servidor local de testes)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Geração de dados com IA (ai_populate)
+# Chamadas simultâneas, limite de requisições por minuto, tentativas por chamada
+# e espera base (segundos) do backoff exponencial entre tentativas.
+AI_CONCURRENCY = int(os.getenv('AI_CONCURRENCY', 4))
+AI_REQUESTS_PER_MINUTE = int(os.getenv('AI_REQUESTS_PER_MINUTE', 60))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 3))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', 1.0))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', 60))
+# Chunks de generate_data: tamanho inicial e limites do ajuste automático
+AI_CHUNK_SIZE = int(os.getenv('AI_CHUNK_SIZE', 10))
+AI_CHUNK_MIN = int(os.getenv('AI_CHUNK_MIN', 2))
+AI_CHUNK_MAX = int(os.getenv('AI_CHUNK_MAX', 40))
+# Lê as respostas em stream e grava cada item assim que chega
+AI_STREAMING = os.getenv('AI_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# Instrumentos pedidos em uma única chamada (os inválidos são pedidos de novo em lotes menores)
+AI_INSTRUMENTOS_POR_LOTE = int(os.getenv('AI_INSTRUMENTOS_POR_LOTE', 20))
+# Fila de gerações (comando processar_geracoes): segundos sem heartbeat para
+# considerar o worker interrompido e número máximo de vezes que uma geração é retomada
+AI_JOB_STALE_SECONDS = int(os.getenv('AI_JOB_STALE_SECONDS', 600))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', 3))
+# Cache em disco das respostas já validadas: validade (segundos) e tamanho máximo
+# do diretório (bytes), acima do qual as entradas menos usadas são removidas
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+AI_CACHE_DIR = os.getenv('AI_CACHE_DIR', str(BASE_DIR / 'cache' / 'ai'))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 7 * 24 * 3600))
+AI_CACHE_MAX_BYTES = int(os.getenv('AI_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Descoberta de logotipos (logos.py): verificações simultâneas, prazo total e
+# timeout de cada requisição (segundos), validade do cache por domínio e
+# quanto da página inicial é lido à procura de candidatos (bytes)
+LOGO_CONCORRENCIA = int(os.getenv('LOGO_CONCORRENCIA', 8))
+LOGO_PRAZO = float(os.getenv('LOGO_PRAZO', 10))
+LOGO_TIMEOUT = float(os.getenv('LOGO_TIMEOUT', 3))
+LOGO_CACHE_TTL = int(os.getenv('LOGO_CACHE_TTL', 24 * 3600))
+LOGO_HTML_MAX_BYTES = int(os.getenv('LOGO_HTML_MAX_BYTES', 1024 * 1024))
+LOGO_CLEARBIT_URL = os.getenv('LOGO_CLEARBIT_URL', 'https://logo.clearbit.com/{dominio}')
+# Logos baixados: tamanho máximo do download (bytes) e do lado maior da imagem gravada (pixels)
+LOGO_MAX_BYTES = int(os.getenv('LOGO_MAX_BYTES', 5 * 1024 * 1024))
+LOGO_TAMANHO_MAXIMO = int(os.getenv('LOGO_TAMANHO_MAXIMO', 512))
+
+# Variantes responsivas das imagens (imagens.py): larguras geradas e threads
+# do pool de geração (0 gera na hora, na thread do upload)
+IMAGEM_LARGURAS = [int(largura) for largura in os.getenv('IMAGEM_LARGURAS', '160,320,640,1280').split(',')]
+IMAGEM_WORKERS = int(os.getenv('IMAGEM_WORKERS', 2))
+# Normalização dos uploads: lado maior em pixels e qualidade do JPEG gravado
+IMAGEM_DIMENSAO_MAXIMA = int(os.getenv('IMAGEM_DIMENSAO_MAXIMA', 2560))
+IMAGEM_QUALIDADE = int(os.getenv('IMAGEM_QUALIDADE', 85))
+# Idade mínima (segundos) de um arquivo sem referências para `coletar_midia` removê-lo
+MIDIA_CARENCIA = int(os.getenv('MIDIA_CARENCIA', 3600))
+
+# Upload de fotos em pedaços (uploads.py): arquivos parciais, limites,
+# uploads abertos por usuário, horas sem atividade até um upload ser
+# considerado abandonado e threads que normalizam as fotos na conclusão
+UPLOAD_PARCIAL_DIR = Path(os.getenv('UPLOAD_PARCIAL_DIR', BASE_DIR / 'cache' / 'uploads'))
+UPLOAD_TAMANHO_MAXIMO = int(os.getenv('UPLOAD_TAMANHO_MAXIMO', 50 * 1024 * 1024))
+UPLOAD_PEDACO_MAXIMO = int(os.getenv('UPLOAD_PEDACO_MAXIMO', 8 * 1024 * 1024))
+UPLOAD_SESSOES_POR_USUARIO = int(os.getenv('UPLOAD_SESSOES_POR_USUARIO', 20))
+UPLOAD_ABANDONO_HORAS = int(os.getenv('UPLOAD_ABANDONO_HORAS', 24))
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', '144.202.29.245']
 
@@ -86,6 +152,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'instrumentos.orcamento.OrcamentoConsultasMiddleware',
 ]
 
 ROOT_URLCONF = 'musical_instruments.urls'
@@ -163,6 +230,22 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Dashboard
+# Tempo máximo (em segundos) que as estatísticas do dashboard ficam em cache.
+# O cache também é invalidado sempre que instrumentos ou o catálogo mudam.
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', 300))
+# Bloco de fotos da página do instrumento (invalidado quando as fotos mudam)
+FOTOS_CACHE_TIMEOUT = int(os.getenv('FOTOS_CACHE_TIMEOUT', 24 * 3600))
+# APIs de lookup da taxonomia: corpo de cada versão no cache do servidor e
+# max-age enviado ao navegador (0 = sempre revalida com a ETag)
+LOOKUP_CACHE_TIMEOUT = int(os.getenv('LOOKUP_CACHE_TIMEOUT', 24 * 3600))
+LOOKUP_MAX_AGE = int(os.getenv('LOOKUP_MAX_AGE', 0))
+# Orçamento de consultas SQL por rota (instrumentos/orcamento.py): mede cada
+# request (por padrão só com DEBUG) e, ao estourar, registra um aviso ('aviso')
+# ou levanta erro ('erro')
+ORCAMENTO_CONSULTAS = os.getenv('ORCAMENTO_CONSULTAS', str(DEBUG)).lower() in ('1', 'true', 'sim')
+ORCAMENTO_CONSULTAS_ESTOURO = os.getenv('ORCAMENTO_CONSULTAS_ESTOURO', 'aviso')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 